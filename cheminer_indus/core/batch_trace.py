@@ -0,0 +1,403 @@
+# -*- coding: utf-8 -*-
+# cheminer_indus/core/batch_trace.py
+
+"""
+Cheminement en masse des PV non conformes (campagne annuelle).
+
+Déroulement
+-----------
+1. le graphe est écrit en instantané disque (`graph_snapshot`) : chaque
+   processus du pool le mappe en lecture seule, sans reconstruction ;
+2. tous les PV sont accrochés au réseau en une passe (`SegmentIndex`) ;
+3. les nœuds de départ distincts sont répartis par paquets sur le pool
+   (processus Python lancés avec l'interpréteur trouvé à côté de QGIS ;
+   calcul local si aucun n'est disponible) ;
+4. les ensembles d'arêtes identiques (PV d'une même antenne) ne sont
+   écrits qu'une fois.
+
+Sorties (CSV ';', UTF-8)
+------------------------
+<base>_pv.csv        : un PV par ligne → ensemble, exutoire(s), longueur ;
+                       colonnes x / y : chargeable comme couche de points
+<base>_ensembles.csv : un ensemble d'arêtes par ligne → FIDs canal / fossé,
+                       industriels et PV rencontrés
+
+Lancement et relecture dans QGIS : onglet PV Conformité (`batch_layers`,
+`load_edge_sets`, `select_edge_set`). Utilisable hors de l'interface :
+    python -m cheminer_indus.core.batch_trace --canal <source> --pv <source> --out <base>
+"""
+
+from __future__ import annotations
+
+import csv
+import hashlib
+import multiprocessing
+import os
+import sys
+import tempfile
+from array import array
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from .graph import LAYER_CANAL, NetworkGraph, get_graph, merge_alias
+from .graph_snapshot import close_snapshot, load_snapshot, save_snapshot
+from .segment_index import get_segment_index
+
+PV_SUFFIX = "_pv.csv"
+EDGESET_SUFFIX = "_ensembles.csv"
+PV_COLUMNS = ("pv_id", "x", "y", "couche", "fid", "distance", "depart",
+              "ensemble", "exutoire", "longueur", "nb_industriels", "nb_pv")
+EDGESET_COLUMNS = ("ensemble", "longueur", "exutoire", "canal_fids", "fosse_fids",
+                   "industriels", "pv")
+
+
+def _as_str(v) -> str:
+    if v is None:
+        return ""
+    return str(v)
+
+
+# ---------------------------------------------------------------------- #
+# Processus de calcul
+# ---------------------------------------------------------------------- #
+
+_WORKER_GRAPH: Optional[NetworkGraph] = None
+
+
+def _init_worker(path: str) -> None:
+    global _WORKER_GRAPH
+    _WORKER_GRAPH = load_snapshot(path)
+    if _WORKER_GRAPH is None:
+        raise RuntimeError("Instantané illisible : {}".format(path))
+
+
+def _release_worker() -> None:
+    """Ferme l'instantané du calcul local (le fichier peut alors être supprimé)."""
+    global _WORKER_GRAPH
+    if _WORKER_GRAPH is not None:
+        close_snapshot(_WORKER_GRAPH)
+        _WORKER_GRAPH = None
+
+
+def _is_end(g: NetworkGraph, n: int, downstream: bool) -> bool:
+    """Exutoire (aval) ou tête de réseau (amont) : aucun tronçon pour continuer."""
+    if downstream:
+        return not any(g.edge_dst[e] >= 0 for e in g.out_edges(n))
+    return not any(g.edge_src[e] >= 0 for e in g.in_edges(n))
+
+
+def _trace_chunk(task: Tuple[List[int], bool]) -> List[Tuple[int, bytes, List[int]]]:
+    """Parcours d'un paquet de nœuds : (nœud, arêtes triées 'i', extrémités)."""
+    nodes, downstream = task
+    g = _WORKER_GRAPH
+    out = []
+    for n in nodes:
+        edges, reached = g.walk([n], downstream)
+        ends = [m for m in reached if _is_end(g, m, downstream)]
+        out.append((n, array("i", sorted(edges)).tobytes(), ends))
+    return out
+
+
+def _python_executable() -> Optional[str]:
+    """
+    Interpréteur des processus du pool. Dans QGIS, `sys.executable` est
+    l'exécutable de QGIS : on cherche alors le Python de son installation.
+    None si introuvable (calcul local).
+    """
+    exe = sys.executable or ""
+    if os.path.basename(exe).lower().startswith("python"):
+        return exe
+    names = ("python.exe", "python3.exe") if os.name == "nt" else ("python3", "python")
+    for folder in (sys.exec_prefix, os.path.join(sys.exec_prefix, "bin")):
+        for name in names:
+            candidate = os.path.join(folder, name)
+            if os.path.isfile(candidate):
+                return candidate
+    return None
+
+
+def _pool_context(exe: str):
+    """Contexte multiprocessing des processus lancés avec l'interpréteur `exe`."""
+    if exe == sys.executable:
+        return None
+    ctx = multiprocessing.get_context("spawn")
+    ctx.set_executable(exe)
+    return ctx
+
+
+def _run_chunks(path: str, chunks: List[List[int]], downstream: bool,
+                workers: int, progress: Optional[Callable[[int, int], None]]):
+    tasks = [(c, downstream) for c in chunks]
+    total = len(tasks)
+    exe = _python_executable() if workers > 1 and total > 1 else None
+    if exe:
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(path,), mp_context=_pool_context(exe)) as pool:
+                results = []
+                for i, res in enumerate(pool.map(_trace_chunk, tasks), 1):
+                    results.extend(res)
+                    if progress:
+                        progress(i, total)
+                return results
+        except (OSError, BrokenProcessPool):
+            pass  # pool indisponible : calcul local
+
+    _init_worker(path)
+    try:
+        results = []
+        for i, task in enumerate(tasks, 1):
+            results.extend(_trace_chunk(task))
+            if progress:
+                progress(i, total)
+        return results
+    finally:
+        _release_worker()
+
+
+# ---------------------------------------------------------------------- #
+# Lecture des couches
+# ---------------------------------------------------------------------- #
+
+def _pv_points(pv_layer, non_conforming_only: bool) -> List[Tuple[str, float, float]]:
+    """(id, x, y) des PV ; 'id' sinon FID, filtre conforme = 'Non' si le champ existe."""
+    names = pv_layer.fields().names()
+    out = []
+    for f in pv_layer.getFeatures():
+        if non_conforming_only and "conforme" in names and f["conforme"] != "Non":
+            continue
+        if not f.hasGeometry():
+            continue
+        pt = f.geometry().centroid().asPoint()
+        pv_id = _as_str(f["id"]) if "id" in names else str(f.id())
+        out.append((pv_id, pt.x(), pt.y()))
+    return out
+
+
+# ---------------------------------------------------------------------- #
+# Campagne
+# ---------------------------------------------------------------------- #
+
+def trace_pv_batch(
+    canal_layer,
+    pv_layer,
+    out_base: str,
+    fosse_layer=None,
+    liaison_layer=None,
+    field_alias: Optional[Dict[str, Iterable[str]]] = None,
+    downstream: bool = True,
+    search_distance: float = 50.0,
+    workers: Optional[int] = None,
+    chunk_size: int = 64,
+    non_conforming_only: bool = True,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> Dict[str, int]:
+    """
+    Trace tous les PV (non conformes) de `pv_layer` et écrit les deux tables
+    `<out_base>_pv.csv` / `<out_base>_ensembles.csv`.
+
+    workers  : nombre de processus (None = nombre de cœurs, 1 = sans pool)
+    progress : rappel (paquets traités, paquets total)
+
+    Retour : {'pv', 'accroches', 'departs', 'ensembles'}
+    """
+    g = get_graph(canal_layer, fosse_layer, merge_alias(field_alias))
+    if g._pending:
+        g._build_csr()
+
+    # 1. Accrochage de tous les PV
+    pvs = _pv_points(pv_layer, non_conforming_only)
+    snaps = get_segment_index(g).nearest_many([(x, y) for _, x, y in pvs], search_distance)
+
+    starts: Dict[int, None] = {}
+    pv_start: List[int] = []
+    for snap in snaps:
+        node = -1
+        if snap is not None:
+            node = g.edge_dst[snap.edge] if downstream else g.edge_src[snap.edge]
+        pv_start.append(node)
+        if node >= 0:
+            starts.setdefault(node)
+
+    # 2. Parcours des départs distincts sur le pool
+    fd, path = tempfile.mkstemp(prefix="cheminer_batch_", suffix=".bin")
+    os.close(fd)
+    try:
+        save_snapshot(g, path)
+        nodes = list(starts)
+        chunks = [nodes[i:i + chunk_size] for i in range(0, len(nodes), chunk_size)]
+        results = _run_chunks(path, chunks, downstream, workers or os.cpu_count() or 1, progress)
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    traced: Dict[int, Tuple[array, List[int]]] = {}
+    for n, raw, ends in results:
+        edges = array("i")
+        edges.frombytes(raw)
+        traced[n] = (edges, ends)
+
+    # 3. Ensembles d'arêtes (tronçon accroché compris), dédoublonnés
+    set_ids: Dict[bytes, int] = {}
+    sets: List[Tuple[array, List[int]]] = []
+    pv_set: List[int] = []
+    for snap, node in zip(snaps, pv_start):
+        if node < 0:
+            pv_set.append(-1)
+            continue
+        edges, ends = traced[node]
+        i = bisect_left(edges, snap.edge)
+        if i == len(edges) or edges[i] != snap.edge:
+            edges = edges[:i] + array("i", [snap.edge]) + edges[i:]
+        digest = hashlib.sha1(edges.tobytes()).digest()
+        sid = set_ids.get(digest)
+        if sid is None:
+            sid = set_ids[digest] = len(sets) + 1
+            sets.append((edges, ends))
+        pv_set.append(sid)
+
+    # 4. Écriture (industriels : index des liaisons, attributs seuls)
+    from .industrials import LiaisonIndex   # qgis.core : pas dans les processus du pool
+
+    liaisons = LiaisonIndex(liaison_layer, None)
+    pv_by_edge: Dict[int, List[str]] = {}
+    for (pv_id, _, _), snap in zip(pvs, snaps):
+        if snap is not None:
+            pv_by_edge.setdefault(snap.edge, []).append(pv_id)
+
+    summaries = []
+    for edges, ends in sets:
+        nodes_on = g.node_names(n for e in edges for n in (g.edge_src[e], g.edge_dst[e]))
+        canal = [g.edge_fid[e] for e in edges if g.edge_layer[e] == LAYER_CANAL]
+        fosse = [g.edge_fid[e] for e in edges if g.edge_layer[e] != LAYER_CANAL]
+        summaries.append({
+            "longueur": round(sum(g.edge_length[e] for e in edges), 2),
+            "exutoire": "|".join(sorted(g.node_names(ends))),
+            "canal_fids": " ".join(map(str, canal)),
+            "fosse_fids": " ".join(map(str, fosse)),
+            "industriels": sorted(liaisons.indus_of_liaisons(liaisons.liaisons_of_nodes(nodes_on))),
+            "pv": [p for e in edges for p in pv_by_edge.get(e, ())],
+        })
+
+    with open(out_base + PV_SUFFIX, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f, delimiter=";")
+        w.writerow(PV_COLUMNS)
+        for (pv_id, x, y), snap, node, sid in zip(pvs, snaps, pv_start, pv_set):
+            if sid < 0:
+                w.writerow((pv_id, x, y, "", "", "", "", "", "", "", "", ""))
+                continue
+            s = summaries[sid - 1]
+            w.writerow((pv_id, x, y, snap.layer, snap.fid, round(snap.distance, 2),
+                        g.node_ids[node], sid, s["exutoire"], s["longueur"],
+                        len(s["industriels"]), len(s["pv"]) - 1))
+
+    with open(out_base + EDGESET_SUFFIX, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f, delimiter=";")
+        w.writerow(EDGESET_COLUMNS)
+        for sid, s in enumerate(summaries, 1):
+            w.writerow((sid, s["longueur"], s["exutoire"], s["canal_fids"], s["fosse_fids"],
+                        " ".join(s["industriels"]), " ".join(s["pv"])))
+
+    return {
+        "pv": len(pvs),
+        "accroches": sum(1 for s in pv_set if s > 0),
+        "departs": len(starts),
+        "ensembles": len(sets),
+    }
+
+
+# ---------------------------------------------------------------------- #
+# Relecture dans QGIS
+# ---------------------------------------------------------------------- #
+
+def load_edge_sets(out_base: str) -> Dict[int, Dict[str, object]]:
+    """ensemble → {'longueur', 'exutoire', 'canal_fids', 'fosse_fids', 'industriels', 'pv'}."""
+    out: Dict[int, Dict[str, object]] = {}
+    with open(out_base + EDGESET_SUFFIX, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f, delimiter=";"):
+            out[int(row["ensemble"])] = {
+                "longueur": float(row["longueur"]),
+                "exutoire": row["exutoire"],
+                "canal_fids": [int(v) for v in row["canal_fids"].split()],
+                "fosse_fids": [int(v) for v in row["fosse_fids"].split()],
+                "industriels": row["industriels"].split(),
+                "pv": row["pv"].split(),
+            }
+    return out
+
+
+def select_edge_set(edge_set: Dict[str, object], canal_layer, fosse_layer=None) -> None:
+    """Sélectionne dans les couches les tronçons d'un ensemble relu."""
+    canal_layer.selectByIds(edge_set["canal_fids"])
+    if fosse_layer is not None:
+        fosse_layer.selectByIds(edge_set["fosse_fids"])
+
+
+def batch_layers(out_base: str, crs_authid: str = ""):
+    """
+    Couches QGIS des résultats : PV (points x / y) et ensembles (table).
+    """
+    from qgis.core import QgsVectorLayer
+
+    def uri(path: str, extra: str) -> str:
+        return "file:///{}?delimiter=;&detectTypes=yes{}".format(
+            os.path.abspath(path).replace("\\", "/").lstrip("/"), extra)
+
+    pts = "&xField=x&yField=y" + ("&crs={}".format(crs_authid) if crs_authid else "")
+    pv = QgsVectorLayer(uri(out_base + PV_SUFFIX, pts), "Campagne PV", "delimitedtext")
+    sets = QgsVectorLayer(uri(out_base + EDGESET_SUFFIX, "&geomType=none"),
+                          "Campagne PV - ensembles", "delimitedtext")
+    return pv, sets
+
+
+# ---------------------------------------------------------------------- #
+# Ligne de commande
+# ---------------------------------------------------------------------- #
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Cheminement en masse des PV non conformes")
+    parser.add_argument("--canal", required=True, help="source de la couche canalisations")
+    parser.add_argument("--pv", required=True, help="source de la couche PV_CONFORMITE")
+    parser.add_argument("--fosse", help="source de la couche cours d'eau / fossés")
+    parser.add_argument("--liaison", help="source de la couche LIAISON_INDUS")
+    parser.add_argument("--provider", default="ogr", help="fournisseur QGIS (ogr, postgres…)")
+    parser.add_argument("--out", required=True, help="préfixe des fichiers CSV produits")
+    parser.add_argument("--amont", action="store_true", help="parcours vers l'amont")
+    parser.add_argument("--distance", type=float, default=50.0, help="rayon d'accrochage (m)")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--tous", action="store_true", help="inclure les PV conformes")
+    args = parser.parse_args(argv)
+
+    from qgis.core import QgsApplication, QgsVectorLayer
+
+    app = QgsApplication([], False)
+    app.initQgis()
+    try:
+        def layer(src: Optional[str], name: str):
+            if not src:
+                return None
+            lyr = QgsVectorLayer(src, name, args.provider)
+            if not lyr.isValid():
+                raise SystemExit("Couche invalide : {}".format(src))
+            return lyr
+
+        res = trace_pv_batch(
+            layer(args.canal, "canalisations"), layer(args.pv, "PV_CONFORMITE"), args.out,
+            fosse_layer=layer(args.fosse, "fosse"), liaison_layer=layer(args.liaison, "liaison"),
+            downstream=not args.amont, search_distance=args.distance, workers=args.workers,
+            non_conforming_only=not args.tous,
+            progress=lambda i, n: print("\r{}/{}".format(i, n), end="", flush=True),
+        )
+        print("\n{pv} PV, {accroches} accrochés, {departs} départs, {ensembles} ensembles".format(**res))
+    finally:
+        app.exitQgis()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
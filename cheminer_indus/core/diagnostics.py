@@ -1,135 +1,416 @@
 # -*- coding: utf-8 -*-
 # cheminer_indus/core/diagnostics.py
 
+"""
+Diagnostics des canalisations sélectionnées, par règles enregistrées.
+
+Chaque règle (`DiagnosticRule`) déclare :
+  - les colonnes de tronçon dont elle a besoin (nom logique → champs candidats
+    de la couche CANAL) ;
+  - les tables de nœuds qu'elle consulte (TABLES) ;
+et examine chaque tronçon sélectionné (`check_edge`) et/ou chaque nœud de la
+sélection (`check_node`).
+
+Le moteur (`Diagnostics`) réunit les besoins des règles actives, lit chaque
+couche une seule fois (attributs seuls, sans géométrie), puis évalue toutes
+les règles ensemble en un seul passage sur la sélection. Ajouter une règle
+(`register_rule`) n'ajoute pas de lecture. Sur CANAL, seules les lignes
+sélectionnées sont lues en entier ; les tables de nœuds CANAL ne lisent que
+les colonnes de nœuds sur le reste de la couche, puis les tronçons entrants
+des nœuds de la sélection.
+
+Résultat : {rubrique: [(FID entité, texte, FID associé), ...]} dans l'ordre
+d'enregistrement des règles.
+"""
+
 from __future__ import annotations
-from typing import Dict, List, Tuple
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+from qgis.core import QgsVectorLayer, QgsFeatureRequest
+
+from .graph import resolve_field
+from .topology import Z_FIELDS, _to_float
+
+Finding = Tuple[int, str, int]
+
+INVERSION_MAPPING: Dict[str, str] = {
+    "1": "Inversion EP dans EU avérée",
+    "2": "Inversion EU dans EP avérée",
+    "3": "Trop-plein EP dans EU",
+    "4": "Trop-plein EU dans EP",
+}
+
+# Tables de nœuds disponibles pour les règles
+TABLES: Dict[str, str] = {
+    "ouvrage": "idouvrage → (typreseau, FID) [OUVRAGE]",
+    "canal_in": "idnterm → tronçons entrants [CANAL] (nœuds de la sélection)",
+    "canal_out": "idnini → nombre de tronçons sortants [CANAL]",
+    "fosse_in": "idnterm → nombre de fossés entrants [FOSSE]",
+    "liaison": "id_ouvrage → [(FID, id_industriel)] [LIAISON]",
+    "indus": "ids des industriels [INDUS]",
+}
+
+
+def _to_int(v, default=-1):
+    try:
+        return int(str(v).strip())
+    except Exception:
+        return default
+
+
+def _key(v) -> str:
+    """Clé de table : valeur brute en texte (même égalité que "champ" = 'valeur')."""
+    return "" if v is None else str(v)
+
+
+def _id(v) -> str:
+    """Identifiant normalisé (liaisons / industriels) ; '' si vide ou INCONNU."""
+    s = "" if v is None else str(v).strip()
+    return "" if s.upper() in ("", "INCONNU", "NULL") else s
+
+
+# ---------------------------------------------------------------------- #
+# Règles
+# ---------------------------------------------------------------------- #
+
+class DiagnosticRule:
+    """
+    Règle de diagnostic.
+
+    key      : rubrique (clé du résultat)
+    label    : libellé affiché dans DiagnosticsDock
+    layer    : couche des entités signalées ('canal', 'liaison'…)
+    columns  : colonnes de tronçon {nom logique: champs candidats}
+    required : colonnes sans lesquelles la règle est ignorée
+    tables   : tables de nœuds consultées (clés de TABLES)
+    """
+
+    key = ""
+    label = ""
+    layer = "canal"
+    columns: Dict[str, Sequence[str]] = {}
+    required: Tuple[str, ...] = ()
+    tables: Tuple[str, ...] = ()
+
+    def check_edge(self, ctx: "DiagnosticContext", row: Dict[str, object]) -> Iterable[Finding]:
+        return ()
+
+    def check_node(self, ctx: "DiagnosticContext", node: str) -> Iterable[Finding]:
+        return ()
+
+
+RULES: List[DiagnosticRule] = []
+
+
+def register_rule(cls):
+    """Décorateur : enregistre une règle (ordre d'enregistrement = ordre des rubriques)."""
+    RULES.append(cls())
+    return cls
+
+
+_NODE_COLUMNS = {"idnini": ["idnini"], "idnterm": ["idnterm"]}
+
+
+@register_rule
+class InversionRule(DiagnosticRule):
+    key = "INVERSIONS"
+    label = "INVERSIONS"
+    columns = {"typreseau": ["typreseau"], "inversion": ["inversion"], **_NODE_COLUMNS}
+    required = ("typreseau", "idnini", "idnterm")
+    tables = ("ouvrage",)
+
+    def check_edge(self, ctx, row):
+        typ_c = (row["typreseau"] or "").strip()
+        if typ_c not in ("01", "02"):
+            return
+        code = row.get("inversion")
+        code = "" if code is None else str(code).strip()
+        for oid, pos in ((row["idnini"], "amont"), (row["idnterm"], "aval")):
+            if not oid or oid == "INCONNU":
+                continue
+            of = ctx.ouvrage.get(_key(oid))
+            if of is None:
+                continue
+            typ_o, ofid = of
 
-from qgis.core import QgsVectorLayer, QgsFeatureRequest, QgsExpression
+            # EP/EU inversés
+            direction = ""
+            if typ_c == "02" and typ_o == "01":
+                direction = "EU → EP"
+            elif typ_c == "01" and typ_o == "02":
+                direction = "EP → EU"
+            if direction:
+                # statut d’inversion via champ SQL
+                statut = INVERSION_MAPPING.get(code, "Inversion à vérifier") if code else "Inversion à vérifier"
+                yield (row["fid"], "Inversion {} ({} de l’ouvrage {}) - {}".format(
+                    direction, pos, oid, statut), ofid)
+
+
+@register_rule
+class ReductionRule(DiagnosticRule):
+    key = "REDUCTIONS"
+    label = "RÉDUCTION DE DIAMÈTRE"
+    columns = {"typreseau": ["typreseau"], "diametre": ["diametre"], **_NODE_COLUMNS}
+    required = ("diametre", "idnini")
+    tables = ("canal_in", "canal_out")
+
+    def check_edge(self, ctx, row):
+        diam_aval = _to_int(row["diametre"], -1)
+        idnini = row["idnini"]
+        if diam_aval <= 0 or not idnini or idnini == "INCONNU":
+            return
+        typ_c = (row.get("typreseau") or "").strip()
+        seuil = 50 if typ_c == "02" else 200
+
+        k = _key(idnini)
+        if ctx.canal_out.get(k, 0) != 1:
+            return
+        diams = [d for d in (_to_int(r["diametre"], -1) for r in ctx.canal_in.get(k, ())) if d > 0]
+        if diams and max(diams) - diam_aval > seuil:
+            yield (row["fid"], "Réduction de diamètre : {} → {} (seuil {} mm) sur ouvrage {}".format(
+                max(diams), diam_aval, seuil, idnini), row["fid"])
+
+
+@register_rule
+class ContrePenteRule(DiagnosticRule):
+    key = "CONTRE_PENTES"
+    label = "CONTRE-PENTE"
+    columns = dict(Z_FIELDS)
+    required = ("zamont", "zaval")
+
+    def check_edge(self, ctx, row):
+        z0, z1 = _to_float(row["zamont"]), _to_float(row["zaval"])
+        if z0 is not None and z1 is not None and z0 < z1:
+            yield (row["fid"], "Contre-pente : cote amont {:.2f} < cote aval {:.2f}".format(z0, z1), row["fid"])
+
+
+@register_rule
+class MaterialChangeRule(DiagnosticRule):
+    key = "MATERIAUX"
+    label = "CHANGEMENT DE MATÉRIAU"
+    columns = {"materiau": ["matcanass", "materiau", "materiaux", "mat_canal"], **_NODE_COLUMNS}
+    required = ("materiau", "idnini")
+    tables = ("canal_in",)
+
+    def check_edge(self, ctx, row):
+        mat = (str(row["materiau"] or "")).strip()
+        idnini = row["idnini"]
+        if not mat or not idnini or idnini == "INCONNU":
+            return
+        amont = {str(r["materiau"] or "").strip() for r in ctx.canal_in.get(_key(idnini), ())}
+        amont.discard("")
+        if amont and mat not in amont:
+            yield (row["fid"], "Changement de matériau : {} → {} sur ouvrage {}".format(
+                " / ".join(sorted(amont)), mat, idnini), row["fid"])
+
+
+@register_rule
+class OpenChannelRule(DiagnosticRule):
+    key = "FOSSE_CANAL"
+    label = "PASSAGE FOSSÉ → CANALISATION"
+    columns = dict(_NODE_COLUMNS)
+    required = ("idnini",)
+    tables = ("fosse_in",)
+
+    def check_edge(self, ctx, row):
+        idnini = row["idnini"]
+        if not idnini or idnini == "INCONNU":
+            return
+        n = ctx.fosse_in.get(_key(idnini), 0)
+        if n:
+            yield (row["fid"], "Passage fossé → canalisation sur ouvrage {} ({} fossé(s) entrant(s))".format(
+                idnini, n), row["fid"])
+
+
+@register_rule
+class OverflowRule(DiagnosticRule):
+    key = "DEVERSEMENTS"
+    label = "DÉVERSEMENTS (codes 5–8)"
+    columns = {"inversion": ["inversion"]}
+    required = ("inversion",)
+
+    def check_edge(self, ctx, row):
+        code = _to_int(row["inversion"], -1)
+        if 5 <= code <= 8:
+            yield (row["fid"], "Déversement signalé (code inversion {})".format(code), row["fid"])
+
+
+@register_rule
+class UnconnectedIndustrialRule(DiagnosticRule):
+    key = "INDUS_NON_RACCORDES"
+    label = "INDUSTRIEL NON RACCORDÉ"
+    layer = "liaison"
+    columns = dict(_NODE_COLUMNS)
+    tables = ("liaison", "indus")
+
+    def check_node(self, ctx, node):
+        for lid, ind in ctx.liaison.get(_id(node), ()):
+            if not ind:
+                yield (lid, "Liaison {} sur ouvrage {} : industriel non renseigné".format(lid, node), lid)
+            elif ctx.indus is not None and ind not in ctx.indus:
+                yield (lid, "Liaison {} sur ouvrage {} : industriel {} absent de INDUS".format(
+                    lid, node, ind), lid)
+
+
+# ---------------------------------------------------------------------- #
+# Moteur
+# ---------------------------------------------------------------------- #
+
+class DiagnosticContext:
+    """Tables de nœuds chargées pour un passage (vides si non demandées)."""
+
+    def __init__(self):
+        self.ouvrage: Dict[str, Tuple[str, int]] = {}
+        self.canal_in: Dict[str, List[Dict[str, object]]] = {}
+        self.canal_out: Dict[str, int] = {}
+        self.fosse_in: Dict[str, int] = {}
+        self.liaison: Dict[str, List[Tuple[int, str]]] = {}
+        self.indus: Optional[Set[str]] = None
 
 
 class Diagnostics:
     """
-    Deux rubriques :
-    - INVERSIONS EU/EP
-    - RÉDUCTION DE DIAMÈTRE
-    Analyse uniquement les canalisations sélectionnées.
+    Moteur de règles (voir RULES) sur les canalisations sélectionnées.
+
+    Couches facultatives : fosse (passages fossé → canalisation), liaison /
+    indus (industriels non raccordés) ; une règle dont la couche ou les
+    champs manquent est ignorée.
     """
 
-    def __init__(self, canal_layer: QgsVectorLayer, ouvr_layer: QgsVectorLayer):
+    def __init__(self, canal_layer: QgsVectorLayer, ouvr_layer: QgsVectorLayer,
+                 fosse_layer: Optional[QgsVectorLayer] = None,
+                 liaison_layer: Optional[QgsVectorLayer] = None,
+                 indus_layer: Optional[QgsVectorLayer] = None,
+                 rules: Optional[Sequence[DiagnosticRule]] = None):
         self.canal = canal_layer
         self.ouvr = ouvr_layer
+        self.fosse = fosse_layer
+        self.liaison = liaison_layer
+        self.indus = indus_layer
+        self.rules = list(RULES if rules is None else rules)
+
+    # ------------------------------------------------------------------
+    # Préparation
+    # ------------------------------------------------------------------
+    def _layer_for_table(self, table: str):
+        return {"ouvrage": self.ouvr, "canal_in": self.canal, "canal_out": self.canal,
+                "fosse_in": self.fosse, "liaison": self.liaison, "indus": self.indus}[table]
 
-    def run_selected_only(self) -> Dict[str, List[Tuple[int, str, int]]]:
-        inversions = []
-        reductions = []
+    def _active(self, names: Sequence[str]) -> Tuple[List[DiagnosticRule], Dict[str, str]]:
+        """Règles applicables et champs résolus {nom logique: champ CANAL}."""
+        fields: Dict[str, str] = {}
+        active: List[DiagnosticRule] = []
+        for rule in self.rules:
+            resolved = {k: resolve_field(names, cands) for k, cands in rule.columns.items()}
+            if any(resolved.get(k) is None for k in rule.required):
+                continue
+            needed = [t for t in rule.tables if t != "indus"]   # INDUS facultatif
+            if any(self._layer_for_table(t) is None for t in needed):
+                continue
+            active.append(rule)
+            fields.update({k: f for k, f in resolved.items() if f})
+        return active, fields
 
+    @staticmethod
+    def _read(layer, attrs: List[str], fids: Optional[Iterable[int]] = None) -> Iterator:
+        req = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry)
+        req.setSubsetOfAttributes(attrs, layer.fields())
+        if fids is not None:
+            req.setFilterFids(list(fids))
+        return iter(layer.getFeatures(req))
+
+    def _load_canal_tables(self, ctx: DiagnosticContext, tables: Set[str],
+                           fields: Dict[str, str], rows: List[Dict[str, object]]) -> None:
+        """
+        Tables de nœuds CANAL : `canal_out` sur toute la couche, `canal_in`
+        pour les nœuds de la sélection (`rows`). Le reste de la couche n'est
+        lu que sur ses colonnes de nœuds.
+        """
+        keep_in = "canal_in" in tables and "idnterm" in fields
+        keep_out = "canal_out" in tables and "idnini" in fields
+        if not keep_in and not keep_out:
+            return
+        nodes = {_key(r[n]) for r in rows for n in ("idnini", "idnterm") if r.get(n) is not None}
+        by_fid = {r["fid"]: r for r in rows}
+        incoming: Dict[str, List[int]] = {}
+        attrs = sorted({fields[n] for n, keep in (("idnini", keep_out), ("idnterm", keep_in)) if keep})
+        for f in self._read(self.canal, attrs):
+            if keep_out and f[fields["idnini"]] is not None:
+                k = _key(f[fields["idnini"]])
+                ctx.canal_out[k] = ctx.canal_out.get(k, 0) + 1
+            if keep_in and f[fields["idnterm"]] is not None:
+                k = _key(f[fields["idnterm"]])
+                if k in nodes:
+                    incoming.setdefault(k, []).append(f.id())
+        if not incoming:
+            return
+        missing = {fid for fids in incoming.values() for fid in fids if fid not in by_fid}
+        if missing:
+            for f in self._read(self.canal, sorted(set(fields.values())), missing):
+                by_fid[f.id()] = self._row(f, fields)
+        for k, fids in incoming.items():
+            ctx.canal_in[k] = [by_fid[fid] for fid in fids if fid in by_fid]
+
+    @staticmethod
+    def _row(f, fields: Dict[str, str]) -> Dict[str, object]:
+        row: Dict[str, object] = {k: f[name] for k, name in fields.items()}
+        row["fid"] = f.id()
+        return row
+
+    def _load_tables(self, ctx: DiagnosticContext, tables: Set[str]) -> None:
+        if "ouvrage" in tables:
+            for of in self._read(self.ouvr, ["idouvrage", "typreseau"]):
+                # premier ouvrage de l'id (comme une requête "idouvrage" = '...')
+                ctx.ouvrage.setdefault(_key(of["idouvrage"]), ((of["typreseau"] or "").strip(), of.id()))
+        if "fosse_in" in tables and self.fosse is not None:
+            for f in self._read(self.fosse, ["idnterm"]):
+                if f["idnterm"] is not None:
+                    k = _key(f["idnterm"])
+                    ctx.fosse_in[k] = ctx.fosse_in.get(k, 0) + 1
+        if "liaison" in tables and self.liaison is not None:
+            for f in self._read(self.liaison, ["id_ouvrage", "id_industriel"]):
+                node = _id(f["id_ouvrage"])
+                if node:
+                    ctx.liaison.setdefault(node, []).append((f.id(), _id(f["id_industriel"])))
+        if "indus" in tables and self.indus is not None and "id" in self.indus.fields().names():
+            ctx.indus = {i for i in (_id(f["id"]) for f in self._read(self.indus, ["id"])) if i}
+
+    # ------------------------------------------------------------------
+    # Diagnostic
+    # ------------------------------------------------------------------
+    def run_selected_only(self) -> Dict[str, List[Finding]]:
+        results: Dict[str, List[Finding]] = {r.key: [] for r in self.rules}
         if not self.canal or not self.ouvr:
-            return {"INVERSIONS": inversions, "REDUCTIONS": reductions}
+            return results
 
         sel_ids = self.canal.selectedFeatureIds()
         if not sel_ids:
-            return {"INVERSIONS": inversions, "REDUCTIONS": reductions}
-
-        has_inversion_field = "inversion" in self.canal.fields().names()
-
-        inversion_mapping = {
-            "1": "Inversion EP dans EU avérée",
-            "2": "Inversion EU dans EP avérée",
-            "3": "Trop-plein EP dans EU",
-            "4": "Trop-plein EU dans EP",
-        }
-
-        req = QgsFeatureRequest().setFilterFids(sel_ids)
-
-        for f in self.canal.getFeatures(req):
-            typ_c = (f["typreseau"] or "").strip()
-            idnini = f["idnini"]
-            idnterm = f["idnterm"]
-
-            # ------------------------------------------------------
-            # 1) INVERSIONS
-            # ------------------------------------------------------
-            for oid, pos in ((idnini, "amont"), (idnterm, "aval")):
-                if not oid or oid == "INCONNU":
-                    continue
-
-                safe_oid = str(oid).replace("'", "''")
-                expr = QgsExpression("\"idouvrage\" = '{}'".format(safe_oid))
-
-                of = next(self.ouvr.getFeatures(QgsFeatureRequest(expr)), None)
-                if not of:
-                    continue
-
-                typ_o = (of["typreseau"] or "").strip()
-
-                # EP/EU inversés
-                if typ_c in ("01", "02") and typ_o in ("01", "02") and typ_c != typ_o:
-
-                    direction = ""
-                    if typ_c == "02" and typ_o == "01":
-                        direction = "EU → EP"
-                    elif typ_c == "01" and typ_o == "02":
-                        direction = "EP → EU"
-
-                    if direction:
-                        # statut d’inversion via champ SQL
-                        statut = "Inversion à vérifier"
-                        if has_inversion_field:
-                            try:
-                                code = f["inversion"]
-                                code = "" if code is None else str(code).strip()
-                                if code:
-                                    statut = inversion_mapping.get(code, "Inversion à vérifier")
-                            except Exception:
-                                pass
-
-                        info_txt = "Inversion {} ({} de l’ouvrage {}) - {}".format(
-                            direction, pos, oid, statut
-                        )
-
-                        inversions.append((f.id(), info_txt, of.id()))
-
-            # ------------------------------------------------------
-            # 2) REDUCTION DE DIAMÈTRE
-            # ------------------------------------------------------
-            def _to_int(v, default=-1):
-                try:
-                    return int(str(v).strip())
-                except Exception:
-                    return default
-
-            diam_aval = _to_int(f["diametre"], -1)
-            if diam_aval <= 0:
-                continue
+            return results
+
+        rules, fields = self._active(self.canal.fields().names())
+        if not rules:
+            return results
+        tables = {t for r in rules for t in r.tables}
+        ctx = DiagnosticContext()
+
+        # CANAL : lignes de la sélection seules, puis tables de nœuds si demandées
+        rows = [self._row(f, fields) for f in self._read(self.canal, sorted(set(fields.values())), sel_ids)]
+        self._load_canal_tables(ctx, tables, fields, rows)
+        self._load_tables(ctx, tables)
+
+        # Un passage : toutes les règles, tronçon par tronçon puis nœud par nœud
+        edge_rules = [r for r in rules if type(r).check_edge is not DiagnosticRule.check_edge]
+        node_rules = [r for r in rules if type(r).check_node is not DiagnosticRule.check_node]
+        seen: Set[str] = set()
+        for row in rows:
+            for rule in edge_rules:
+                results[rule.key].extend(rule.check_edge(ctx, row))
+            if node_rules:
+                for name in ("idnini", "idnterm"):
+                    node = _id(row.get(name))
+                    if node and node not in seen:
+                        seen.add(node)
+                        for rule in node_rules:
+                            results[rule.key].extend(rule.check_node(ctx, node))
 
-            typ_for_threshold = typ_c if typ_c in ("01", "02") else "01"
-            seuil = 50 if typ_for_threshold == "02" else 200
-
-            if idnini and idnini != "INCONNU":
-                safe_ini = str(idnini).replace("'", "''")
-
-                expr_in = QgsExpression("\"idnterm\" = '{}'".format(safe_ini))
-                diam_in_list = []
-                in_count = 0
-
-                for fin in self.canal.getFeatures(QgsFeatureRequest(expr_in)):
-                    d = _to_int(fin["diametre"], -1)
-                    if d > 0:
-                        diam_in_list.append(d)
-                    in_count += 1
-
-                if in_count >= 1:
-                    expr_out = QgsExpression("\"idnini\" = '{}'".format(safe_ini))
-                    out_count = sum(1 for _ in self.canal.getFeatures(QgsFeatureRequest(expr_out)))
-
-                    if out_count == 1 and diam_in_list:
-                        dmax = max(diam_in_list)
-                        if dmax - diam_aval > seuil:
-                            info_red = (
-                                "Réduction de diamètre : {} → {} (seuil {} mm) sur ouvrage {}".format(
-                                    dmax, diam_aval, seuil, idnini
-                                )
-                            )
-                            reductions.append((f.id(), info_red, f.id()))
-
-        return {"INVERSIONS": inversions, "REDUCTIONS": reductions}
+        return results
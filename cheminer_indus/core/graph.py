@@ -0,0 +1,1058 @@
+# -*- coding: utf-8 -*-
+# cheminer_indus/core/graph.py
+
+"""
+Graphe topologique compact du réseau (canalisations + fossés).
+
+Les deux couches linéaires sont lues UNE seule fois (attributs uniquement),
+les identifiants de nœuds (`idnini` / `idnterm`) sont internés en entiers et
+l'adjacence est rangée en tableaux de type CSR (aval et amont).
+Tous les parcours se font ensuite en mémoire, sans requête au fournisseur.
+
+Le graphe se tient à jour via les signaux d'édition des couches
+(ajout / suppression / géométrie / attribut) : seules les arêtes concernées
+sont modifiées, l'adjacence CSR étant recompactée en mémoire de temps en temps.
+
+Les imports QGIS sont faits à la construction uniquement : le module reste
+utilisable hors QGIS sur un graphe déjà construit.
+"""
+
+from __future__ import annotations
+
+import copy
+import heapq
+from array import array
+from collections import deque
+from itertools import chain, count
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Set, Tuple, Union
+
+INCONNU = "INCONNU"
+
+_GRAPH_UIDS = count(1)
+
+LAYER_CANAL = 0
+LAYER_FOSSE = 1
+LAYER_NAMES = ("canal", "fosse")
+
+# Champs alternatifs (même convention que NetworkTracer / MainDock)
+DEFAULT_ALIAS: Dict[str, List[str]] = {
+    "cat": ["contcanass", "categorie", "cat_reseau"],
+    "func": ["fonccanass", "fonction", "function"],
+    "type": ["typreseau", "type_reseau"],
+    "len": ["l_longcana_reelle", "longueur", "length"],
+    "diam": ["diametre", "diamnominal", "diametre_nominal"],
+    "commune": ["commune", "code_insee", "insee"],
+}
+
+# Attributs codés (code 0 = valeur absente → ne bloque pas les filtres)
+CODED_KEYS = ("cat", "func", "type", "commune")
+
+# Attributs numériques lus en plus de la longueur
+NUMERIC_KEYS = ("len", "diam")
+
+# Tableaux par arête (même ordre dans l'instantané disque)
+EDGE_ARRAYS = ("edge_layer", "edge_fid", "edge_src", "edge_dst", "edge_length", "edge_diam")
+
+
+def _norm(v) -> str:
+    """Valeur d'attribut → texte nettoyé ('' pour None / NULL)."""
+    if v is None:
+        return ""
+    try:
+        if v.isNull():
+            return ""
+    except AttributeError:
+        pass
+    return str(v).strip()
+
+
+def resolve_field(names: Iterable[str], candidates: Iterable[str]) -> Optional[str]:
+    """Premier nom de champ existant parmi les candidats."""
+    names = set(names)
+    for cand in candidates or []:
+        if cand in names:
+            return cand
+    return None
+
+
+def merge_alias(field_alias: Optional[Dict[str, Iterable[str]]]) -> Dict[str, List[str]]:
+    alias = {k: list(v) for k, v in DEFAULT_ALIAS.items()}
+    if field_alias:
+        for k, v in field_alias.items():
+            if v:
+                alias[k] = list(v)
+    return alias
+
+
+class PathResult(NamedTuple):
+    """Résultat de `NetworkGraph.path_between`."""
+    edges: List[int]      # arêtes situées sur au moins un chemin source → cible
+    nodes: List[int]      # nœuds de ces chemins
+    shortest: List[int]   # arêtes du plus court chemin (ordre amont → aval)
+    length: float         # poids du plus court chemin (-1 si aucun chemin)
+
+
+class NetworkGraph:
+    """
+    Graphe unifié canal + fossé, indexé par entiers.
+
+    Nœuds
+    -----
+    node_ids   : List[str]        identifiant texte de chaque nœud
+    node_index : Dict[str, int]   identifiant texte → indice
+
+    Arêtes (tableaux parallèles, une entrée par tronçon)
+    ----------------------------------------------------
+    edge_layer  : LAYER_CANAL / LAYER_FOSSE
+    edge_fid    : FID QGIS du tronçon
+    edge_src    : indice du nœud amont (idnini), -1 si vide
+    edge_dst    : indice du nœud aval (idnterm), -1 si vide
+    edge_length : longueur (champ 'len', sinon géométrie)
+    edge_diam   : diamètre en mm (champ 'diam', 0 si absent)
+    edge_codes  : {'cat'|'func'|'type'|'commune': codes}, table de valeurs dans `code_values`
+
+    Adjacence CSR
+    -------------
+    out_offsets / out_index : arêtes sortantes du nœud n =
+        out_index[out_offsets[n]:out_offsets[n + 1]]
+    in_offsets / in_index   : idem pour les arêtes entrantes.
+
+    Les tronçons dont une extrémité vaut 'INCONNU' sont exclus du graphe
+    et mémorisés dans `unknown_edges` (couche, fid).
+
+    Mises à jour incrémentales
+    --------------------------
+    Une arête supprimée est marquée dans `edge_dead` (les indices d'arêtes
+    restent stables) ; une arête ajoutée est rangée en fin de tableaux et
+    référencée dans une adjacence complémentaire jusqu'au prochain
+    recompactage. `version` augmente à chaque modification.
+    """
+
+    def __init__(self):
+        self.canal_layer = None
+        self.fosse_layer = None
+        self.alias: Dict[str, List[str]] = merge_alias(None)
+
+        self.node_ids: List[str] = []
+        self.node_index: Dict[str, int] = {}
+
+        self.edge_layer = array("B")
+        self.edge_fid = array("q")
+        self.edge_src = array("i")
+        self.edge_dst = array("i")
+        self.edge_length = array("d")
+        self.edge_diam = array("f")
+        self.edge_codes: Dict[str, array] = {k: array("H") for k in CODED_KEYS}
+        self.code_values: Dict[str, List[str]] = {k: [""] for k in CODED_KEYS}
+        self._code_index: Dict[str, Dict[str, int]] = {k: {"": 0} for k in CODED_KEYS}
+
+        self.out_offsets = array("i", [0])
+        self.out_index = array("i")
+        self.in_offsets = array("i", [0])
+        self.in_index = array("i")
+
+        self.unknown_edges: List[Tuple[int, int]] = []
+        self.uid: int = next(_GRAPH_UIDS)  # identité (partagée par les copies figées)
+        self.version: int = 0
+
+        # Mises à jour incrémentales
+        self.edge_dead = bytearray()
+        self._extra_out: Dict[int, List[int]] = {}
+        self._extra_in: Dict[int, List[int]] = {}
+        self._pending: int = 0
+        self._journal: List[Tuple[int, int]] = []
+        self._journal_start: int = 0
+        self._layer_fields: Dict[int, Dict[str, Optional[str]]] = {}
+        self._watched: List[Tuple[object, Dict[str, object]]] = []
+
+        self._counts: Tuple[int, int] = (0, 0)
+        # Index dérivés (accessibilité…), datés par `version` : (version, valeur)
+        # ou objet exposant `.graph`, `.stale` (et `immutable = False` s'il est
+        # mis à jour sur place)
+        self._derived: Dict[object, object] = {}
+        self._mmap = None  # instantané disque mappé (voir graph_snapshot)
+        self._fid_index: Optional[List[Dict[int, int]]] = None
+
+    # ------------------------------------------------------------------ #
+    # Construction
+    # ------------------------------------------------------------------ #
+
+    @classmethod
+    def from_layers(cls, canal_layer, fosse_layer=None,
+                    field_alias: Optional[Dict[str, Iterable[str]]] = None,
+                    sources: Optional[Dict[int, object]] = None) -> "NetworkGraph":
+        """
+        Construit le graphe en une passe attributaire par couche.
+        La géométrie n'est lue que pour les tronçons sans longueur renseignée.
+
+        sources : {LAYER_CANAL|LAYER_FOSSE: QgsVectorLayerFeatureSource} pour
+                  lire les entités hors du fil principal (couches sinon).
+        """
+        sources = sources or {}
+        g = cls()
+        g.canal_layer = canal_layer
+        g.fosse_layer = fosse_layer if (fosse_layer and fosse_layer.isValid()) else None
+        g.alias = merge_alias(field_alias)
+
+        if canal_layer and canal_layer.isValid():
+            g._read_layer(canal_layer, LAYER_CANAL, sources.get(LAYER_CANAL))
+        if g.fosse_layer:
+            g._read_layer(g.fosse_layer, LAYER_FOSSE, sources.get(LAYER_FOSSE))
+
+        g._build_csr()
+        return g
+
+    def _intern(self, node_id: str) -> int:
+        if not node_id:
+            return -1
+        idx = self.node_index.get(node_id)
+        if idx is None:
+            idx = len(self.node_ids)
+            self.node_index[node_id] = idx
+            self.node_ids.append(node_id)
+        return idx
+
+    def _code(self, key: str, value: str) -> int:
+        index = self._code_index[key]
+        c = index.get(value)
+        if c is None:
+            c = len(self.code_values[key])
+            index[value] = c
+            self.code_values[key].append(value)
+        return c
+
+    def _fields_for(self, layer_code: int) -> Dict[str, Optional[str]]:
+        """Champs résolus (alias) d'une couche, mis en cache."""
+        fields = self._layer_fields.get(layer_code)
+        if fields is None:
+            layer = self.layer_of(layer_code)
+            names = layer.fields().names() if layer is not None else []
+            fields = {k: resolve_field(names, self.alias.get(k, [])) for k in CODED_KEYS + NUMERIC_KEYS}
+            self._layer_fields[layer_code] = fields
+        return fields
+
+    def layer_of(self, layer_code: int):
+        return self.canal_layer if layer_code == LAYER_CANAL else self.fosse_layer
+
+    def _field_length(self, f, len_field: Optional[str]) -> Optional[float]:
+        """Valeur numérique d'un champ (None si absent ou non renseigné)."""
+        if not len_field:
+            return None
+        try:
+            v = f[len_field]
+            return float(v) if _norm(v) else None
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def _append_feature(self, layer_code: int, f, fields: Dict[str, Optional[str]]) -> Optional[int]:
+        """
+        Ajoute le tronçon en fin de tableaux (sans toucher à l'adjacence).
+        Longueur à -1 si ni le champ ni la géométrie ne la fournissent encore.
+        """
+        ini = _norm(f["idnini"])
+        term = _norm(f["idnterm"])
+        if ini.upper() == INCONNU or term.upper() == INCONNU:
+            self.unknown_edges.append((layer_code, f.id()))
+            return None
+
+        e = len(self.edge_fid)
+        self.edge_layer.append(layer_code)
+        self.edge_fid.append(f.id())
+        self.edge_src.append(self._intern(ini))
+        self.edge_dst.append(self._intern(term))
+        self.edge_dead.append(0)
+
+        for key in CODED_KEYS:
+            fname = fields[key]
+            self.edge_codes[key].append(self._code(key, _norm(f[fname])) if fname else 0)
+
+        length = self._field_length(f, fields["len"])
+        if length is None:
+            geom = f.geometry() if f.hasGeometry() else None
+            length = float(geom.length()) if geom and not geom.isEmpty() else -1.0
+        self.edge_length.append(length)
+        self.edge_diam.append(self._field_length(f, fields["diam"]) or 0.0)
+        return e
+
+    def _read_layer(self, layer, layer_code: int, source=None) -> None:
+        from qgis.core import QgsFeatureRequest
+
+        source = source if source is not None else layer
+        names = layer.fields().names()
+        if "idnini" not in names or "idnterm" not in names:
+            return
+
+        fields = self._fields_for(layer_code)
+        attrs = ["idnini", "idnterm"] + [f for f in fields.values() if f]
+
+        req = QgsFeatureRequest()
+        req.setFlags(QgsFeatureRequest.NoGeometry)
+        req.setSubsetOfAttributes(attrs, layer.fields())
+
+        missing_len: Dict[int, int] = {}  # fid -> indice d'arête
+        for f in source.getFeatures(req):
+            e = self._append_feature(layer_code, f, fields)
+            if e is not None and self.edge_length[e] < 0:
+                missing_len[f.id()] = e
+                self.edge_length[e] = 0.0
+
+        # Longueur géométrique pour les tronçons sans champ renseigné
+        if missing_len:
+            req_g = QgsFeatureRequest().setFilterFids(list(missing_len.keys()))
+            req_g.setSubsetOfAttributes([])
+            for f in source.getFeatures(req_g):
+                geom = f.geometry()
+                if geom and not geom.isEmpty():
+                    self.edge_length[missing_len[f.id()]] = float(geom.length())
+
+    def _build_csr(self) -> None:
+        n = len(self.node_ids)
+        if len(self.edge_dead) != self.edge_count:
+            self.edge_dead = bytearray(self.edge_count)
+        self.out_offsets, self.out_index = self._csr(self.edge_src, n, self.edge_dead)
+        self.in_offsets, self.in_index = self._csr(self.edge_dst, n, self.edge_dead)
+        self._extra_out.clear()
+        self._extra_in.clear()
+        self._pending = 0
+
+    @staticmethod
+    def _csr(keys: array, n: int, dead: bytearray) -> Tuple[array, array]:
+        """Tri par comptage des arêtes vivantes selon leur nœud clé (amont ou aval)."""
+        counts = [0] * (n + 1)
+        for e, k in enumerate(keys):
+            if k >= 0 and not dead[e]:
+                counts[k + 1] += 1
+        for i in range(n):
+            counts[i + 1] += counts[i]
+        offsets = array("i", counts)
+        index = array("i", bytes(offsets[n] * offsets.itemsize))
+        cursor = list(counts[:n])
+        for e, k in enumerate(keys):
+            if k >= 0 and not dead[e]:
+                index[cursor[k]] = e
+                cursor[k] += 1
+        return offsets, index
+
+    # ------------------------------------------------------------------ #
+    # Accès
+    # ------------------------------------------------------------------ #
+
+    @property
+    def node_count(self) -> int:
+        return len(self.node_ids)
+
+    @property
+    def edge_count(self) -> int:
+        return len(self.edge_fid)
+
+    def node(self, node_id: Optional[str]) -> int:
+        """Indice du nœud, -1 s'il n'existe pas dans le graphe."""
+        return self.node_index.get(_norm(node_id), -1)
+
+    def out_edges(self, n: int) -> Sequence[int]:
+        """Arêtes vivantes sortant du nœud n (vers l'aval)."""
+        return self._adjacent(n, self.out_offsets, self.out_index, self._extra_out)
+
+    def in_edges(self, n: int) -> Sequence[int]:
+        """Arêtes vivantes entrant dans le nœud n (depuis l'amont)."""
+        return self._adjacent(n, self.in_offsets, self.in_index, self._extra_in)
+
+    def _adjacent(self, n: int, offsets, index, extra: Dict[int, List[int]]) -> Sequence[int]:
+        base = index[offsets[n]:offsets[n + 1]] if n < len(offsets) - 1 else ()
+        if not self._pending:
+            return base
+        dead = self.edge_dead
+        return [e for e in chain(base, extra.get(n, ())) if not dead[e]]
+
+    def code_value(self, key: str, e: int) -> str:
+        return self.code_values[key][self.edge_codes[key][e]]
+
+    def filter_code(self, key: str, value: Optional[str]) -> Optional[int]:
+        """
+        Code de filtre pour une valeur saisie :
+          None → pas de filtre ; -1 → valeur absente du réseau
+          (seuls les tronçons sans valeur passent).
+        """
+        value = (value or "").strip()
+        if not value:
+            return None
+        return self._code_index[key].get(value, -1)
+
+    @staticmethod
+    def _code_bits(code: Optional[int]) -> Optional[int]:
+        """Masque binaire des codes admis : valeur absente (code 0) + code demandé."""
+        if code is None:
+            return None
+        return 1 | (1 << code) if code > 0 else 1
+
+    def edge_filter(self, cat_code: Optional[int] = None,
+                    func_code: Optional[int] = None) -> Optional[bytearray]:
+        """
+        Filtre compilé : 1 octet par arête (1 = passe), None sans filtre.
+
+        Chaque filtre est un masque binaire sur la table de codes, appliqué une
+        fois à tous les codes de la table ; le masque par arête s'obtient par
+        indexation, sans aucune lecture d'entité. Mis en cache par version.
+        """
+        cat_bits, func_bits = self._code_bits(cat_code), self._code_bits(func_code)
+        if cat_bits is None and func_bits is None:
+            return None
+        key = ("filter", cat_code, func_code)
+        cached = self._derived.get(key)
+        if cached is not None and cached[0] == self.version:
+            return cached[1]
+
+        def lut(name: str, bits: Optional[int]) -> bytes:
+            n = len(self.code_values[name])
+            if bits is None:
+                return b"\x01" * n
+            return bytes((bits >> c) & 1 for c in range(n))
+
+        lut_cat = lut("cat", cat_bits)
+        lut_func = lut("func", func_bits)
+        cats = self.edge_codes["cat"]
+        funcs = self.edge_codes["func"]
+        mask = bytearray(lut_cat[c] & lut_func[f] for c, f in zip(cats, funcs))
+        self._derived[key] = (self.version, mask)
+        return mask
+
+    def fid_index(self, layer_code: int) -> Dict[int, int]:
+        """FID → indice d'arête pour une couche (construit à la demande)."""
+        if self._fid_index is None:
+            idx: List[Dict[int, int]] = [{}, {}]
+            dead = self.edge_dead
+            for e, (lc, fid) in enumerate(zip(self.edge_layer, self.edge_fid)):
+                if not dead[e]:
+                    idx[lc][fid] = e
+            self._fid_index = idx
+        return self._fid_index[layer_code]
+
+    def mask_from_fids(self, canal_fids: Iterable[int], fosse_fids: Iterable[int] = ()) -> bytearray:
+        """Masque (1 octet par arête) des tronçons donnés par FID."""
+        mask = bytearray(self.edge_count)
+        for layer_code, fids in ((LAYER_CANAL, canal_fids), (LAYER_FOSSE, fosse_fids)):
+            index = self.fid_index(layer_code)
+            for fid in fids or ():
+                e = index.get(fid)
+                if e is not None:
+                    mask[e] = 1
+        return mask
+
+    def fids_by_layer(self, edges: Iterable[int]) -> Tuple[List[int], List[int]]:
+        canal: List[int] = []
+        fosse: List[int] = []
+        layer, fid = self.edge_layer, self.edge_fid
+        for e in edges:
+            (canal if layer[e] == LAYER_CANAL else fosse).append(fid[e])
+        return canal, fosse
+
+    def node_names(self, nodes: Iterable[int]) -> Set[str]:
+        ids = self.node_ids
+        return {ids[n] for n in nodes if n >= 0}
+
+    # ------------------------------------------------------------------ #
+    # Parcours
+    # ------------------------------------------------------------------ #
+
+    def walk(
+        self,
+        starts: Iterable[int],
+        downstream: bool = True,
+        cat_code: Optional[int] = None,
+        func_code: Optional[int] = None,
+        edge_mask: Optional[bytearray] = None,
+        strict: bool = True,
+        owners: Optional[List[int]] = None,
+    ) -> Tuple[List[int], List[int]]:
+        """
+        Parcours en profondeur depuis un ou plusieurs nœuds.
+
+        cat_code / func_code : codes issus de `filter_code` (None = pas de filtre)
+        edge_mask            : si fourni, seules les arêtes à 1 sont suivies
+        strict               : True  → ignore les arêtes sans nœud suivant
+                               False → les retient sans poursuivre
+        owners               : si fourni (liste vide), reçoit pour chaque arête
+                               atteinte la position dans `starts` du départ qui
+                               l'a atteinte en premier (un départ reste
+                               propriétaire de son propre nœud).
+
+        Retour : (arêtes atteintes, nœuds visités) en ordre de parcours.
+        """
+        for edges, nodes in self.iter_walk(starts, downstream, cat_code, func_code,
+                                           edge_mask, strict, owners, batch_size=0):
+            return edges, nodes
+        return [], []
+
+    def iter_walk(
+        self,
+        starts: Iterable[int],
+        downstream: bool = True,
+        cat_code: Optional[int] = None,
+        func_code: Optional[int] = None,
+        edge_mask: Optional[bytearray] = None,
+        strict: bool = True,
+        owners: Optional[List[int]] = None,
+        batch_size: int = 2000,
+    ) -> Iterator[Tuple[List[int], List[int]]]:
+        """
+        Même parcours que `walk`, livré par lots : (arêtes, nœuds) nouveaux
+        tous les `batch_size` nœuds visités (0 = un seul lot final).
+        L'appelant peut interrompre le parcours entre deux lots.
+        """
+        if downstream:
+            adjacent, nxt_of = self.out_edges, self.edge_dst
+        else:
+            adjacent, nxt_of = self.in_edges, self.edge_src
+        passes = self.edge_filter(cat_code, func_code)
+
+        seen = bytearray(self.node_count)
+        edges: List[int] = []
+        nodes: List[int] = []
+        starts = list(starts)
+        stack = [n for n in reversed(starts) if n >= 0]
+
+        track = owners is not None
+        if track:
+            origin: Dict[int, int] = {}
+            for i, n in enumerate(starts):
+                if n >= 0:
+                    origin.setdefault(n, i)
+            fixed = set(origin)
+
+        while stack:
+            cur = stack.pop()
+            if seen[cur]:
+                continue
+            seen[cur] = 1
+            nodes.append(cur)
+            if track:
+                own = origin[cur]
+
+            for e in adjacent(cur):
+                if edge_mask is not None and not edge_mask[e]:
+                    continue
+                if passes is not None and not passes[e]:
+                    continue
+                nxt = nxt_of[e]
+                if nxt < 0:
+                    if not strict:
+                        edges.append(e)
+                        if track:
+                            owners.append(own)
+                    continue
+                edges.append(e)
+                if track:
+                    owners.append(own)
+                if not seen[nxt]:
+                    stack.append(nxt)
+                    if track and nxt not in fixed:
+                        origin[nxt] = own
+
+            if batch_size and len(nodes) >= batch_size:
+                yield edges, nodes
+                edges, nodes = [], []
+
+        if nodes or not batch_size:
+            yield edges, nodes
+
+    def iter_bfs(
+        self,
+        starts: Iterable[int],
+        downstream: bool = True,
+        cat_code: Optional[int] = None,
+        func_code: Optional[int] = None,
+        edge_mask: Optional[bytearray] = None,
+    ) -> Iterator[Tuple[int, int, int, float, int]]:
+        """
+        Parcours en largeur livré arête par arête :
+        (arête, nœud de départ, nœud d'arrivée, longueur cumulée, profondeur).
+
+        La longueur cumulée et la profondeur (1 pour les arêtes issues d'un
+        départ) suivent l'arbre de parcours. Chaque arête n'est livrée qu'une
+        fois ; les arêtes sans nœud suivant sont ignorées. Mémoire : file et
+        marquage des nœuds, aucune liste de résultats.
+        """
+        if downstream:
+            adjacent, nxt_of = self.out_edges, self.edge_dst
+        else:
+            adjacent, nxt_of = self.in_edges, self.edge_src
+        passes = self.edge_filter(cat_code, func_code)
+        lengths = self.edge_length
+
+        seen = bytearray(self.node_count)
+        queue: deque = deque()
+        for n in starts:
+            if n >= 0 and not seen[n]:
+                seen[n] = 1
+                queue.append((n, 0.0, 0))
+
+        while queue:
+            cur, dist, depth = queue.popleft()
+            for e in adjacent(cur):
+                if edge_mask is not None and not edge_mask[e]:
+                    continue
+                if passes is not None and not passes[e]:
+                    continue
+                nxt = nxt_of[e]
+                if nxt < 0:
+                    continue
+                d = dist + lengths[e]
+                yield e, cur, nxt, d, depth + 1
+                if not seen[nxt]:
+                    seen[nxt] = 1
+                    queue.append((nxt, d, depth + 1))
+
+    def bounded_walk(
+        self,
+        seeds: Dict[int, Tuple[float, int]],
+        downstream: bool = True,
+        cat_code: Optional[int] = None,
+        func_code: Optional[int] = None,
+        max_hops: Optional[int] = None,
+        max_length: Optional[float] = None,
+        settled: Optional[Dict[int, Tuple[float, int]]] = None,
+        taken: Optional[Set[int]] = None,
+    ) -> Tuple[List[int], Set[int]]:
+        """
+        Parcours borné : expansion par file de priorité sur la longueur cumulée
+        (Dijkstra), arrêtée dès que `max_length` (m) ou `max_hops` (tronçons
+        depuis le départ, le long du plus court chemin) serait dépassé.
+
+        seeds   : nœud → (longueur cumulée, nombre de tronçons) de départ
+        settled : nœuds déjà fixés (complété sur place) — pour prolonger un
+                  parcours, passer l'état précédent et la frontière en `seeds`
+        taken   : arêtes déjà retenues (complété sur place)
+
+        Retour : (nouvelles arêtes retenues, frontière) ; la frontière est
+        l'ensemble des nœuds dont au moins une arête dépasse la borne.
+        """
+        if downstream:
+            adjacent, nxt_of = self.out_edges, self.edge_dst
+        else:
+            adjacent, nxt_of = self.in_edges, self.edge_src
+        passes = self.edge_filter(cat_code, func_code)
+        lengths = self.edge_length
+        settled = {} if settled is None else settled
+        taken = set() if taken is None else taken
+        inf = float("inf")
+
+        best: Dict[int, Tuple[float, int]] = {}
+        heap: List[Tuple[float, int, int]] = []
+        for n, (d, h) in seeds.items():
+            if n >= 0:
+                best[n] = (d, h)
+                heap.append((d, h, n))
+        heapq.heapify(heap)
+        expand = set(best)  # les graines sont (ré)examinées même si déjà fixées
+
+        edges: List[int] = []
+        frontier: Set[int] = set()
+        while heap:
+            d, h, cur = heapq.heappop(heap)
+            if cur in settled and cur not in expand:
+                continue
+            if best.get(cur, (inf, 0))[0] < d:
+                continue
+            expand.discard(cur)
+            settled[cur] = (d, h)
+
+            for e in adjacent(cur):
+                if e in taken or (passes is not None and not passes[e]):
+                    continue
+                nd, nh = d + lengths[e], h + 1
+                if (max_length is not None and nd > max_length) or \
+                        (max_hops is not None and nh > max_hops):
+                    frontier.add(cur)
+                    continue
+                nxt = nxt_of[e]
+                if nxt < 0:
+                    continue
+                taken.add(e)
+                edges.append(e)
+                if nxt not in settled and nd < best.get(nxt, (inf, 0))[0]:
+                    best[nxt] = (nd, nh)
+                    heapq.heappush(heap, (nd, nh, nxt))
+
+        return edges, frontier
+
+    def frozen(self) -> "NetworkGraph":
+        """
+        Copie figée du graphe pour un parcours hors du fil principal : les
+        tableaux sont copiés (les vues sur instantané disque, en lecture seule,
+        sont partagées) et la copie n'est abonnée à aucun signal.
+
+        Les index dérivés à jour (filtres, condensation, accessibilité…) sont
+        immuables pour une version donnée : la copie les reprend, rattachés à
+        elle, plutôt que de les recalculer.
+        """
+        g = NetworkGraph.__new__(NetworkGraph)
+        g.__dict__.update(self.__dict__)
+        dup = lambda a: a if isinstance(a, memoryview) else a[:]
+        for name in EDGE_ARRAYS + ("out_offsets", "out_index", "in_offsets", "in_index"):
+            setattr(g, name, dup(getattr(self, name)))
+        g.edge_codes = {k: dup(v) for k, v in self.edge_codes.items()}
+        g.code_values = {k: list(v) for k, v in self.code_values.items()}
+        g._code_index = {k: dict(v) for k, v in self._code_index.items()}
+        g.node_ids = list(self.node_ids)
+        g.node_index = dict(self.node_index)
+        g.edge_dead = bytearray(self.edge_dead)
+        g._extra_out = {k: list(v) for k, v in self._extra_out.items()}
+        g._extra_in = {k: list(v) for k, v in self._extra_in.items()}
+        g.unknown_edges = list(self.unknown_edges)
+        g._journal = []
+        g._watched = []
+        g._derived = {}
+        for key, value in self._derived.items():
+            if isinstance(value, tuple):
+                if value[0] == self.version:
+                    g._derived[key] = value
+            elif not value.stale and getattr(value, "immutable", True):
+                value = copy.copy(value)
+                value.graph = g
+                g._derived[key] = value
+        g._fid_index = None
+        return g
+
+    def path_between(
+        self,
+        src: Union[int, Iterable[int], None],
+        dst: Union[int, Iterable[int]],
+        weight: Optional[str] = "length",
+        edge_mask: Optional[bytearray] = None,
+    ) -> PathResult:
+        """
+        Chemins de `src` vers `dst` dans le sens d'écoulement (idnini → idnterm).
+
+        src / dst : indice de nœud ou ensemble d'indices ; src=None = tout
+                    nœud (les arêtes retenues sont alors tout l'amont de dst)
+        weight    : 'length' (longueur des tronçons) ou None (nombre d'arêtes)
+        edge_mask : si fourni, seules les arêtes à 1 sont empruntées
+
+        Une arête est retenue si son amont est atteignable depuis src et son
+        aval mène à dst : un seul passage avant + un passage arrière, quel que
+        soit le maillage. Le plus court chemin (Dijkstra multi-source) est
+        calculé dans ce sous-graphe.
+        """
+        as_list = lambda v: [v] if isinstance(v, int) else [n for n in v if n >= 0]
+        targets = as_list(dst)
+        _, back = self.walk(targets, downstream=False, edge_mask=edge_mask)
+        bwd = bytearray(self.node_count)
+        for n in back:
+            bwd[n] = 1
+
+        if src is None:
+            fwd = None
+            sources: List[int] = []
+        else:
+            sources = [n for n in as_list(src) if n >= 0 and bwd[n]]
+            _, ahead = self.walk(sources, downstream=True, edge_mask=edge_mask)
+            fwd = bytearray(self.node_count)
+            for n in ahead:
+                fwd[n] = 1
+
+        esrc = self.edge_src
+        edges: List[int] = []
+        for n in back:
+            if fwd is not None and not fwd[n]:
+                continue
+            for e in self.in_edges(n):
+                if edge_mask is not None and not edge_mask[e]:
+                    continue
+                u = esrc[e]
+                if fwd is None or (u >= 0 and fwd[u]):
+                    edges.append(e)
+        nodes = [n for n in back if fwd is None or fwd[n]]
+
+        shortest: List[int] = []
+        length = -1.0
+        if sources:
+            shortest, length = self._dijkstra(sources, set(targets), set(edges), weight)
+        elif src is None and targets:
+            length = 0.0
+        return PathResult(edges, nodes, shortest, length)
+
+    def _dijkstra(self, sources: List[int], targets: Set[int], allowed: Set[int],
+                  weight: Optional[str]) -> Tuple[List[int], float]:
+        lengths = self.edge_length
+        edst = self.edge_dst
+        dist: Dict[int, float] = {n: 0.0 for n in sources}
+        via: Dict[int, int] = {}
+        heap = [(0.0, n) for n in sources]
+        heapq.heapify(heap)
+        while heap:
+            d, cur = heapq.heappop(heap)
+            if d > dist.get(cur, float("inf")):
+                continue
+            if cur in targets:
+                path: List[int] = []
+                while cur in via:
+                    e = via[cur]
+                    path.append(e)
+                    cur = self.edge_src[e]
+                path.reverse()
+                return path, d
+            for e in self.out_edges(cur):
+                if e not in allowed:
+                    continue
+                nxt = edst[e]
+                nd = d + (lengths[e] if weight == "length" else 1.0)
+                if nd < dist.get(nxt, float("inf")):
+                    dist[nxt] = nd
+                    via[nxt] = e
+                    heapq.heappush(heap, (nd, nxt))
+        return [], -1.0
+
+    # ------------------------------------------------------------------ #
+    # Mises à jour incrémentales
+    # ------------------------------------------------------------------ #
+
+    JOURNAL_MAX = 50000
+
+    def _make_writable(self) -> None:
+        """Copie en mémoire les tableaux encore mappés sur un instantané disque."""
+        for name in EDGE_ARRAYS:
+            cur = getattr(self, name)
+            if isinstance(cur, memoryview):
+                arr = array(cur.format)
+                arr.frombytes(cur.tobytes())
+                setattr(self, name, arr)
+        for key in CODED_KEYS:
+            cur = self.edge_codes[key]
+            if isinstance(cur, memoryview):
+                arr = array(cur.format)
+                arr.frombytes(cur.tobytes())
+                self.edge_codes[key] = arr
+
+    def _touch(self, edges: Iterable[int]) -> None:
+        self.version += 1
+        for e in edges:
+            self._journal.append((self.version, e))
+        if len(self._journal) > self.JOURNAL_MAX:
+            drop = len(self._journal) - self.JOURNAL_MAX
+            self._journal_start = self._journal[drop - 1][0]
+            del self._journal[:drop]
+        self._counts = (_feature_count(self.canal_layer), _feature_count(self.fosse_layer))
+
+    def changed_edges_since(self, version: int) -> Optional[Set[int]]:
+        """
+        Arêtes modifiées depuis `version`, ou None si le journal ne remonte
+        pas jusque-là (l'appelant doit alors tout recalculer).
+        """
+        if version < self._journal_start:
+            return None
+        return {e for v, e in self._journal if v > version}
+
+    def _link(self, e: int) -> None:
+        src, dst = self.edge_src[e], self.edge_dst[e]
+        if src >= 0:
+            self._extra_out.setdefault(src, []).append(e)
+        if dst >= 0:
+            self._extra_in.setdefault(dst, []).append(e)
+        if self._fid_index is not None:
+            self._fid_index[self.edge_layer[e]][self.edge_fid[e]] = e
+        self._pending += 1
+
+    def _kill(self, e: int) -> None:
+        self.edge_dead[e] = 1
+        if self._fid_index is not None:
+            self._fid_index[self.edge_layer[e]].pop(self.edge_fid[e], None)
+        self._pending += 1
+
+    def _maybe_compact(self) -> None:
+        if self._pending > max(256, self.edge_count // 50):
+            self._build_csr()
+
+    def add_feature(self, layer_code: int, feature) -> Optional[int]:
+        """Ajoute un tronçon au graphe ; renvoie l'indice d'arête (None si exclu)."""
+        self._make_writable()
+        e = self._append_feature(layer_code, feature, self._fields_for(layer_code))
+        if e is None:
+            self._touch(())
+            return None
+        if self.edge_length[e] < 0:
+            self.edge_length[e] = 0.0
+        self._link(e)
+        self._touch((e,))
+        self._maybe_compact()
+        return e
+
+    def remove_feature(self, layer_code: int, fid: int) -> Optional[int]:
+        """Retire un tronçon du graphe ; renvoie l'indice de l'arête retirée."""
+        self.unknown_edges = [u for u in self.unknown_edges if u != (layer_code, fid)]
+        e = self.fid_index(layer_code).get(fid)
+        if e is None:
+            return None
+        self._kill(e)
+        self._touch((e,))
+        self._maybe_compact()
+        return e
+
+    def refresh_feature(self, layer_code: int, fid: int) -> None:
+        """
+        Relit un tronçon depuis sa couche. Si ses extrémités n'ont pas changé,
+        l'arête est mise à jour sur place (indice conservé), sinon remplacée.
+        """
+        layer = self.layer_of(layer_code)
+        if layer is None:
+            return
+        feature = layer.getFeature(fid)
+        if not feature.isValid():
+            self.remove_feature(layer_code, fid)
+            return
+
+        e = self.fid_index(layer_code).get(fid)
+        ini = _norm(feature["idnini"])
+        term = _norm(feature["idnterm"])
+        same_ends = (
+            e is not None
+            and ini.upper() != INCONNU and term.upper() != INCONNU
+            and self.edge_src[e] == self.node(ini) and self.edge_dst[e] == self.node(term)
+            and (self.edge_src[e] >= 0) == bool(ini) and (self.edge_dst[e] >= 0) == bool(term)
+        )
+        if not same_ends:
+            self.remove_feature(layer_code, fid)
+            self.add_feature(layer_code, feature)
+            return
+
+        self._make_writable()
+        fields = self._fields_for(layer_code)
+        for key in CODED_KEYS:
+            fname = fields[key]
+            self.edge_codes[key][e] = self._code(key, _norm(feature[fname])) if fname else 0
+        length = self._field_length(feature, fields["len"])
+        if length is None:
+            geom = feature.geometry()
+            length = float(geom.length()) if geom and not geom.isEmpty() else 0.0
+        self.edge_length[e] = length
+        self.edge_diam[e] = self._field_length(feature, fields["diam"]) or 0.0
+        self._touch((e,))
+
+    def reload(self) -> None:
+        """Reconstruction complète depuis les couches (annulation d'édition…)."""
+        fresh = NetworkGraph.from_layers(self.canal_layer, self.fosse_layer, self.alias)
+        watched, version = self._watched, self.version
+        self.__dict__.update(fresh.__dict__)
+        self._watched = watched
+        self.version = version
+        self._journal_start = version + 1
+        self._touch(())
+
+    # --- Abonnement aux signaux d'édition des couches ---
+
+    def _on_committed(self, layer_code: int, features) -> None:
+        """Après validation : les FIDs temporaires (< 0) deviennent définitifs."""
+        for fid in [fid for fid in self.fid_index(layer_code) if fid < 0]:
+            self.remove_feature(layer_code, fid)
+        for f in features:
+            self.remove_feature(layer_code, f.id())
+            self.add_feature(layer_code, f)
+
+    def watch(self) -> None:
+        """Abonne le graphe aux signaux d'édition des couches canal et fossé."""
+        if self._watched:
+            return
+        for code, layer in ((LAYER_CANAL, self.canal_layer), (LAYER_FOSSE, self.fosse_layer)):
+            if layer is None:
+                continue
+            slots = {
+                "featureAdded": lambda fid, c=code, lyr=layer: self.add_feature(c, lyr.getFeature(fid)),
+                "featureDeleted": lambda fid, c=code: self.remove_feature(c, fid),
+                "geometryChanged": lambda fid, _g, c=code: self.refresh_feature(c, fid),
+                "attributeValueChanged": lambda fid, _i, _v, c=code: self.refresh_feature(c, fid),
+                "committedFeaturesAdded": lambda _lid, feats, c=code: self._on_committed(c, feats),
+                "afterRollBack": self.reload,
+            }
+            for sig, slot in slots.items():
+                getattr(layer, sig).connect(slot)
+            self._watched.append((layer, slots))
+
+    def unwatch(self) -> None:
+        for layer, slots in self._watched:
+            for sig, slot in slots.items():
+                try:
+                    getattr(layer, sig).disconnect(slot)
+                except (RuntimeError, TypeError):
+                    pass
+        self._watched = []
+
+
+# ---------------------------------------------------------------------- #
+# Graphe partagé (un par couple de couches)
+# ---------------------------------------------------------------------- #
+
+_SHARED: Dict[Tuple, NetworkGraph] = {}
+
+
+def _shared_key(canal_layer, fosse_layer, alias: Dict[str, List[str]]) -> Tuple:
+    lid = lambda lyr: lyr.id() if lyr is not None else ""
+    return (lid(canal_layer), lid(fosse_layer),
+            tuple(sorted((k, tuple(v)) for k, v in alias.items())))
+
+
+def _feature_count(layer) -> int:
+    return layer.featureCount() if layer is not None else 0
+
+
+def get_graph(canal_layer, fosse_layer=None,
+              field_alias: Optional[Dict[str, Iterable[str]]] = None,
+              build: bool = True) -> Optional[NetworkGraph]:
+    """
+    Renvoie le graphe partagé des couches données.
+    Au premier appel, l'instantané disque à jour est chargé s'il existe
+    (sinon le graphe est construit puis enregistré).
+    Reconstruit si les couches ou leur nombre d'entités ont changé.
+    Avec build=False, ne fait que charger un instantané (None sinon).
+    """
+    from .graph_snapshot import load_or_build
+
+    fosse_layer = fosse_layer if (fosse_layer and fosse_layer.isValid()) else None
+    alias = merge_alias(field_alias)
+    key = _shared_key(canal_layer, fosse_layer, alias)
+
+    g = _SHARED.get(key)
+    if _is_current(g, canal_layer, fosse_layer):
+        return g
+
+    new = load_or_build(canal_layer, fosse_layer, alias, build=build)
+    if new is None:
+        return None
+    return _share(key, new)
+
+
+def _is_current(g: Optional[NetworkGraph], canal_layer, fosse_layer) -> bool:
+    return (g is not None and g.canal_layer is canal_layer and g.fosse_layer is fosse_layer
+            and g._counts == (_feature_count(canal_layer), _feature_count(fosse_layer)))
+
+
+def _share(key: Tuple, new: NetworkGraph) -> NetworkGraph:
+    old = _SHARED.get(key)
+    if old is not None:
+        old.unwatch()
+    new._counts = (_feature_count(new.canal_layer), _feature_count(new.fosse_layer))
+    new.watch()
+    _SHARED[key] = new
+    return new
+
+
+def share_graph(graph: NetworkGraph) -> NetworkGraph:
+    """
+    Adopte comme graphe partagé de ses couches un graphe construit hors du
+    fil principal (à appeler depuis le fil principal : abonnement aux signaux).
+    Un graphe partagé déjà à jour est conservé.
+    """
+    key = _shared_key(graph.canal_layer, graph.fosse_layer, graph.alias)
+    current = _SHARED.get(key)
+    if _is_current(current, graph.canal_layer, graph.fosse_layer):
+        return current
+    return _share(key, graph)
+
+
+def invalidate_graph(canal_layer=None, fosse_layer=None) -> None:
+    """Oublie le(s) graphe(s) partagé(s) des couches données (toutes si None)."""
+    if canal_layer is None and fosse_layer is None:
+        keys = list(_SHARED)
+    else:
+        ids = {lyr.id() for lyr in (canal_layer, fosse_layer) if lyr is not None}
+        keys = [k for k in _SHARED if k[0] in ids or k[1] in ids]
+    for key in keys:
+        _SHARED.pop(key).unwatch()
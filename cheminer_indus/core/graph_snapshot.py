@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+# cheminer_indus/core/graph_snapshot.py
+
+"""
+Instantané disque du graphe réseau (format binaire versionné, mappé en mémoire).
+
+Disposition du fichier
+----------------------
+    MAGIC (8 octets) | taille de l'en-tête (uint32) | en-tête JSON | tableaux
+
+Les tableaux (identifiants des nœuds en octets UTF-8 et leurs offsets, offsets
+CSR, FIDs, longueurs, codes de filtre…) sont alignés sur 8 octets et relus par `mmap` sans copie : un instantané à jour
+se charge en quelques millisecondes au démarrage.
+
+La clé combine, pour chaque couche, l'URI source, le nombre d'entités et un
+tampon de modification côté fournisseur ; toute différence impose une
+reconstruction. Le nom du fichier est préfixé d'une empreinte des seules
+sources : un nouvel instantané ne remplace que ceux des mêmes couches.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from .graph import CODED_KEYS, EDGE_ARRAYS, NetworkGraph
+
+MAGIC = b"CIGRAPH\x00"
+FORMAT_VERSION = 3
+SNAPSHOT_DIR = ".cheminer_indus"
+
+# Tableaux sérialisés : nom → attribut du graphe
+_EDGE_ARRAYS = EDGE_ARRAYS
+_CSR_ARRAYS = ("out_offsets", "out_index", "in_offsets", "in_index")
+
+
+# ---------------------------------------------------------------------- #
+# Clé
+# ---------------------------------------------------------------------- #
+
+def _change_stamp(layer) -> str:
+    """
+    Tampon de modification côté fournisseur :
+      - postgres : compteurs d'écritures de pg_stat_user_tables
+      - fichiers : date de modification du fichier
+    Chaîne vide si indisponible (la clé repose alors sur l'URI et le nombre d'entités).
+    """
+    try:
+        provider = layer.providerType()
+    except Exception:
+        return ""
+
+    if provider == "postgres":
+        try:
+            from qgis.core import QgsDataSourceUri, QgsProviderRegistry
+
+            uri = QgsDataSourceUri(layer.source())
+            relation = '"{}"."{}"'.format(uri.schema() or "public", uri.table())
+            md = QgsProviderRegistry.instance().providerMetadata("postgres")
+            conn = md.createConnection(layer.source(), {})
+            rows = conn.executeSql(
+                "SELECT n_tup_ins, n_tup_upd, n_tup_del, pg_postmaster_start_time() "
+                "FROM pg_stat_user_tables WHERE relid = '{}'::regclass".format(
+                    relation.replace("'", "''"))
+            )
+            return "|".join(str(v) for v in rows[0]) if rows else ""
+        except Exception:
+            return ""
+
+    path = (layer.source() or "").split("|", 1)[0]
+    try:
+        return str(os.path.getmtime(path)) if path and os.path.exists(path) else ""
+    except OSError:
+        return ""
+
+
+def snapshot_key(canal_layer, fosse_layer, alias: Dict[str, List[str]]) -> Optional[str]:
+    """Clé de l'instantané, None si les couches ne sont pas persistantes (mémoire)."""
+    parts = []
+    for lyr in (canal_layer, fosse_layer):
+        if lyr is None:
+            parts.append(None)
+            continue
+        if lyr.providerType() == "memory":
+            return None
+        parts.append([lyr.source(), lyr.featureCount(), _change_stamp(lyr)])
+    payload = json.dumps([FORMAT_VERSION, parts, sorted(alias.items())], sort_keys=True)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def sources_tag(canal_layer, fosse_layer) -> str:
+    """Empreinte courte des URI sources des couches (préfixe des fichiers)."""
+    sources = [lyr.source() if lyr is not None else None for lyr in (canal_layer, fosse_layer)]
+    return hashlib.sha1(json.dumps(sources).encode("utf-8")).hexdigest()[:8]
+
+
+def snapshot_dir() -> str:
+    """Dossier des instantanés : dossier du projet QGIS, sinon dossier temporaire."""
+    home = ""
+    try:
+        from qgis.core import QgsProject
+        home = QgsProject.instance().homePath()
+    except Exception:
+        home = ""
+    base = home if home and os.path.isdir(home) else os.path.join(tempfile.gettempdir(), "cheminer_indus")
+    return os.path.join(base, SNAPSHOT_DIR)
+
+
+def snapshot_path(key: str, tag: str = "", folder: Optional[str] = None) -> str:
+    """Fichier de l'instantané : graph_<empreinte des sources>_<clé>.bin."""
+    return os.path.join(folder or snapshot_dir(), "graph_{}_{}.bin".format(tag, key[:16]))
+
+
+def snapshot_location(canal_layer, fosse_layer,
+                      alias: Dict[str, List[str]]) -> Optional[Tuple[str, str]]:
+    """
+    (clé, chemin) de l'instantané des couches, None si elles ne sont pas
+    persistantes. Interroge les couches et le projet : fil principal.
+    """
+    key = snapshot_key(canal_layer, fosse_layer, alias)
+    if key is None:
+        return None
+    return key, snapshot_path(key, sources_tag(canal_layer, fosse_layer))
+
+
+# ---------------------------------------------------------------------- #
+# Écriture
+# ---------------------------------------------------------------------- #
+
+def _arrays_of(graph: NetworkGraph) -> Dict[str, array]:
+    out: Dict[str, array] = {}
+    for name in _EDGE_ARRAYS + _CSR_ARRAYS:
+        out[name] = getattr(graph, name)
+    for key in CODED_KEYS:
+        out["codes_" + key] = graph.edge_codes[key]
+    out["unknown_layer"] = array("B", (lc for lc, _ in graph.unknown_edges))
+    out["unknown_fid"] = array("q", (fid for _, fid in graph.unknown_edges))
+    # Identifiants bout à bout ; le nœud i occupe node_bytes[node_offsets[i]:node_offsets[i + 1]]
+    encoded = [nid.encode("utf-8") for nid in graph.node_ids]
+    offsets = array("q", [0])
+    for raw in encoded:
+        offsets.append(offsets[-1] + len(raw))
+    out["node_offsets"] = offsets
+    out["node_bytes"] = array("B", b"".join(encoded))
+    return out
+
+
+def save_snapshot(graph: NetworkGraph, path: str, key: str = "") -> None:
+    """Écrit l'instantané (écriture atomique via fichier temporaire)."""
+    arrays = _arrays_of(graph)
+
+    entries = []
+    offset = 0
+    for name, arr in arrays.items():
+        nbytes = len(arr) * arr.itemsize
+        typecode = getattr(arr, "typecode", None) or arr.format
+        entries.append({"name": name, "type": typecode, "offset": offset, "length": len(arr)})
+        offset += (nbytes + 7) & ~7
+
+    header = {
+        "format": FORMAT_VERSION,
+        "key": key,
+        "byteorder": sys.byteorder,
+        "node_count": graph.node_count,
+        "code_values": graph.code_values,
+        "arrays": entries,
+    }
+    raw_header = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    start = len(MAGIC) + 4 + len(raw_header)
+    pad = (-start) & 7
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(raw_header) + pad))
+        f.write(raw_header + b" " * pad)
+        for name, arr in arrays.items():
+            data = arr.tobytes()
+            f.write(data)
+            f.write(b"\x00" * ((-len(data)) & 7))
+    os.replace(tmp, path)
+
+
+# ---------------------------------------------------------------------- #
+# Lecture
+# ---------------------------------------------------------------------- #
+
+def _read_header(f) -> Optional[dict]:
+    if f.read(len(MAGIC)) != MAGIC:
+        return None
+    (size,) = struct.unpack("<I", f.read(4))
+    header = json.loads(f.read(size).decode("utf-8"))
+    header["_data_start"] = len(MAGIC) + 4 + size
+    return header
+
+
+def load_snapshot(path: str, key: Optional[str] = None) -> Optional[NetworkGraph]:
+    """
+    Mappe l'instantané en mémoire et renvoie un graphe prêt à parcourir.
+    None si le fichier est absent, d'un autre format ou d'une autre clé.
+    Les tableaux du graphe sont alors des vues en lecture seule sur le fichier.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            header = _read_header(f)
+            if not header or header.get("format") != FORMAT_VERSION \
+                    or header.get("byteorder") != sys.byteorder:
+                return None
+            if key is not None and header.get("key") != key:
+                return None
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError, struct.error):
+        return None
+
+    base = header["_data_start"]
+    buf = memoryview(mm)
+    views = {}
+    for ent in header["arrays"]:
+        itemsize = array(ent["type"]).itemsize
+        start = base + ent["offset"]
+        views[ent["name"]] = buf[start:start + ent["length"] * itemsize].cast(ent["type"])
+
+    g = NetworkGraph()
+    for name in _EDGE_ARRAYS + _CSR_ARRAYS:
+        setattr(g, name, views[name])
+    for k in CODED_KEYS:
+        g.edge_codes[k] = views["codes_" + k]
+        g.code_values[k] = list(header["code_values"][k])
+        g._code_index[k] = {v: i for i, v in enumerate(g.code_values[k])}
+
+    data, offsets = bytes(views["node_bytes"]), views["node_offsets"]
+    g.node_ids = [data[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(header["node_count"])]
+    g.node_index = dict(zip(g.node_ids, range(len(g.node_ids))))
+    g.unknown_edges = list(zip(views["unknown_layer"], views["unknown_fid"]))
+    g.edge_dead = bytearray(len(g.edge_fid))
+    g._mmap = mm
+    return g
+
+
+def close_snapshot(graph: NetworkGraph) -> None:
+    """
+    Libère les vues du graphe sur son instantané et ferme le fichier mappé
+    (indispensable sous Windows avant de supprimer le fichier). Le graphe
+    n'est plus utilisable ensuite.
+    """
+    mm = graph._mmap
+    if mm is None:
+        return
+    views = [getattr(graph, name) for name in _EDGE_ARRAYS + _CSR_ARRAYS]
+    views += list(graph.edge_codes.values())
+    for view in views:
+        if isinstance(view, memoryview):
+            view.release()
+    graph._derived.clear()
+    graph._mmap = None
+    try:
+        mm.close()
+    except BufferError:
+        pass  # vue encore référencée ailleurs : fermeture par le ramasse-miettes
+
+
+def purge_snapshots(folder: str, keep: str) -> None:
+    """
+    Supprime les instantanés périmés des mêmes couches que `keep` (même
+    empreinte des sources), ainsi que ceux d'un ancien nommage sans
+    empreinte. Les instantanés d'autres couches sont conservés.
+    """
+    prefix = os.path.basename(keep).rsplit("_", 1)[0] + "_"
+    try:
+        names = os.listdir(folder)
+    except OSError:
+        return
+    for name in names:
+        p = os.path.join(folder, name)
+        legacy = name.startswith("graph_") and name.count("_") == 1
+        if (name.startswith(prefix) or legacy) and name.endswith(".bin") and p != keep:
+            try:
+                os.remove(p)
+            except OSError:
+                pass
+
+
+def load_or_build(canal_layer, fosse_layer, alias: Dict[str, List[str]],
+                  build: bool = True, sources: Optional[dict] = None) -> Optional[NetworkGraph]:
+    """
+    Charge l'instantané à jour des couches s'il existe, sinon construit le
+    graphe et l'enregistre pour le prochain démarrage.
+    Avec build=False, renvoie None plutôt que de construire.
+    sources : sources d'entités pour une construction hors du fil principal
+              (voir `NetworkGraph.from_layers`).
+    """
+    location = snapshot_location(canal_layer, fosse_layer, alias)
+    return load_or_build_at(location, canal_layer, fosse_layer, alias, build, sources)
+
+
+def load_or_build_at(location: Optional[Tuple[str, str]], canal_layer, fosse_layer,
+                     alias: Dict[str, List[str]], build: bool = True,
+                     sources: Optional[dict] = None) -> Optional[NetworkGraph]:
+    """
+    Comme `load_or_build`, pour un emplacement déjà calculé par
+    `snapshot_location` (None : pas d'instantané). Avec `sources`, les
+    entités ne sont lues qu'au travers des sources : utilisable dans une tâche.
+    """
+    if location is None:
+        return NetworkGraph.from_layers(canal_layer, fosse_layer, alias, sources) if build else None
+
+    key, path = location
+    g = load_snapshot(path, key)
+    if g is not None:
+        g.canal_layer = canal_layer
+        g.fosse_layer = fosse_layer
+        g.alias = alias
+        return g
+    if not build:
+        return None
+
+    g = NetworkGraph.from_layers(canal_layer, fosse_layer, alias, sources)
+    try:
+        save_snapshot(g, path, key)
+        purge_snapshots(os.path.dirname(path), keep=path)
+    except OSError:
+        pass
+    return g
@@ -2,20 +2,202 @@
 # cheminer_indus/core/industrials.py
 
 from __future__ import annotations
-from typing import List, Dict, Set, Optional
+from typing import Iterable, List, Dict, Set, Optional
 
-from qgis.core import QgsVectorLayer, QgsExpression, QgsFeatureRequest
+from qgis.core import QgsVectorLayer, QgsFeatureRequest
+
+
+def _key(v) -> str:
+    """Identifiant normalisé (texte sans espaces ; '' si vide ou INCONNU)."""
+    s = "" if v is None else str(v).strip()
+    return "" if s.upper() in ("", "INCONNU", "NULL") else s
+
+
+class LiaisonIndex:
+    """
+    Index nœud → liaisons → industriels, lus une fois (attributs seuls) :
+      node_liaisons : id_ouvrage → FIDs de liaison
+      liaison_indus : FID de liaison → id_industriel
+      indus_fids    : id industriel → FIDs de la couche INDUS
+    Identifiants normalisés comme `trim(...)` côté expressions.
+    Une liaison éditée est relue seule (`put_liaison` / `remove_liaison`).
+    """
+
+    def __init__(self, liaison_layer: Optional[QgsVectorLayer],
+                 indus_layer: Optional[QgsVectorLayer]):
+        self.node_liaisons: Dict[str, List[int]] = {}
+        self.liaison_indus: Dict[int, str] = {}
+        self.indus_fids: Dict[str, List[int]] = {}
+        self._liaison_node: Dict[int, str] = {}
+
+        if liaison_layer is not None and liaison_layer.isValid():
+            req = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry)
+            req.setSubsetOfAttributes(["id_ouvrage", "id_industriel"], liaison_layer.fields())
+            for f in liaison_layer.getFeatures(req):
+                self._add_liaison(f)
+
+        if indus_layer is not None and indus_layer.isValid():
+            req = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry)
+            req.setSubsetOfAttributes(["id"], indus_layer.fields())
+            for f in indus_layer.getFeatures(req):
+                ind = _key(f["id"])
+                if ind:
+                    self.indus_fids.setdefault(ind, []).append(f.id())
+
+    def _add_liaison(self, f) -> None:
+        fid = f.id()
+        node, ind = _key(f["id_ouvrage"]), _key(f["id_industriel"])
+        if node:
+            self.node_liaisons.setdefault(node, []).append(fid)
+            self._liaison_node[fid] = node
+        if ind:
+            self.liaison_indus[fid] = ind
+
+    def remove_liaison(self, fid: int) -> None:
+        node = self._liaison_node.pop(fid, None)
+        if node is not None:
+            fids = self.node_liaisons[node]
+            fids.remove(fid)
+            if not fids:
+                del self.node_liaisons[node]
+        self.liaison_indus.pop(fid, None)
+
+    def put_liaison(self, f) -> None:
+        """Ajoute ou remplace une liaison (entité de la couche LIAISON)."""
+        self.remove_liaison(f.id())
+        self._add_liaison(f)
+
+    def commit_liaisons(self, features) -> None:
+        """Après validation : les FIDs temporaires (< 0) deviennent définitifs."""
+        for fid in [fid for fid in set(self._liaison_node) | set(self.liaison_indus) if fid < 0]:
+            self.remove_liaison(fid)
+        for f in features:
+            self.put_liaison(f)
+
+    def liaisons_of_nodes(self, nodes: Iterable[str]) -> List[int]:
+        out: List[int] = []
+        for n in {_key(n) for n in nodes}:
+            out.extend(self.node_liaisons.get(n, ()))
+        return sorted(out)
+
+    def indus_of_liaisons(self, lids: Iterable[int]) -> Set[str]:
+        get = self.liaison_indus.get
+        return {i for i in map(get, lids) if i}
+
+    def fids_of_indus(self, ids: Iterable[str]) -> List[int]:
+        out: List[int] = []
+        for i in {_key(i) for i in ids}:
+            out.extend(self.indus_fids.get(i, ()))
+        return sorted(out)
 
 
 class IndustrialsService:
     """
     Opérations sur Industriels & Liaisons.
+
+    Les résolutions nœuds → liaisons → industriels passent par un
+    `LiaisonIndex` construit à la première demande. Une édition de LIAISON
+    n'y relit que l'entité concernée (comme `NetworkGraph.refresh_feature`
+    pour les tronçons) ; une édition de INDUS, ou une annulation, l'oublie.
+
+    Les fiches industriels ({champ: valeur}) sont lues par lots
+    (`fetch_many`) et gardées en cache ; une modification d'attribut
+    n'oublie que la fiche concernée, les autres éditions tout le cache.
     """
 
+    _EDIT_SIGNALS = ("featureAdded", "featureDeleted", "attributeValueChanged",
+                     "committedFeaturesAdded", "afterRollBack")
+
     def __init__(self, indus_layer: Optional[QgsVectorLayer],
                  liaison_layer: Optional[QgsVectorLayer]):
         self.indus_layer = indus_layer
         self.liaison_layer = liaison_layer
+        self._index: Optional[LiaisonIndex] = None
+        self._watched = False
+        self._records: Dict[str, Dict[str, str]] = {}   # id normalisé → fiche
+        self._record_of_fid: Dict[int, str] = {}
+
+    # ------------------------------------------------------------------
+    # Index
+    # ------------------------------------------------------------------
+    @property
+    def index(self) -> LiaisonIndex:
+        if self._index is None:
+            self._index = LiaisonIndex(self.liaison_layer, self.indus_layer)
+            self._watch()
+        return self._index
+
+    def invalidate(self, *args) -> None:
+        """Oublie les index et les fiches (appelé sur édition des couches)."""
+        self._index = None
+        self._records = {}
+        self._record_of_fid = {}
+
+    def _indus_attribute_changed(self, fid: int, idx: int = -1, *args) -> None:
+        if idx < 0 or idx == self.indus_layer.fields().indexOf("id"):
+            self._index = None
+        key = self._record_of_fid.pop(fid, None)
+        if key is not None:
+            self._records.pop(key, None)
+
+    def _refresh_liaison(self, fid: int, idx: int = -1, *args) -> None:
+        """Relit une liaison ajoutée ou modifiée (id_ouvrage / id_industriel)."""
+        if self._index is None:
+            return
+        if idx >= 0:
+            names = self.liaison_layer.fields().names()
+            if idx >= len(names) or names[idx] not in ("id_ouvrage", "id_industriel"):
+                return
+        f = self.liaison_layer.getFeature(fid)
+        if f.isValid():
+            self._index.put_liaison(f)
+        else:
+            self._index.remove_liaison(fid)
+
+    def _liaison_deleted(self, fid: int) -> None:
+        if self._index is not None:
+            self._index.remove_liaison(fid)
+
+    def _liaisons_committed(self, _layer_id, features) -> None:
+        if self._index is not None:
+            self._index.commit_liaisons(features)
+
+    def _watch(self) -> None:
+        if self._watched:
+            return
+        drop_index = lambda *args: setattr(self, "_index", None)
+        liaison_slots = {
+            "featureAdded": self._refresh_liaison,
+            "featureDeleted": self._liaison_deleted,
+            "attributeValueChanged": self._refresh_liaison,
+            "committedFeaturesAdded": self._liaisons_committed,
+            "afterRollBack": drop_index,
+        }
+        for layer in (self.liaison_layer, self.indus_layer):
+            if layer is None:
+                continue
+            for sig in self._EDIT_SIGNALS:
+                if layer is self.indus_layer:
+                    slot = self._indus_attribute_changed if sig == "attributeValueChanged" else self.invalidate
+                else:
+                    slot = liaison_slots[sig]
+                try:
+                    getattr(layer, sig).connect(slot)
+                except (AttributeError, RuntimeError, TypeError):
+                    pass
+        self._watched = True
+
+    def liaison_fids_of_nodes(self, nodes: Iterable[str]) -> List[int]:
+        """FIDs des liaisons raccordées aux nœuds donnés."""
+        if not self.liaison_layer:
+            return []
+        return self.index.liaisons_of_nodes(nodes)
+
+    def indus_fids_of(self, ids: Iterable[str]) -> List[int]:
+        """FIDs (couche INDUS) des industriels donnés par ID."""
+        if not self.indus_layer:
+            return []
+        return self.index.fids_of_indus(ids)
 
     # ------------------------------------------------------------------
     # Sélection via nœuds atteints
@@ -25,25 +207,10 @@ class IndustrialsService:
         À partir d'un ensemble de nœuds, sélectionne les liaisons concernées
         dans la couche LIAISON_INDUS et renvoie la liste de leurs FIDs.
         """
-        if not self.liaison_layer or not nodes:
-            if self.liaison_layer:
-                self.liaison_layer.removeSelection()
+        if not self.liaison_layer:
             return []
-
-        esc = lambda s: (s or "").replace("'", "''")
-        values = ",".join("'{}'".format(esc(n)) for n in nodes if n)
-        if not values:
-            self.liaison_layer.removeSelection()
-            return []
-
-        expr = QgsExpression("\"id_ouvrage\" IN ({})".format(values))
-        req = QgsFeatureRequest(expr)
-        ids = [f.id() for f in self.liaison_layer.getFeatures(req)]
-
-        self.liaison_layer.removeSelection()
-        if ids:
-            self.liaison_layer.selectByIds(ids)
-
+        ids = self.liaison_fids_of_nodes(nodes or ())
+        self.liaison_layer.selectByIds(ids, QgsVectorLayer.SetSelection)
         return ids
 
     def select_industrials_from_selected_liaisons(self) -> List[str]:
@@ -53,23 +220,8 @@ class IndustrialsService:
         """
         if not self.liaison_layer or not self.indus_layer:
             return []
-
-        ind_ids: Set[str] = set()
-        for lf in self.liaison_layer.selectedFeatures():
-            ind = lf['id_industriel']
-            if ind and ind != 'INCONNU':
-                ind_ids.add(str(ind))
-
-        self.indus_layer.removeSelection()
-        if ind_ids:
-            esc = lambda s: (s or "").replace("'", "''")
-            values = ",".join("'{}'".format(esc(i)) for i in ind_ids)
-            exprI = QgsExpression("\"id\" IN ({})".format(values))
-            reqI = QgsFeatureRequest(exprI)
-            fids = [f.id() for f in self.indus_layer.getFeatures(reqI)]
-            if fids:
-                self.indus_layer.selectByIds(fids)
-
+        ind_ids = self.index.indus_of_liaisons(self.liaison_layer.selectedFeatureIds())
+        self.indus_layer.selectByIds(self.index.fids_of_indus(ind_ids), QgsVectorLayer.SetSelection)
         return sorted(ind_ids)
 
     def connected_ids_from_nodes(self, nodes: Set[str]) -> List[str]:
@@ -89,37 +241,49 @@ class IndustrialsService:
         Essaie de normaliser quelques noms usuels (Nom, Adresse, Activite…)
         pour faciliter l'affichage dans le tableau.
         """
-        if not self.indus_layer:
-            return {}
-
-        expr = QgsExpression("\"id\" = '{}'".format(str(ind_id).replace("'", "''")))
-        req = QgsFeatureRequest(expr)
+        return self.fetch_many([ind_id]).get(ind_id, {})
 
-        for f in self.indus_layer.getFeatures(req):
-            out: Dict[str, str] = {}
-            for name in f.fields().names():
-                out[name] = "" if f[name] is None else str(f[name])
+    @staticmethod
+    def _record(f, ind_id: str) -> Dict[str, str]:
+        out: Dict[str, str] = {}
+        for name in f.fields().names():
+            out[name] = "" if f[name] is None else str(f[name])
 
-            # Renommages usuels (on ajoute ces clés si absentes)
-            out.setdefault("Nom", out.get("nom", ""))
-            out.setdefault("Adresse", out.get("adresse", ""))
-            out.setdefault("Activite", out.get("activite", ""))
-            out.setdefault("Risques", out.get("risques", ""))
-            out.setdefault("Produits", out.get("produits", ""))
-            out.setdefault("siret", out.get("SIRET", out.get("siret", "")))
+        # Renommages usuels (on ajoute ces clés si absentes)
+        out.setdefault("Nom", out.get("nom", ""))
+        out.setdefault("Adresse", out.get("adresse", ""))
+        out.setdefault("Activite", out.get("activite", ""))
+        out.setdefault("Risques", out.get("risques", ""))
+        out.setdefault("Produits", out.get("produits", ""))
+        out.setdefault("siret", out.get("SIRET", out.get("siret", "")))
 
-            # Toujours stocker l'id pour le tableau
-            out.setdefault("id", str(ind_id))
-
-            return out
-
-        return {}
+        # Toujours stocker l'id pour le tableau
+        out.setdefault("id", str(ind_id))
+        return out
 
     def fetch_many(self, ids: List[str]) -> Dict[str, Dict[str, str]]:
         """
         Renvoie {id_indus: {champ: valeur, ...}, ...}
+        Les fiches absentes du cache sont lues en une requête (FIDs de
+        l'index, sans géométrie) ; un ID inconnu donne {}.
         """
         out: Dict[str, Dict[str, str]] = {}
+        if not self.indus_layer:
+            return {i: {} for i in ids}
+
+        missing = {_key(i) for i in ids} - set(self._records)
+        missing.discard("")
+        fids = self.index.fids_of_indus(missing)
+        if fids:
+            req = QgsFeatureRequest().setFilterFids(fids)
+            req.setFlags(QgsFeatureRequest.NoGeometry)
+            for f in self.indus_layer.getFeatures(req):
+                key = _key(f["id"])
+                if key in missing and key not in self._records:
+                    self._records[key] = self._record(f, key)
+                    self._record_of_fid[f.id()] = key
+
         for i in ids:
-            out[i] = self.fetch(i)
+            rec = self._records.get(_key(i))
+            out[i] = dict(rec) if rec is not None else {}
         return out
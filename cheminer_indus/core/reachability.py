@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+# cheminer_indus/core/reachability.py
+
+"""
+Index d'accessibilité amont / aval sur le graphe réseau.
+
+Construit une fois par version du graphe :
+  1. condensation des composantes fortement connexes (boucles, mailles,
+     tronçons à contre-sens) → DAG de composantes ;
+  2. forêt couvrante du DAG (chaque composante garde UN successeur aval)
+     numérotée en préordre : l'amont d'une composante est un intervalle
+     contigu de `node_order`.
+
+Un réseau d'assainissement est presque toujours une forêt (chaque regard a
+un seul exutoire) : les requêtes sont alors en temps constant. Une
+composante à plusieurs successeurs (déversoir, bifurcation) n'apporte un
+amont hors intervalle qu'aux composantes situées entre son successeur
+secondaire et leur ancêtre commun dans la forêt : seules celles-ci sont
+marquées inexactes et traitées par un parcours du DAG élagué par l'ordre
+topologique, mémorisé par composante.
+
+La condensation (`Condensation`) sert aussi au rejeu des visites (membres
+des composantes, de l'aval vers l'amont). Le signalement des boucles d'un traçage (`reached_loops`) ne condense que le sous-graphe
+parcouru : ni une modification du réseau ni une nouvelle combinaison de
+filtres n'impose de repasser sur tout le graphe.
+"""
+
+from __future__ import annotations
+
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from .graph import NetworkGraph
+
+
+# ---------------------------------------------------------------------- #
+# Composantes fortement connexes
+# ---------------------------------------------------------------------- #
+
+def strongly_connected(graph: NetworkGraph,
+                       passes: Optional[bytearray] = None,
+                       roots: Optional[Iterable[int]] = None) -> Tuple[array, int]:
+    """
+    Composantes fortement connexes (Tarjan itératif) sur les arêtes vivantes
+    dont les deux extrémités sont connues (et admises par le filtre `passes`).
+
+    roots : si fourni, seuls les nœuds atteignables depuis ces nœuds (par les
+            arêtes admises) sont numérotés ; les autres gardent comp = -1.
+
+    Retour : (comp, nombre de composantes). Les composantes sont numérotées
+    de l'aval vers l'amont : pour toute arête u → v entre composantes
+    distinctes, comp[v] < comp[u].
+    """
+    n = graph.node_count
+    dst = graph.edge_dst
+    out_edges = graph.out_edges
+
+    def succ(v: int) -> Iterator[int]:
+        for e in out_edges(v):
+            w = dst[e]
+            if w >= 0 and (passes is None or passes[e]):
+                yield w
+
+    index = array("i", [-1]) * n
+    low = array("i", [0]) * n
+    comp = array("i", [-1]) * n
+    on_stack = bytearray(n)
+    stack: List[int] = []
+    counter = 0
+    count = 0
+
+    for root in (range(n) if roots is None else roots):
+        if root < 0 or index[root] != -1:
+            continue
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = 1
+        work = [(root, succ(root))]
+
+        while work:
+            v, it = work[-1]
+            for w in it:
+                if index[w] == -1:
+                    index[w] = low[w] = counter
+                    counter += 1
+                    stack.append(w)
+                    on_stack[w] = 1
+                    work.append((w, succ(w)))
+                    break
+                if on_stack[w] and index[w] < low[v]:
+                    low[v] = index[w]
+            else:
+                work.pop()
+                if work:
+                    u = work[-1][0]
+                    if low[v] < low[u]:
+                        low[u] = low[v]
+                if low[v] == index[v]:
+                    while True:
+                        w = stack.pop()
+                        on_stack[w] = 0
+                        comp[w] = count
+                        if w == v:
+                            break
+                    count += 1
+
+    return comp, count
+
+
+# ---------------------------------------------------------------------- #
+# Condensation
+# ---------------------------------------------------------------------- #
+
+class Condensation:
+    """
+    Composantes fortement connexes du graphe (tronçons vivants).
+
+    comp         : composante de chaque nœud (aval d'abord)
+    comp_offsets / comp_nodes : membres de la composante c =
+        comp_nodes[comp_offsets[c]:comp_offsets[c + 1]]
+    """
+
+    def __init__(self, graph: NetworkGraph):
+        self.graph = graph
+        self.version = graph.version
+
+        comp, nc = strongly_connected(graph)
+        self.comp = comp
+        self.comp_count = nc
+
+        counts = [0] * (nc + 1)
+        for c in comp:
+            counts[c + 1] += 1
+        for i in range(nc):
+            counts[i + 1] += counts[i]
+        self.comp_offsets = array("i", counts)
+        members = array("i", bytes(4 * len(comp)))
+        cursor = counts[:nc]
+        for v, c in enumerate(comp):
+            members[cursor[c]] = v
+            cursor[c] += 1
+        self.comp_nodes = members
+
+    @property
+    def stale(self) -> bool:
+        return self.version != self.graph.version
+
+    def members(self, c: int) -> Sequence[int]:
+        return self.comp_nodes[self.comp_offsets[c]:self.comp_offsets[c + 1]]
+
+
+def reached_loops(graph: NetworkGraph, edges: Sequence[int],
+                  nodes: Iterable[int]) -> List[Tuple[List[int], List[int]]]:
+    """
+    Boucles d'un parcours : composantes fortement connexes du seul
+    sous-graphe parcouru (`edges`, depuis `nodes`).
+
+    Un parcours complet contient toute boucle passant par un de ses nœuds
+    (tous les nœuds et tronçons de la boucle sont atteints) : le résultat est
+    celui de la condensation du graphe entier, pour un coût proportionnel au
+    parcours.
+
+    Retour : [(nœuds de la boucle, tronçons internes parcourus)], dans
+    l'ordre des composantes.
+    """
+    src, dst = graph.edge_src, graph.edge_dst
+    passes = bytearray(graph.edge_count)
+    for e in edges:
+        passes[e] = 1
+    nodes = list(nodes)
+    comp, _ = strongly_connected(graph, passes, nodes)
+
+    members: Dict[int, List[int]] = {}
+    for v in nodes:
+        if v >= 0 and comp[v] >= 0:
+            members.setdefault(comp[v], []).append(v)
+    inner: Dict[int, List[int]] = {}
+    for e in edges:
+        u, v = src[e], dst[e]
+        if u >= 0 and v >= 0 and comp[u] == comp[v] >= 0:
+            inner.setdefault(comp[u], []).append(e)
+    return [(sorted(members[c]), inner[c]) for c in sorted(inner)
+            if len(members[c]) > 1 or any(src[e] == dst[e] for e in inner[c])]
+
+
+def get_condensation(graph: NetworkGraph) -> Condensation:
+    """Condensation du graphe, mise en cache jusqu'à modification."""
+    cond = graph._derived.get("condensation")
+    if cond is None or cond.stale:
+        cond = Condensation(graph)
+        graph._derived["condensation"] = cond
+    return cond
+
+
+# ---------------------------------------------------------------------- #
+# Index
+# ---------------------------------------------------------------------- #
+
+class ReachabilityIndex:
+    """
+    Requêtes d'accessibilité sur les indices de nœuds du graphe.
+
+    is_upstream(a, b)  : a est-il en amont de b (chemin a → … → b, a ≠ b) ?
+    upstream_count(a)  : nombre de nœuds en amont de a (a exclu)
+    iter_upstream(a)   : énumération paresseuse de ces nœuds
+    """
+
+    def __init__(self, graph: NetworkGraph):
+        self.graph = graph
+        self.version = graph.version
+        self._build()
+
+    # ------------------------------------------------------------------ #
+    # Construction
+    # ------------------------------------------------------------------ #
+
+    def _build(self) -> None:
+        g = self.graph
+        cond = get_condensation(g)
+        comp, nc = cond.comp, cond.comp_count
+        self.comp = comp
+        self.comp_count = nc
+        self.comp_offsets = cond.comp_offsets
+        self.comp_nodes = cond.comp_nodes
+
+        # DAG des composantes (successeurs aval / prédécesseurs amont)
+        succ: List[List[int]] = [[] for _ in range(nc)]
+        pred: List[List[int]] = [[] for _ in range(nc)]
+        src, dst = g.edge_src, g.edge_dst
+        dead = g.edge_dead
+        for e in range(g.edge_count):
+            u, v = src[e], dst[e]
+            if u < 0 or v < 0 or dead[e]:
+                continue
+            cu, cv = comp[u], comp[v]
+            if cu != cv:
+                succ[cu].append(cv)
+                pred[cv].append(cu)
+        self._succ = [sorted(set(s)) for s in succ]
+        self._pred = [sorted(set(p)) for p in pred]
+        self.is_forest = all(len(s) <= 1 for s in self._succ)
+
+        # Forêt couvrante : parent = premier successeur aval
+        children: List[List[int]] = [[] for _ in range(nc)]
+        roots: List[int] = []
+        for c, s in enumerate(self._succ):
+            (children[s[0]] if s else roots).append(c)
+
+        # Préordre itératif : chaque composante occupe [lo, hi) dans node_order
+        lo = array("i", [0]) * nc
+        hi = array("i", [0]) * nc
+        order = array("i")
+        offs, nodes = self.comp_offsets, self.comp_nodes
+        for root in roots:
+            stack = [(root, False)]
+            while stack:
+                c, done = stack.pop()
+                if done:
+                    hi[c] = len(order)
+                    continue
+                lo[c] = len(order)
+                order.extend(nodes[offs[c]:offs[c + 1]])
+                stack.append((c, True))
+                stack.extend((k, False) for k in children[c])
+        self._lo, self._hi = lo, hi
+        self.node_order = order
+        self._count_cache: Dict[int, int] = {}
+
+        # Exactitude de l'intervalle : une arête secondaire x → y (hors forêt)
+        # ajoute x à l'amont des ancêtres de y qui ne contiennent pas x.
+        parent = [s[0] if s else -1 for s in self._succ]
+        inexact = bytearray(nc)
+        for x, s in enumerate(self._succ):
+            for y in s[1:]:
+                c = y
+                while c >= 0 and not self._in_subtree(x, c):
+                    inexact[c] = 1
+                    c = parent[c]
+        self._inexact = inexact
+
+    @property
+    def stale(self) -> bool:
+        return self.version != self.graph.version
+
+    # ------------------------------------------------------------------ #
+    # Requêtes
+    # ------------------------------------------------------------------ #
+
+    def _in_subtree(self, c: int, root: int) -> bool:
+        return self._lo[root] <= self._lo[c] < self._hi[root]
+
+    def is_upstream(self, a: int, b: int) -> bool:
+        """True si un chemin a → … → b existe (a ≠ b)."""
+        if a < 0 or b < 0 or a == b:
+            return False
+        ca, cb = self.comp[a], self.comp[b]
+        if ca == cb:
+            return True
+        if ca < cb:  # a est plus en aval dans l'ordre topologique
+            return False
+        if self._in_subtree(ca, cb):
+            return True
+        if not self._inexact[cb]:
+            return False
+
+        # DAG général : parcours aval depuis ca, élagué sous cb
+        seen = {ca}
+        stack = [ca]
+        while stack:
+            c = stack.pop()
+            for s in self._succ[c]:
+                if s == cb or self._in_subtree(s, cb):
+                    return True
+                if s > cb and s not in seen:
+                    seen.add(s)
+                    stack.append(s)
+        return False
+
+    def _upstream_comps(self, cb: int) -> Iterator[int]:
+        """Composantes en amont de cb (cb exclue), par le DAG des prédécesseurs."""
+        seen = {cb}
+        stack = [cb]
+        while stack:
+            c = stack.pop()
+            for p in self._pred[c]:
+                if p not in seen:
+                    seen.add(p)
+                    stack.append(p)
+                    yield p
+
+    def _comp_size(self, c: int) -> int:
+        return self.comp_offsets[c + 1] - self.comp_offsets[c]
+
+    def upstream_count(self, a: int) -> int:
+        """Nombre de nœuds en amont de a (a exclu)."""
+        if a < 0:
+            return 0
+        ca = self.comp[a]
+        if not self._inexact[ca]:
+            return self._hi[ca] - self._lo[ca] - 1
+        n = self._count_cache.get(ca)
+        if n is None:
+            n = sum(self._comp_size(c) for c in self._upstream_comps(ca))
+            self._count_cache[ca] = n
+        return self._comp_size(ca) - 1 + n
+
+    def iter_upstream(self, a: int) -> Iterator[int]:
+        """Nœuds en amont de a (a exclu), produits à la demande."""
+        if a < 0:
+            return
+        ca = self.comp[a]
+        if not self._inexact[ca]:
+            order = self.node_order
+            for i in range(self._lo[ca], self._hi[ca]):
+                if order[i] != a:
+                    yield order[i]
+            return
+        offs, nodes = self.comp_offsets, self.comp_nodes
+        for v in nodes[offs[ca]:offs[ca + 1]]:
+            if v != a:
+                yield v
+        for c in self._upstream_comps(ca):
+            yield from nodes[offs[c]:offs[c + 1]]
+
+
+def get_reachability(graph: NetworkGraph) -> ReachabilityIndex:
+    """Index du graphe, reconstruit à la demande après une modification."""
+    idx = graph._derived.get("reachability")
+    if idx is None or idx.stale:
+        idx = ReachabilityIndex(graph)
+        graph._derived["reachability"] = idx
+    return idx
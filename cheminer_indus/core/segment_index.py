@@ -0,0 +1,364 @@
+# -*- coding: utf-8 -*-
+# cheminer_indus/core/segment_index.py
+
+"""
+Index spatial des segments du réseau (canalisations + fossés).
+
+Chaque géométrie linéaire est découpée en segments (deux sommets consécutifs)
+rangés dans une grille régulière : un segment n'est inscrit que dans les
+cellules qu'il traverse (parcours de grille pas à pas, type DDA). Une requête
+« tronçon le plus proche » n'examine que les cellules voisines du point et
+renvoie le point projeté sur le segment, la position le long du tronçon et
+ses nœuds amont / aval.
+
+L'index est construit une fois puis tenu à jour d'une version du graphe à
+l'autre (`get_segment_index`) : seuls les tronçons du journal des
+modifications sont relus. Les requêtes par lots (`nearest_many`) sont
+vectorisées avec NumPy si disponible (boucle Python sinon — résultats
+identiques).
+"""
+
+from __future__ import annotations
+
+import math
+from array import array
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+from .graph import LAYER_CANAL, LAYER_FOSSE, LAYER_NAMES, NetworkGraph
+
+
+class SnapResult(NamedTuple):
+    """Accrochage d'un point sur le réseau."""
+    edge: int              # indice d'arête du graphe
+    layer: str             # 'canal' / 'fosse'
+    fid: int
+    x: float               # point projeté sur le tronçon
+    y: float
+    distance: float        # distance point → tronçon
+    fraction: float        # position le long du tronçon (0 = amont, 1 = aval)
+    upstream_node: str     # idnini ('' si inconnu)
+    downstream_node: str   # idnterm ('' si inconnu)
+
+
+def _line_parts(geom) -> List[Sequence]:
+    if geom is None or geom.isEmpty():
+        return []
+    if geom.isMultipart():
+        return list(geom.asMultiPolyline())
+    return [geom.asPolyline()]
+
+
+def grid_cells(x0: float, y0: float, x1: float, y1: float,
+               cell: float) -> Iterator[Tuple[int, int]]:
+    """
+    Cellules (i, j) traversées par le segment (x0, y0) → (x1, y1), de la
+    cellule du premier sommet à celle du second (Amanatides & Woo).
+    Un passage exactement par un coin de cellule inscrit aussi l'une des
+    deux cellules voisines : l'ensemble couvre toujours le segment.
+    """
+    i, j = math.floor(x0 / cell), math.floor(y0 / cell)
+    i_end, j_end = math.floor(x1 / cell), math.floor(y1 / cell)
+    yield i, j
+    dx, dy = x1 - x0, y1 - y0
+    step_i = 1 if dx > 0 else -1
+    step_j = 1 if dy > 0 else -1
+    inf = float("inf")
+    # paramètre t ∈ [0, 1] du prochain bord de cellule franchi, sur chaque axe
+    t_i = ((i + (step_i > 0)) * cell - x0) / dx if dx else inf
+    t_j = ((j + (step_j > 0)) * cell - y0) / dy if dy else inf
+    d_i = cell / abs(dx) if dx else inf
+    d_j = cell / abs(dy) if dy else inf
+    while (i, j) != (i_end, j_end):
+        if j == j_end or (i != i_end and t_i < t_j):
+            i += step_i
+            t_i += d_i
+        else:
+            j += step_j
+            t_j += d_j
+        yield i, j
+
+
+class SegmentIndex:
+    """
+    Grille de segments sur les tronçons vivants du graphe.
+
+    cell_size : côté des cellules (unités de la couche) ; par défaut la
+                longueur moyenne des segments.
+    """
+
+    # Mis à jour sur place (voir `update`) : non repris par `NetworkGraph.frozen`
+    immutable = False
+
+    def __init__(self, graph: NetworkGraph, cell_size: Optional[float] = None):
+        self.graph = graph
+        self.version = graph.version
+        self._dead = 0      # segments retirés de la grille (tronçons modifiés)
+        self._has_bounds = False
+        self._read_segments()
+        self._build_grid(cell_size)
+
+    @property
+    def stale(self) -> bool:
+        return self.version != self.graph.version
+
+    def __len__(self) -> int:
+        return len(self.seg_edge)
+
+    # ------------------------------------------------------------------ #
+    # Construction
+    # ------------------------------------------------------------------ #
+
+    def _read_segments(self, fids_by_layer: Optional[Dict[int, List[int]]] = None) -> None:
+        """
+        Découpe en segments les tronçons des couches (tous, ou seulement les
+        FIDs donnés par couche) ; les segments sont ajoutés en fin de tableaux.
+        """
+        from qgis.core import QgsFeatureRequest
+
+        g = self.graph
+        if fids_by_layer is None:
+            self.x0, self.y0 = array("d"), array("d")
+            self.x1, self.y1 = array("d"), array("d")
+            self.seg_edge = array("i")
+            self.seg_along = array("d")     # abscisse du début du segment sur le tronçon
+            self.edge_geom_length: Dict[int, float] = {}
+            self.edge_segs: Dict[int, Tuple[int, int]] = {}  # arête → segments [début, fin)
+
+        for layer_code in (LAYER_CANAL, LAYER_FOSSE):
+            layer = g.layer_of(layer_code)
+            index = g.fid_index(layer_code)
+            if layer is None or not index:
+                continue
+            req = QgsFeatureRequest().setSubsetOfAttributes([])
+            if fids_by_layer is not None:
+                fids = fids_by_layer.get(layer_code)
+                if not fids:
+                    continue
+                req.setFilterFids(fids)
+            for f in layer.getFeatures(req):
+                e = index.get(f.id())
+                if e is None or not f.hasGeometry():
+                    continue
+                first = len(self.seg_edge)
+                along = 0.0
+                for part in _line_parts(f.geometry()):
+                    for a, b in zip(part, part[1:]):
+                        ax, ay, bx, by = a.x(), a.y(), b.x(), b.y()
+                        self.x0.append(ax)
+                        self.y0.append(ay)
+                        self.x1.append(bx)
+                        self.y1.append(by)
+                        self.seg_edge.append(e)
+                        self.seg_along.append(along)
+                        along += math.hypot(bx - ax, by - ay)
+                self.edge_geom_length[e] = along
+                self.edge_segs[e] = (first, len(self.seg_edge))
+
+    def _cells_of(self, s: int) -> Iterator[Tuple[int, int]]:
+        return grid_cells(self.x0[s], self.y0[s], self.x1[s], self.y1[s], self.cell)
+
+    def _build_grid(self, cell_size: Optional[float]) -> None:
+        n = len(self.seg_edge)
+        if not cell_size:
+            total = sum(self.edge_geom_length.values())
+            cell_size = total / n if n and total > 0 else 1.0
+        self.cell = float(cell_size)
+
+        self.grid: Dict[Tuple[int, int], List[int]] = {}
+        self.bounds: Tuple[int, int, int, int] = (0, 0, 0, 0)   # (imin, imax, jmin, jmax)
+        self._register(range(n))
+
+    def _register(self, segments: Iterable[int]) -> None:
+        """Inscrit les segments dans les cellules traversées ; étend `bounds`."""
+        grid = self.grid
+        inf = float("inf")
+        imin, imax, jmin, jmax = inf, -inf, inf, -inf
+        for s in segments:
+            for key in self._cells_of(s):
+                grid.setdefault(key, []).append(s)
+                i, j = key
+                if i < imin:
+                    imin = i
+                if i > imax:
+                    imax = i
+                if j < jmin:
+                    jmin = j
+                if j > jmax:
+                    jmax = j
+        if imin == inf:
+            return
+        if self._has_bounds:
+            bi, bI, bj, bJ = self.bounds
+            imin, imax, jmin, jmax = min(imin, bi), max(imax, bI), min(jmin, bj), max(jmax, bJ)
+        self.bounds = (imin, imax, jmin, jmax)
+        self._has_bounds = True
+
+    # ------------------------------------------------------------------ #
+    # Mise à jour
+    # ------------------------------------------------------------------ #
+
+    def update(self) -> bool:
+        """
+        Rattrape les modifications du graphe depuis la dernière version
+        indexée : les segments des tronçons modifiés sont retirés de la
+        grille, puis ceux des tronçons encore vivants sont relus.
+        False si le journal ne remonte pas assez loin ou si la moitié des
+        segments indexés sont périmés (reconstruire).
+        """
+        g = self.graph
+        changed = g.changed_edges_since(self.version)
+        if changed is None:
+            return False
+
+        for e in changed:
+            first, end = self.edge_segs.pop(e, (0, 0))
+            self._dead += end - first
+            for s in range(first, end):
+                for key in self._cells_of(s):
+                    cell = self.grid.get(key)
+                    if cell is not None and s in cell:
+                        cell.remove(s)
+                        if not cell:
+                            del self.grid[key]
+            self.edge_geom_length.pop(e, None)
+
+        fids: Dict[int, List[int]] = {}
+        for e in changed:
+            if not g.edge_dead[e]:
+                fids.setdefault(g.edge_layer[e], []).append(g.edge_fid[e])
+        first = len(self.seg_edge)
+        self._read_segments(fids)
+        self._register(range(first, len(self.seg_edge)))
+        self.version = g.version
+        # Trop de segments morts dans les tableaux : reconstruire
+        return self._dead * 2 <= len(self.seg_edge)
+
+    # ------------------------------------------------------------------ #
+    # Requêtes
+    # ------------------------------------------------------------------ #
+
+    def _result(self, s: int, t: float, d2: float) -> SnapResult:
+        g = self.graph
+        e = self.seg_edge[s]
+        dx, dy = self.x1[s] - self.x0[s], self.y1[s] - self.y0[s]
+        along = self.seg_along[s] + t * math.hypot(dx, dy)
+        total = self.edge_geom_length.get(e, 0.0)
+        src, dst = g.edge_src[e], g.edge_dst[e]
+        return SnapResult(
+            e, LAYER_NAMES[g.edge_layer[e]], g.edge_fid[e],
+            self.x0[s] + t * dx, self.y0[s] + t * dy, math.sqrt(d2),
+            along / total if total > 0 else 0.0,
+            g.node_ids[src] if src >= 0 else "",
+            g.node_ids[dst] if dst >= 0 else "",
+        )
+
+    def _project(self, s: int, px: float, py: float) -> Tuple[float, float]:
+        """(t, distance²) du point au segment s, t ∈ [0, 1]."""
+        x0, y0 = self.x0[s], self.y0[s]
+        dx, dy = self.x1[s] - x0, self.y1[s] - y0
+        len2 = dx * dx + dy * dy
+        t = ((px - x0) * dx + (py - y0) * dy) / len2 if len2 > 0 else 0.0
+        t = min(max(t, 0.0), 1.0)
+        qx, qy = x0 + t * dx - px, y0 + t * dy - py
+        return t, qx * qx + qy * qy
+
+    def nearest(self, x: float, y: float,
+                max_distance: float = float("inf")) -> Optional[SnapResult]:
+        """
+        Segment le plus proche de (x, y) à au plus `max_distance`
+        (à égalité, le premier segment indexé). None si aucun.
+        """
+        if not self.grid:
+            return None
+        c = self.cell
+        ci, cj = math.floor(x / c), math.floor(y / c)
+        limit = max_distance * max_distance
+        best: Optional[Tuple[float, int, float]] = None
+        seen = set()
+        # anneaux de cellules : tout segment de l'anneau k est à plus de (k - 1) × cellule
+        imin, imax, jmin, jmax = self.bounds
+        max_ring = max(ci - imin, imax - ci, cj - jmin, jmax - cj)
+        k = 0
+        while k <= max_ring and (k - 1) * c <= max_distance:
+            if best is not None and best[0] <= ((k - 1) * c) ** 2:
+                break
+            for i in range(ci - k, ci + k + 1):
+                edge_row = i in (ci - k, ci + k)
+                for j in (range(cj - k, cj + k + 1) if edge_row else (cj - k, cj + k)):
+                    for s in self.grid.get((i, j), ()):
+                        if s in seen:
+                            continue
+                        seen.add(s)
+                        t, d2 = self._project(s, x, y)
+                        if d2 <= limit and (best is None or (d2, s) < (best[0], best[1])):
+                            best = (d2, s, t)
+            k += 1
+        if best is None:
+            return None
+        d2, s, t = best
+        return self._result(s, t, d2)
+
+    def nearest_many(self, points: Iterable[Tuple[float, float]],
+                     max_distance: float) -> List[Optional[SnapResult]]:
+        """
+        `nearest` pour une série de points (même ordre en sortie).
+        Les points sont regroupés par cellule : chaque groupe est confronté
+        en une fois aux segments de la fenêtre de rayon `max_distance`.
+        """
+        points = [(float(x), float(y)) for x, y in points]
+        if not NUMPY_AVAILABLE or not self.grid or math.isinf(max_distance):
+            return [self.nearest(x, y, max_distance) for x, y in points]
+
+        c = self.cell
+        r = int(math.ceil(max_distance / c))
+        groups: Dict[Tuple[int, int], List[int]] = {}
+        for k, (x, y) in enumerate(points):
+            groups.setdefault((math.floor(x / c), math.floor(y / c)), []).append(k)
+
+        x0 = np.frombuffer(self.x0, dtype=np.float64)
+        y0 = np.frombuffer(self.y0, dtype=np.float64)
+        dxs = np.frombuffer(self.x1, dtype=np.float64) - x0
+        dys = np.frombuffer(self.y1, dtype=np.float64) - y0
+        len2s = dxs * dxs + dys * dys
+
+        out: List[Optional[SnapResult]] = [None] * len(points)
+        limit = max_distance * max_distance
+        for (ci, cj), members in groups.items():
+            cand = set()
+            for i in range(ci - r, ci + r + 1):
+                for j in range(cj - r, cj + r + 1):
+                    cand.update(self.grid.get((i, j), ()))
+            if not cand:
+                continue
+            segs = np.fromiter(sorted(cand), dtype=np.int64)
+            px = np.asarray([points[k][0] for k in members])[:, None]
+            py = np.asarray([points[k][1] for k in members])[:, None]
+            sx, sy, dx, dy, len2 = x0[segs], y0[segs], dxs[segs], dys[segs], len2s[segs]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                t = np.where(len2 > 0, ((px - sx) * dx + (py - sy) * dy) / len2, 0.0)
+            t = np.clip(t, 0.0, 1.0)
+            qx, qy = sx + t * dx - px, sy + t * dy - py
+            d2 = qx * qx + qy * qy
+            best = np.argmin(d2, axis=1)
+            for row, k in enumerate(members):
+                col = best[row]
+                if d2[row, col] <= limit:
+                    out[k] = self._result(int(segs[col]), float(t[row, col]), float(d2[row, col]))
+        return out
+
+
+def get_segment_index(graph: NetworkGraph) -> SegmentIndex:
+    """Index des segments du graphe, mis à jour après modification."""
+    idx = graph._derived.get("segments")
+    if idx is not None and idx.stale and idx.graph is graph and idx.update():
+        return idx
+    if idx is None or idx.stale:
+        idx = SegmentIndex(graph)
+        graph._derived["segments"] = idx
+    return idx
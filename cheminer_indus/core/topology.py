@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+# cheminer_indus/core/topology.py
+
+"""
+Contrôle de topologie du réseau sur le graphe unifié (canal + fossé).
+
+Rubriques
+---------
+INCONNU        : extrémité 'INCONNU' (tronçon exclu du graphe)
+EXTREMITE_VIDE : idnini / idnterm non renseigné (le parcours s'arrête)
+AUTO_BOUCLE    : idnini = idnterm
+DOUBLON        : plusieurs tronçons de même couche entre les deux mêmes nœuds
+NOEUD_ABSENT   : nœud de canalisation absent de la couche OUVRAGE
+PENTE_INVERSE  : cote amont plus basse que la cote aval (si les champs existent)
+
+Un passage complet est linéaire en nombre de tronçons. Ensuite `update()` ne
+réexamine que les tronçons modifiés depuis le dernier contrôle (journal du
+graphe), cotes relues pour eux seuls. La liste des ouvrages est lue au
+contrôle complet (`run`).
+"""
+
+from __future__ import annotations
+
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from .graph import LAYER_CANAL, LAYER_NAMES, NetworkGraph, _norm, resolve_field
+
+CATEGORIES: Dict[str, str] = {
+    "INCONNU": "Extrémité INCONNU",
+    "EXTREMITE_VIDE": "Extrémité non renseignée",
+    "AUTO_BOUCLE": "Tronçon bouclant sur son nœud",
+    "DOUBLON": "Tronçons en double",
+    "NOEUD_ABSENT": "Nœud absent de OUVRAGE",
+    "PENTE_INVERSE": "Pente inversée",
+}
+
+# Cotes amont / aval (radier), premier champ existant
+Z_FIELDS: Dict[str, List[str]] = {
+    "zamont": ["z_amont", "zamont", "cote_amont", "radier_amont"],
+    "zaval": ["z_aval", "zaval", "cote_aval", "radier_aval"],
+}
+
+
+class TopologyIssue(NamedTuple):
+    category: str      # clé de CATEGORIES
+    layer: str         # 'canal' / 'fosse'
+    fid: int
+    node: str          # nœud concerné ('' si le tronçon entier est en cause)
+    message: str
+
+
+def _to_float(v) -> Optional[float]:
+    s = _norm(v)
+    if not s:
+        return None
+    try:
+        return float(s.replace(",", "."))
+    except ValueError:
+        return None
+
+
+class TopologyValidator:
+    """
+    Contrôle de topologie incrémental.
+
+    ouvr_layer : couche OUVRAGE (champ 'idouvrage') ; sans elle, la
+                 rubrique NOEUD_ABSENT n'est pas contrôlée.
+    """
+
+    def __init__(self, graph: NetworkGraph, ouvr_layer=None):
+        self.graph = graph
+        self.ouvr_layer = ouvr_layer
+        self.version = -1
+        self._ouvrages: Optional[Set[str]] = None
+        self._by_edge: Dict[int, List[TopologyIssue]] = {}
+        self._pair_of: Dict[int, Tuple[int, int, int]] = {}
+        self._pairs: Dict[Tuple[int, int, int], Set[int]] = {}
+
+    # ------------------------------------------------------------------ #
+    # API
+    # ------------------------------------------------------------------ #
+
+    def run(self) -> Dict[str, List[TopologyIssue]]:
+        """Contrôle complet du réseau."""
+        g = self.graph
+        self._ouvrages = self._read_ouvrages()
+        self._by_edge = {}
+        self._pair_of = {}
+        self._pairs = {}
+        self.version = g.version
+        self._check(e for e in range(g.edge_count) if not g.edge_dead[e])
+        return self.report()
+
+    def update(self) -> Dict[str, List[TopologyIssue]]:
+        """Contrôle des seuls tronçons modifiés depuis le dernier passage."""
+        g = self.graph
+        if self.version < 0:
+            return self.run()
+        changed = g.changed_edges_since(self.version)
+        if changed is None:
+            return self.run()
+        self.version = g.version
+        if changed:
+            self._check(changed)
+        return self.report()
+
+    def report(self) -> Dict[str, List[TopologyIssue]]:
+        """Anomalies par rubrique (ordre de CATEGORIES), triées par couche / FID."""
+        out: Dict[str, List[TopologyIssue]] = {k: [] for k in CATEGORIES}
+        for issues in self._by_edge.values():
+            for it in issues:
+                out[it.category].append(it)
+        for lc, fid in self.graph.unknown_edges:
+            out["INCONNU"].append(TopologyIssue(
+                "INCONNU", LAYER_NAMES[lc], fid, "INCONNU",
+                "Extrémité INCONNU : tronçon exclu du cheminement"))
+        for issues in out.values():
+            issues.sort(key=lambda it: (it.layer, it.fid, it.node))
+        return out
+
+    # ------------------------------------------------------------------ #
+    # Contrôles
+    # ------------------------------------------------------------------ #
+
+    def _read_ouvrages(self) -> Optional[Set[str]]:
+        if self.ouvr_layer is None or "idouvrage" not in self.ouvr_layer.fields().names():
+            return None
+        from qgis.core import QgsFeatureRequest
+
+        req = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry)
+        req.setSubsetOfAttributes(["idouvrage"], self.ouvr_layer.fields())
+        return {_norm(f["idouvrage"]) for f in self.ouvr_layer.getFeatures(req)}
+
+    def _read_slopes(self, edges: List[int]) -> Dict[int, Tuple[float, float]]:
+        """Cotes (amont, aval) des canalisations données, lues en une requête."""
+        g = self.graph
+        layer = g.layer_of(LAYER_CANAL)
+        if layer is None or not edges:
+            return {}
+        names = layer.fields().names()
+        fz0 = resolve_field(names, g.alias.get("zamont", Z_FIELDS["zamont"]))
+        fz1 = resolve_field(names, g.alias.get("zaval", Z_FIELDS["zaval"]))
+        if not fz0 or not fz1:
+            return {}
+        from qgis.core import QgsFeatureRequest
+
+        by_fid = {g.edge_fid[e]: e for e in edges}
+        req = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry)
+        req.setSubsetOfAttributes([fz0, fz1], layer.fields())
+        if len(by_fid) < g.edge_count:
+            req.setFilterFids(list(by_fid))
+        out: Dict[int, Tuple[float, float]] = {}
+        for f in layer.getFeatures(req):
+            e = by_fid.get(f.id())
+            z0, z1 = _to_float(f[fz0]), _to_float(f[fz1])
+            if e is not None and z0 is not None and z1 is not None:
+                out[e] = (z0, z1)
+        return out
+
+    def _check(self, edges: Iterable[int]) -> None:
+        g = self.graph
+        src, dst, layer, fid, dead = g.edge_src, g.edge_dst, g.edge_layer, g.edge_fid, g.edge_dead
+        ids, ouvr = g.node_ids, self._ouvrages
+        edges = list(edges)
+        touched: Set[Tuple[int, int, int]] = set()
+
+        for e in edges:
+            self._by_edge.pop(e, None)
+            old = self._pair_of.pop(e, None)
+            if old is not None:
+                self._pairs[old].discard(e)
+                touched.add(old)
+        live = [e for e in edges if not dead[e]]
+        slopes = self._read_slopes([e for e in live if layer[e] == LAYER_CANAL])
+
+        for e in live:
+            a, b, name, f = src[e], dst[e], LAYER_NAMES[layer[e]], fid[e]
+            issues: List[TopologyIssue] = []
+            if a < 0 or b < 0:
+                which = "idnini et idnterm" if a < 0 and b < 0 else "idnini" if a < 0 else "idnterm"
+                known = a if a >= 0 else b
+                issues.append(TopologyIssue(
+                    "EXTREMITE_VIDE", name, f, ids[known] if known >= 0 else "",
+                    "{} non renseigné".format(which)))
+            elif a == b:
+                issues.append(TopologyIssue(
+                    "AUTO_BOUCLE", name, f, ids[a], "Tronçon bouclant sur le nœud {}".format(ids[a])))
+            if ouvr is not None and layer[e] == LAYER_CANAL:
+                for n, pos in ((a, "amont"), (b, "aval")):
+                    if n >= 0 and ids[n] not in ouvr:
+                        issues.append(TopologyIssue(
+                            "NOEUD_ABSENT", name, f, ids[n],
+                            "Nœud {} {} absent de OUVRAGE".format(pos, ids[n])))
+            z = slopes.get(e)
+            if z is not None and z[0] < z[1]:
+                issues.append(TopologyIssue(
+                    "PENTE_INVERSE", name, f, "",
+                    "Cote amont {:.2f} < cote aval {:.2f}".format(z[0], z[1])))
+            if issues:
+                self._by_edge[e] = issues
+
+            if a >= 0 and b >= 0:
+                pair = (layer[e], a, b)
+                self._pair_of[e] = pair
+                self._pairs.setdefault(pair, set()).add(e)
+                touched.add(pair)
+
+        for pair in touched:
+            members = self._pairs.get(pair, set())
+            for e in members:
+                issues = [it for it in self._by_edge.get(e, ()) if it.category != "DOUBLON"]
+                if len(members) > 1:
+                    others = sorted(fid[o] for o in members if o != e)
+                    issues.append(TopologyIssue(
+                        "DOUBLON", LAYER_NAMES[pair[0]], fid[e], "",
+                        "Même tronçon {} → {} que FID {}".format(
+                            ids[pair[1]], ids[pair[2]], ", ".join(map(str, others)))))
+                if issues:
+                    self._by_edge[e] = issues
+                else:
+                    self._by_edge.pop(e, None)
+            if not members:
+                self._pairs.pop(pair, None)
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+# cheminer_indus/core/trace_cache.py
+
+"""
+Cache LRU des résultats de cheminement.
+
+Clé  : (graphe, départ(s), sens, code catégorie, code fonction, version du graphe)
+Valeur : FIDs canal / fossé et indices de nœuds en tableaux compacts, bilan
+         (stats) et boucles.
+
+La version du graphe fait partie de la clé : toute édition des couches rend
+les entrées existantes inaccessibles, et elles sont purgées dès qu'un résultat
+plus récent du même graphe est enregistré. Le cache est borné en octets
+(estimation) ; les entrées les moins récemment utilisées sont évincées.
+
+Le cache est partagé entre le fil principal et les tâches de cheminement
+(`TraceTask`) : toutes les opérations sont protégées par un verrou.
+"""
+
+from __future__ import annotations
+
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Dict, Hashable, List, NamedTuple, Optional, Tuple
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+class CachedTrace(NamedTuple):
+    canal_ids: array      # 'q'
+    fosse_ids: array      # 'q'
+    nodes: array          # 'i' indices de nœuds atteints
+    stats: Dict[str, object]
+    loops: List[Dict[str, List]]
+
+    def nbytes(self) -> int:
+        size = 256
+        for arr in (self.canal_ids, self.fosse_ids, self.nodes):
+            size += len(arr) * arr.itemsize
+        for v in self.stats.values():
+            size += 64 * (len(v) if hasattr(v, "__len__") else 1)
+        for lp in self.loops:
+            size += 64 + 16 * sum(len(v) for v in lp.values())
+        return size
+
+
+class TraceCache:
+    """LRU borné en mémoire (octets estimés)."""
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Tuple, Tuple[CachedTrace, int]]" = OrderedDict()
+        self._latest: Dict[int, int] = {}  # graphe → dernière version enregistrée
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def key(graph, starts: Tuple[str, ...], downstream: bool,
+            cat_code: Optional[int], func_code: Optional[int]) -> Tuple[Hashable, ...]:
+        return (graph.uid, starts, bool(downstream), cat_code, func_code, graph.version)
+
+    def get(self, key: Tuple) -> Optional[CachedTrace]:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key: Tuple, value: CachedTrace) -> None:
+        uid, version = key[0], key[-1]
+        size = value.nbytes()
+        with self._lock:
+            if self._latest.get(uid, -1) < version:
+                self._latest[uid] = version
+                self._drop(lambda k: k[0] == uid and k[-1] < version)
+
+            if size > self.max_bytes:
+                return
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._entries[key] = (value, size)
+            self.bytes += size
+            self._evict()
+
+    def resize(self, max_bytes: int) -> None:
+        """Change le plafond mémoire (évince aussitôt si nécessaire)."""
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._latest.clear()
+            self.bytes = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def _evict(self) -> None:
+        while self.bytes > self.max_bytes and self._entries:
+            _, (_, size) = self._entries.popitem(last=False)
+            self.bytes -= size
+
+    def _drop(self, pred) -> None:
+        for k in [k for k in self._entries if pred(k)]:
+            self.bytes -= self._entries.pop(k)[1]
+
+
+# Cache partagé par tous les tracers
+TRACE_CACHE = TraceCache()
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+# cheminer_indus/core/trace_stats.py
+
+"""
+Statistiques d'un cheminement calculées sur les tableaux du graphe.
+
+Longueurs, types de flux, classes de diamètre et communes sont lus une fois
+à la construction du graphe ; un bilan se réduit ensuite à des sommes
+pondérées sur les indices d'arêtes sélectionnées (NumPy si disponible,
+boucle Python sinon — résultats identiques).
+"""
+
+from __future__ import annotations
+
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+from .graph import NetworkGraph
+
+# Bornes des classes de diamètre (mm)
+DIAMETER_BOUNDS: Tuple[int, ...] = (200, 300, 400, 600, 800, 1000)
+DIAMETER_UNKNOWN = "inconnu"
+
+
+def diameter_labels(bounds: Sequence[int] = DIAMETER_BOUNDS) -> List[str]:
+    """Libellés des classes : '< 200', '200-300', …, '>= 1000'."""
+    labels = ["< {}".format(bounds[0])]
+    labels += ["{}-{}".format(a, b) for a, b in zip(bounds, bounds[1:])]
+    labels.append(">= {}".format(bounds[-1]))
+    return labels
+
+
+def _diameter_class(d: float, bounds: Sequence[int]) -> int:
+    for i, b in enumerate(bounds):
+        if d < b:
+            return i
+    return len(bounds)
+
+
+def trace_stats(graph: NetworkGraph, edges: Iterable[int],
+                bounds: Sequence[int] = DIAMETER_BOUNDS) -> Dict[str, object]:
+    """
+    Bilan des arêtes données.
+
+    Retour
+    ------
+    dict :
+      'total_length' : float
+      'flux_types'   : Set[str]          codes de type rencontrés
+      'by_type'      : Dict[str, float]  longueur par type ('' = non renseigné)
+      'by_diameter'  : Dict[str, float]  longueur par classe de diamètre
+      'by_commune'   : Dict[str, float]  longueur par commune ('' = non renseignée)
+    """
+    edges = list(edges)
+    if NUMPY_AVAILABLE and edges:
+        sums = _sums_numpy(graph, edges, bounds)
+    else:
+        sums = _sums_python(graph, edges, bounds)
+    total, by_type_code, by_diam_class, by_commune_code = sums
+
+    types = graph.code_values["type"]
+    communes = graph.code_values["commune"]
+    labels = diameter_labels(bounds) + [DIAMETER_UNKNOWN]
+    by_type = {types[c]: v for c, v in by_type_code.items()}
+    return {
+        "total_length": total,
+        "flux_types": {t for t in by_type if t},
+        "by_type": by_type,
+        "by_diameter": {labels[c]: v for c, v in sorted(by_diam_class.items())},
+        "by_commune": {communes[c]: v for c, v in by_commune_code.items()},
+    }
+
+
+def _sums_numpy(graph: NetworkGraph, edges: List[int], bounds: Sequence[int]):
+    idx = np.asarray(edges, dtype=np.int64)
+    lengths = np.frombuffer(graph.edge_length, dtype=np.float64)[idx]
+    diams = np.frombuffer(graph.edge_diam, dtype=np.float32)[idx]
+    types = np.frombuffer(graph.edge_codes["type"], dtype=np.uint16)[idx]
+    communes = np.frombuffer(graph.edge_codes["commune"], dtype=np.uint16)[idx]
+
+    def per_code(codes) -> Dict[int, float]:
+        sums = np.bincount(codes, weights=lengths)
+        present = np.bincount(codes)
+        return {int(c): float(sums[c]) for c in np.nonzero(present)[0]}
+
+    classes = np.digitize(diams, np.asarray(bounds, dtype=np.float32), right=False)
+    classes[diams <= 0] = len(bounds) + 1
+    return float(lengths.sum()), per_code(types), per_code(classes), per_code(communes)
+
+
+def _sums_python(graph: NetworkGraph, edges: List[int], bounds: Sequence[int]):
+    lengths = graph.edge_length
+    diams = graph.edge_diam
+    types = graph.edge_codes["type"]
+    communes = graph.edge_codes["commune"]
+    total = 0.0
+    by_type: Dict[int, float] = {}
+    by_diam: Dict[int, float] = {}
+    by_commune: Dict[int, float] = {}
+    unknown = len(bounds) + 1
+    for e in edges:
+        length = lengths[e]
+        total += length
+        by_type[types[e]] = by_type.get(types[e], 0.0) + length
+        c = _diameter_class(diams[e], bounds) if diams[e] > 0 else unknown
+        by_diam[c] = by_diam.get(c, 0.0) + length
+        by_commune[communes[e]] = by_commune.get(communes[e], 0.0) + length
+    return total, by_type, by_diam, by_commune
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+# cheminer_indus/core/trace_task.py
+
+"""
+Cheminement en tâche de fond (QgsTask), interruptible.
+
+Le parcours s'exécute sur une copie figée du graphe (`NetworkGraph.frozen`) :
+les éditions faites pendant la tâche ne la perturbent pas. Sans graphe
+partagé ni instantané disque (premier cheminement), le graphe est construit
+dans la tâche à partir de sources d'entités ; l'emplacement de l'instantané
+est calculé avant, sur le fil principal. Le graphe construit n'est remis au
+tracer et adopté comme graphe partagé qu'à la fin de la tâche. Les tronçons
+atteints sont émis par lots (`batchReady`) pour être sélectionnés au fil de
+l'eau sur le fil principal ; la progression est exprimée en nœuds / tronçons
+visités (`countsChanged`).
+"""
+
+from __future__ import annotations
+
+from typing import Iterable, List, Optional
+
+from qgis.PyQt.QtCore import pyqtSignal
+from qgis.core import QgsTask, QgsVectorLayerFeatureSource
+
+from .graph import LAYER_CANAL, LAYER_FOSSE, NetworkGraph, get_graph, share_graph
+from .graph_snapshot import load_or_build_at, snapshot_location
+from .tracer import NetworkTracer
+
+
+class TraceTask(QgsTask):
+    """
+    Tâche de cheminement.
+
+    Signaux
+    -------
+    batchReady(list, list)   : FIDs canal / fossé nouvellement atteints
+    countsChanged(int, int)  : nœuds visités, tronçons atteints (cumul)
+    traceDone(bool)          : fin de tâche (False si annulée ou en erreur)
+
+    Après `traceDone(True)`, `self.tracer` porte les résultats complets
+    (canal_ids, fosse_ids, last_nodes, total_length, stats, loops…).
+    """
+
+    batchReady = pyqtSignal(list, list)
+    countsChanged = pyqtSignal(int, int)
+    traceDone = pyqtSignal(bool)
+
+    def __init__(self, tracer: NetworkTracer, start_ids: Iterable[str],
+                 downstream: bool = True, batch_size: int = 2000,
+                 description: Optional[str] = None):
+        super().__init__(description or "CheminerIndus : cheminement", QgsTask.CanCancel)
+        # Graphe partagé ou instantané disque ; jamais de construction ici
+        shared = tracer._graph
+        if shared is None:
+            shared = get_graph(tracer.canal_layer, tracer.fosse_layer, tracer.alias, build=False)
+        self._sources = None
+        self._location = None
+        self._built: Optional[NetworkGraph] = None
+        self._worker: Optional[NetworkTracer] = None
+        if shared is None:
+            self._location = snapshot_location(tracer.canal_layer, tracer.fosse_layer, tracer.alias)
+            self._sources = {
+                code: QgsVectorLayerFeatureSource(layer)
+                for code, layer in ((LAYER_CANAL, tracer.canal_layer), (LAYER_FOSSE, tracer.fosse_layer))
+                if layer is not None and layer.isValid()
+            }
+        # Tracer dédié, sur une copie figée du graphe partagé
+        self.tracer = NetworkTracer(
+            canal_layer=tracer.canal_layer,
+            fosse_layer=tracer.fosse_layer,
+            field_alias=tracer.alias,
+            filters=dict(tracer.filters),
+            graph=shared.frozen() if shared is not None else None,
+            cache=tracer.cache,
+        )
+        self.start_ids: List[str] = list(start_ids)
+        self.downstream = downstream
+        self.batch_size = batch_size
+        self.node_total = max(1, shared.node_count if shared is not None else 1)
+        self.nodes_seen = 0
+        self.edges_seen = 0
+        self.error: Optional[str] = None
+
+    def run(self) -> bool:
+        try:
+            tracer = self.tracer
+            if self._sources is not None:
+                t = self.tracer
+                self._built = load_or_build_at(self._location, t.canal_layer, t.fosse_layer,
+                                               t.alias, sources=self._sources)
+                self.node_total = max(1, self._built.node_count)
+                if self.isCanceled():
+                    return False
+                # Tracer propre à la tâche ; remis à `self.tracer` dans finished()
+                tracer = self._worker = NetworkTracer(
+                    canal_layer=t.canal_layer,
+                    fosse_layer=t.fosse_layer,
+                    field_alias=t.alias,
+                    filters=t.filters,
+                    graph=self._built,
+                    cache=t.cache,
+                )
+            g = tracer.graph
+            for edges, nodes in tracer.trace_batches(self.start_ids, self.downstream,
+                                                     self.batch_size):
+                if self.isCanceled():
+                    return False
+                self.nodes_seen += len(nodes)
+                self.edges_seen += len(edges)
+                if edges:
+                    cids, fids = g.fids_by_layer(edges)
+                    self.batchReady.emit(cids, fids)
+                self.countsChanged.emit(self.nodes_seen, self.edges_seen)
+                self.setProgress(min(99.0, 100.0 * self.nodes_seen / self.node_total))
+            if tracer.from_cache:
+                self.batchReady.emit(tracer.canal_ids, tracer.fosse_ids)
+        except Exception as e:
+            self.error = str(e)
+            return False
+        return not self.isCanceled()
+
+    def finished(self, result: bool) -> None:
+        # Graphe construit dans la tâche : adopté comme graphe partagé
+        if self._built is not None:
+            share_graph(self._built)
+            self._built = None
+        if self._worker is not None:
+            self.tracer = self._worker
+            self._worker = None
+        # Résultats acquis : le tracer revient au graphe partagé (copie libérée)
+        self.tracer._graph = None
+        self.traceDone.emit(bool(result))
@@ -2,16 +2,20 @@
 
 from __future__ import annotations
 
-from typing import Dict, Iterable, List, Optional, Set, Tuple
+from array import array
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
 
 from qgis.core import (
-    QgsFeature,
-    QgsFeatureRequest,
     QgsGeometry,
     QgsVectorLayer,
-    QgsExpression,
 )
 
+from .graph import LAYER_CANAL, LAYER_FOSSE, LAYER_NAMES, NetworkGraph, PathResult, get_graph, merge_alias
+from .reachability import ReachabilityIndex, get_reachability, reached_loops
+from .segment_index import get_segment_index
+from .trace_cache import TRACE_CACHE, CachedTrace, TraceCache
+from .trace_stats import trace_stats
+
 
 def _as_str(v) -> str:
     if v is None:
@@ -19,6 +23,16 @@ def _as_str(v) -> str:
     return str(v)
 
 
+class TraceEdge(NamedTuple):
+    """Tronçon livré par `NetworkTracer.iter_trace`."""
+    layer: str        # 'canal' / 'fosse'
+    fid: int
+    from_node: str    # nœud par lequel le parcours atteint le tronçon
+    to_node: str      # nœud suivant dans le sens du parcours
+    distance: float   # longueur cumulée depuis le départ, tronçon compris
+    depth: int        # nombre de tronçons depuis le départ (1 = tronçon de départ)
+
+
 class NetworkTracer:
     """
     Traçage unifié sur 2 couches linéaires formant UN SEUL graphe topologique :
@@ -27,6 +41,8 @@ class NetworkTracer:
 
     La continuité se fait via les nœuds `idnini` / `idnterm`.
     Le parcours peut alterner librement entre canalisation et fossé.
+    Il s'exécute en mémoire sur un `NetworkGraph` (lu une seule fois par
+    couple de couches, puis partagé).
 
     Paramètres
     ----------
@@ -40,13 +56,34 @@ class NetworkTracer:
          - 'func' : fonction      (ex. fonccanass)
          - 'type' : type de flux  (ex. typreseau: '01','02','03')
          - 'len'  : longueur      (ex. l_longcana_reelle)
+         - 'diam' : diamètre      (ex. diametre, en mm)
+         - 'commune' : commune    (ex. code_insee)
     filters : Optional[Dict[str, str]]
         Filtres applicables : {'category': '01/02/03' ou '', 'function': '01/02' ou ''}
+    graph : Optional[NetworkGraph]
+        Graphe déjà construit (sinon graphe partagé des deux couches).
+    cache : Optional[TraceCache]
+        Cache des résultats (par défaut le cache partagé ; None = désactivé).
 
     Attributs résultats (après trace)
     ---------------------------------
     total_length : float         Longueur cumulée suivie
     flux_types   : Set[str]      Codes rencontrés (ex. {'01','02'})
+    stats        : Dict[str, …]  Bilan complet (voir `trace_stats`) : longueur
+                                 par type, par classe de diamètre, par commune
+    canal_ids    : List[int]     FIDs canalisations atteints
+    fosse_ids    : List[int]     FIDs fossés atteints
+    last_nodes   : Set[str]      Nœuds atteints (départ inclus)
+    loops        : List[Dict[str, List]]
+                   Boucles (composantes fortement connexes) traversées :
+                   {'nodes': [...], 'canal_ids': [...], 'fosse_ids': [...]}
+    attribution  : Dict[str, Tuple[List[int], List[int]]]
+                   Après `trace_many` : (canal_ids, fosse_ids) atteints en
+                   premier par chaque départ
+    frontier     : Dict[str, Tuple[float, int]]
+                   Après un parcours borné : nœuds où la borne a arrêté le
+                   parcours → (longueur cumulée, nombre de tronçons) ;
+                   `extend` le prolonge depuis là
     """
 
     def __init__(
@@ -55,189 +92,324 @@ class NetworkTracer:
         fosse_layer: Optional[QgsVectorLayer] = None,
         field_alias: Optional[Dict[str, Iterable[str]]] = None,
         filters: Optional[Dict[str, str]] = None,
+        graph: Optional[NetworkGraph] = None,
+        cache: Optional[TraceCache] = TRACE_CACHE,
     ):
         self.canal_layer = canal_layer
         self.fosse_layer = fosse_layer if (fosse_layer and fosse_layer.isValid()) else None
         self.filters = filters or {"category": "", "function": ""}
 
-        # Alias par défaut
-        self.alias: Dict[str, List[str]] = {
-            "cat": ["contcanass", "categorie", "cat_reseau"],
-            "func": ["fonccanass", "fonction", "function"],
-            "type": ["typreseau", "type_reseau"],
-            "len": ["l_longcana_reelle", "longueur", "length"],
-        }
-        if field_alias:
-            for k, v in field_alias.items():
-                if v:
-                    self.alias[k] = list(v)
+        # Alias par défaut, complétés par ceux fournis
+        self.alias: Dict[str, List[str]] = merge_alias(field_alias)
 
-        # Caches (par couche) pour éviter de tester 15 fois les mêmes noms
-        self._layer_field_name_cache: Dict[str, Dict[str, Optional[str]]] = {}
+        self._graph: Optional[NetworkGraph] = graph
+        self.cache = cache
+        self.from_cache: bool = False
+        self.frontier: Dict[str, Tuple[float, int]] = {}
+        self._bounded: Optional[Dict[str, object]] = None
 
         # Stats
         self.total_length: float = 0.0
         self.flux_types: Set[str] = set()
+        self.stats: Dict[str, object] = {}
+
+        # Résultats du dernier parcours
+        self.canal_ids: List[int] = []
+        self.fosse_ids: List[int] = []
+        self.last_nodes: Set[str] = set()
+        self.loops: List[Dict[str, List]] = []
+        self.attribution: Dict[str, Tuple[List[int], List[int]]] = {}
 
     # ------------------------------------------------------------------ #
-    # Utils champs / valeurs
+    # Graphe
     # ------------------------------------------------------------------ #
 
-    def _layer_id(self, layer: QgsVectorLayer) -> str:
-        return layer.id()
-
-    def _resolve_field_name(self, layer: QgsVectorLayer, key: str) -> Optional[str]:
-        """
-        Retourne le premier nom de champ existant pour la clé d'alias donnée.
-        Résultat mis en cache par couche.
-        """
-        lid = self._layer_id(layer)
-        cache = self._layer_field_name_cache.setdefault(lid, {})
-        if key in cache:
-            return cache[key]
-
-        wanted = self.alias.get(key, [])
-        names = set(layer.fields().names())
-        for cand in wanted:
-            if cand in names:
-                cache[key] = cand
-                return cand
-        cache[key] = None
-        return None
-
-    def _feat_val_by_key(self, layer: QgsVectorLayer, feat: QgsFeature, key: str) -> Optional[str]:
+    @property
+    def graph(self) -> NetworkGraph:
+        if self._graph is None:
+            self._graph = get_graph(self.canal_layer, self.fosse_layer, self.alias)
+        return self._graph
+
+    @property
+    def reachability(self) -> ReachabilityIndex:
+        """Index d'accessibilité du graphe (reconstruit après modification)."""
+        return get_reachability(self.graph)
+
+    def is_upstream(self, node_a: str, node_b: str) -> bool:
+        """True si le nœud A est en amont du nœud B (sans filtre)."""
+        g = self.graph
+        return self.reachability.is_upstream(g.node(node_a), g.node(node_b))
+
+    def upstream_count(self, node_id: str) -> int:
+        """Nombre de nœuds en amont du nœud donné (sans filtre)."""
+        return self.reachability.upstream_count(self.graph.node(node_id))
+
+    def iter_upstream(self, node_id: str) -> Iterator[str]:
+        """Identifiants des nœuds en amont, produits à la demande."""
+        g = self.graph
+        ids = g.node_ids
+        for n in self.reachability.iter_upstream(g.node(node_id)):
+            yield ids[n]
+
+    def path_between(self, src_id: str, dst_id: str, weight: Optional[str] = "length") -> Dict[str, object]:
         """
-        Lit la valeur d'un champ (par clé d'alias) si présent sur la couche.
-        """
-        fname = self._resolve_field_name(layer, key)
-        if not fname:
-            return None
-        try:
-            val = feat[fname]
-        except Exception:
-            return None
-        return _as_str(val) if val not in (None, "") else None
+        Tronçons entre deux nœuds (sens d'écoulement src → dst).
 
-    def _len_of(self, layer: QgsVectorLayer, feat: QgsFeature) -> float:
-        """
-        Longueur d'un segment : champ 'len' s'il existe, sinon géométrie.
-        """
-        fname = self._resolve_field_name(layer, "len")
-        if fname:
-            try:
-                v = feat[fname]
-                if v not in (None, ""):
-                    return float(v)
-            except Exception:
-                pass
-        g: QgsGeometry = feat.geometry()
-        return float(g.length() if g else 0.0)
-
-    def _pass_filters(self, layer: QgsVectorLayer, feat: QgsFeature) -> bool:
-        """
-        Applique les filtres 'category' et 'function' **si** les champs existent sur la couche.
-        S'ils n'existent pas, on laisse passer (ne pas bloquer les fossés par ex.).
+        Retour
+        ------
+        dict :
+          'canal_ids', 'fosse_ids'         : tronçons situés sur un chemin src → dst
+          'shortest_canal', 'shortest_fosse' : tronçons du plus court chemin
+          'length'                          : poids du plus court chemin (-1 si aucun)
         """
-        fcat = (self.filters.get("category") or "").strip()
-        ffun = (self.filters.get("function") or "").strip()
-
-        if fcat:
-            cat = self._feat_val_by_key(layer, feat, "cat")
-            if cat is not None and cat != fcat:
-                return False
+        g = self.graph
+        res: PathResult = g.path_between(g.node(src_id), g.node(dst_id), weight=weight)
+        canal_ids, fosse_ids = g.fids_by_layer(res.edges)
+        short_c, short_f = g.fids_by_layer(res.shortest)
+        return {
+            "canal_ids": canal_ids,
+            "fosse_ids": fosse_ids,
+            "shortest_canal": short_c,
+            "shortest_fosse": short_f,
+            "length": res.length,
+        }
 
-        if ffun:
-            fun = self._feat_val_by_key(layer, feat, "func")
-            if fun is not None and fun != ffun:
-                return False
+    def _filter_codes(self, filters: Optional[Dict[str, str]] = None) -> Tuple[Optional[int], Optional[int]]:
+        g = self.graph
+        filters = self.filters if filters is None else filters
+        return (g.filter_code("cat", filters.get("category")),
+                g.filter_code("func", filters.get("function")))
 
+    def _reset(self) -> None:
+        self.total_length = 0.0
+        self.flux_types.clear()
+        self.stats = {}
+        self.canal_ids, self.fosse_ids = [], []
+        self.last_nodes = set()
+        self.loops = []
+        self.attribution = {}
+        self.from_cache = False
+        self.frontier = {}
+        self._bounded = None
+
+    def _cache_key(self, starts: List[str], downstream: bool,
+                   codes: Tuple[Optional[int], Optional[int]]) -> Optional[Tuple]:
+        if self.cache is None:
+            return None
+        return TraceCache.key(self.graph, tuple(starts), downstream, *codes)
+
+    def _restore(self, key: Optional[Tuple]) -> bool:
+        """Recharge les résultats depuis le cache ; False si absents."""
+        hit = self.cache.get(key) if key is not None else None
+        if hit is None:
+            return False
+        self.canal_ids = hit.canal_ids.tolist()
+        self.fosse_ids = hit.fosse_ids.tolist()
+        self.last_nodes = self.graph.node_names(hit.nodes)
+        self.last_nodes.update(key[1])
+        self.stats = dict(hit.stats)
+        self.total_length = self.stats["total_length"]
+        self.flux_types = set(self.stats["flux_types"])
+        self.loops = list(hit.loops)
+        self.from_cache = True
         return True
 
+    def _store(self, key: Optional[Tuple], nodes: List[int]) -> None:
+        if key is None:
+            return
+        self.cache.put(key, CachedTrace(
+            array("q", self.canal_ids), array("q", self.fosse_ids),
+            array("i", nodes), self.stats, self.loops,
+        ))
+
+    def _collect(self, edges: List[int], nodes: List[int], starts: Iterable[str]) -> None:
+        """Renseigne les attributs résultats à partir des arêtes / nœuds atteints."""
+        g = self.graph
+        self.loops = self._loops(edges, nodes)
+        self.stats = trace_stats(g, edges)
+        self.total_length = self.stats["total_length"]
+        self.flux_types = set(self.stats["flux_types"])
+
+        self.canal_ids, self.fosse_ids = g.fids_by_layer(edges)
+        self.last_nodes = g.node_names(nodes)
+        for start in starts:
+            start = (start or "").strip()
+            if start:
+                self.last_nodes.add(start)
+
     # ------------------------------------------------------------------ #
     # Parcours unifié
     # ------------------------------------------------------------------ #
 
-    def _iter_edges_from_node(
-        self, node_id: str, downstream: bool
-    ) -> Iterable[Tuple[QgsVectorLayer, QgsFeature, str]]:
-        """
-        Itère sur TOUTES les arêtes sortant du nœud courant, sur canal + fossé.
-        Pour downstream=True : on cherche idnini = node_id  -> next = idnterm
-        Pour downstream=False : on cherche idnterm = node_id -> next = idnini
-        """
-        if not self.canal_layer or not self.canal_layer.isValid():
-            return []
-
-        # Choix du côté à filtrer
-        key_attr = "idnini" if downstream else "idnterm"
-        next_attr = "idnterm" if downstream else "idnini"
-
-        layers = [self.canal_layer]
-        if self.fosse_layer:
-            layers.append(self.fosse_layer)
-
-        results: List[Tuple[QgsVectorLayer, QgsFeature, str]] = []
-        for lyr in layers:
-            expr = QgsExpression(f'"{key_attr}" = \'{node_id}\'')
-            req = QgsFeatureRequest(expr)
-            for feat in lyr.getFeatures(req):
-                idnini = _as_str(feat["idnini"]) if "idnini" in feat.fields().names() else ""
-                idnterm = _as_str(feat["idnterm"]) if "idnterm" in feat.fields().names() else ""
-                if idnini == "INCONNU" or idnterm == "INCONNU":
-                    continue
-
-                if not self._pass_filters(lyr, feat):
-                    continue
-
-                nxt = _as_str(feat[next_attr]) if next_attr in feat.fields().names() else ""
-                if nxt and nxt != "INCONNU":
-                    results.append((lyr, feat, nxt))
-        return results
-
-    def trace(self, start_id: str, downstream: bool = True) -> Tuple[List[int], List[int]]:
+    def _loops(self, edges: List[int], nodes: List[int]) -> List[Dict[str, List]]:
+        """Boucles traversées : composantes bouclées et leurs tronçons internes suivis."""
+        g = self.graph
+        out = []
+        for members, inner in reached_loops(g, edges, nodes):
+            canal, fosse = g.fids_by_layer(inner)
+            out.append({
+                "nodes": sorted(g.node_names(members)),
+                "canal_ids": canal,
+                "fosse_ids": fosse,
+            })
+        return out
+
+    def trace(self, start_id: str, downstream: bool = True,
+              max_hops: Optional[int] = None,
+              max_length_m: Optional[float] = None) -> Tuple[List[int], List[int]]:
         """
         Lance le parcours sur le graphe unifié.
 
+        max_hops / max_length_m : bornes facultatives (nombre de tronçons,
+            longueur cumulée depuis le départ) ; le parcours s'arrête à la
+            borne et mémorise sa frontière (voir `extend`).
+
         Retour
         ------
         (canal_ids, fosse_ids) : List[int], List[int]
             Les FIDs sélectionnés par couche.
         """
-        self.total_length = 0.0
-        self.flux_types.clear()
-
-        visited_nodes: Set[str] = set()
-        canal_ids: List[int] = []
-        fosse_ids: List[int] = []
-
-        stack: List[str] = [start_id]
+        self._reset()
 
-        while stack:
-            cur = stack.pop()
-            if cur in visited_nodes:
-                continue
-            visited_nodes.add(cur)
-
-            for lyr, feat, nxt in self._iter_edges_from_node(cur, downstream):
-                # Accumuler IDs par couche
-                if lyr == self.canal_layer:
-                    canal_ids.append(feat.id())
-                else:
-                    fosse_ids.append(feat.id())
-
-                # Longueur cumulée
-                self.total_length += self._len_of(lyr, feat)
-
-                # Types de flux (si dispo)
-                t = self._feat_val_by_key(lyr, feat, "type")
-                if t:
-                    self.flux_types.add(t)
+        if not self.canal_layer or not self.canal_layer.isValid():
+            return [], []
+
+        g = self.graph
+        codes = self._filter_codes()
+        start = (start_id or "").strip()
+        if max_hops is not None or max_length_m is not None:
+            self._bounded = {
+                "start": start, "downstream": downstream, "codes": codes,
+                "version": g.version, "settled": {}, "taken": set(), "edges": [],
+                "frontier": {g.node(start): (0.0, 0)},
+            }
+            return self._run_bounded(max_hops, max_length_m)
+        key = self._cache_key([start], downstream, codes)
+        if not self._restore(key):
+            edges, nodes = g.walk([g.node(start)], downstream, *codes)
+            self._collect(edges, nodes, [start])
+            self._store(key, nodes)
+
+        return list(self.canal_ids), list(self.fosse_ids)
+
+    def extend(self, max_hops: Optional[int] = None,
+               max_length_m: Optional[float] = None) -> Tuple[List[int], List[int]]:
+        """
+        Prolonge le dernier parcours borné jusqu'aux nouvelles bornes (comptées
+        depuis le départ) sans le recommencer : seule la frontière est reprise.
+        """
+        state = self._bounded
+        if state is None or state["version"] != self.graph.version:
+            if state is None:
+                return list(self.canal_ids), list(self.fosse_ids)
+            return self.trace(state["start"], state["downstream"], max_hops, max_length_m)
+        return self._run_bounded(max_hops, max_length_m)
+
+    def _run_bounded(self, max_hops: Optional[int],
+                     max_length_m: Optional[float]) -> Tuple[List[int], List[int]]:
+        g = self.graph
+        state = self._bounded
+        cat_code, func_code = state["codes"]
+        seeds = {n: state["settled"].get(n, dist) for n, dist in state["frontier"].items()}
+        edges, frontier = g.bounded_walk(
+            seeds, state["downstream"], cat_code, func_code,
+            max_hops=max_hops, max_length=max_length_m,
+            settled=state["settled"], taken=state["taken"],
+        )
+        state["edges"].extend(edges)
+        state["frontier"] = {n: state["settled"][n] for n in frontier}
+
+        self._collect(state["edges"], list(state["settled"]), [state["start"]])
+        self.frontier = {g.node_ids[n]: d for n, d in state["frontier"].items()}
+        return list(self.canal_ids), list(self.fosse_ids)
+
+    def iter_trace(self, start_id: str, downstream: bool = True) -> Iterator[TraceEdge]:
+        """
+        Parcours en largeur livré tronçon par tronçon (voir `TraceEdge`), pour
+        les consommateurs qui peuvent commencer avant la fin du parcours
+        (liaisons, proximité PV, animation). Mêmes filtres que `trace` ;
+        les attributs résultats ne sont pas renseignés.
+        """
+        if not self.canal_layer or not self.canal_layer.isValid():
+            return
+        g = self.graph
+        cat_code, func_code = self._filter_codes()
+        ids, layer, fid = g.node_ids, g.edge_layer, g.edge_fid
+        for e, a, b, dist, depth in g.iter_bfs([g.node((start_id or "").strip())], downstream,
+                                               cat_code, func_code):
+            yield TraceEdge(LAYER_NAMES[layer[e]], fid[e], ids[a], ids[b], dist, depth)
+
+    def trace_batches(
+        self,
+        start_ids: Iterable[str],
+        downstream: bool = True,
+        batch_size: int = 2000,
+    ) -> Iterator[Tuple[List[int], List[int]]]:
+        """
+        Parcours livré par lots d'indices (arêtes, nœuds), pour un affichage
+        progressif ou une exécution interruptible (voir `TraceTask`).
+        Les attributs résultats sont renseignés quand le générateur est épuisé
+        (résultat déjà en cache : aucun lot, `from_cache` vaut True).
+        """
+        self._reset()
+        starts = [s for s in dict.fromkeys((s or "").strip() for s in start_ids) if s]
+        if not starts:
+            return
+
+        g = self.graph
+        codes = self._filter_codes()
+        key = self._cache_key(starts, downstream, codes)
+        if self._restore(key):
+            return
+        all_edges: List[int] = []
+        all_nodes: List[int] = []
+        for edges, nodes in g.iter_walk([g.node(s) for s in starts], downstream,
+                                        cat_code=codes[0], func_code=codes[1],
+                                        batch_size=batch_size):
+            all_edges.extend(edges)
+            all_nodes.extend(nodes)
+            yield edges, nodes
+        self._collect(all_edges, all_nodes, starts)
+        self._store(key, all_nodes)
+
+    def trace_many(
+        self,
+        start_ids: Iterable[str],
+        downstream: bool = True,
+        filters: Optional[Dict[str, str]] = None,
+    ) -> Tuple[List[int], List[int]]:
+        """
+        Parcours unique amorcé depuis plusieurs nœuds (état visité partagé) :
+        le tronc commun n'est parcouru qu'une fois.
 
-                # Continuer
-                if nxt and nxt not in visited_nodes and nxt != "INCONNU":
-                    stack.append(nxt)
+        filters : remplace `self.filters` pour cet appel (None = filtres du tracer)
 
-        return canal_ids, fosse_ids
+        Retour
+        ------
+        (canal_ids, fosse_ids) : union des FIDs atteints par couche.
+        `self.attribution` donne, par départ, les FIDs qu'il a atteints en
+        premier (une arête partagée n'est attribuée qu'à un seul départ).
+        """
+        self._reset()
+        starts = [(s or "").strip() for s in start_ids]
+        starts = [s for s in dict.fromkeys(starts) if s]
+
+        if not starts or not self.canal_layer or not self.canal_layer.isValid():
+            return [], []
+
+        g = self.graph
+        cat_code, func_code = self._filter_codes(filters)
+        owners: List[int] = []
+        edges, nodes = g.walk([g.node(s) for s in starts], downstream,
+                              cat_code=cat_code, func_code=func_code, owners=owners)
+        self._collect(edges, nodes, starts)
+
+        per_source: List[List[int]] = [[] for _ in starts]
+        for e, i in zip(edges, owners):
+            per_source[i].append(e)
+        self.attribution = {s: g.fids_by_layer(es) for s, es in zip(starts, per_source)}
+
+        return list(self.canal_ids), list(self.fosse_ids)
 
     def trace_from_pv(
         self,
@@ -246,7 +418,8 @@ class NetworkTracer:
         search_distance: float = 50.0
     ) -> Tuple[List[int], List[int], Optional[str]]:
         """
-        Lance un cheminement depuis un PV en trouvant la canalisation la plus proche.
+        Lance un cheminement depuis un PV accroché au tronçon (canalisation ou
+        fossé) le plus proche ; le tronçon accroché fait partie du résultat.
         
         Paramètres
         ----------
@@ -262,46 +435,35 @@ class NetworkTracer:
         (canal_ids, fosse_ids, start_node_id) : Tuple[List[int], List[int], Optional[str]]
             Les FIDs sélectionnés par couche et l'ID du nœud de départ trouvé
         """
-        # 1. Trouver la canalisation la plus proche du PV
-        closest_canal = None
-        min_distance = search_distance
-        closest_node_id = None
-        
-        # Créer une bbox autour du PV
+        # 1. Accrocher le PV au tronçon le plus proche (index de segments)
+        g = self.graph
         pv_point = pv_geometry.asPoint()
-        bbox = pv_geometry.buffer(search_distance, 5).boundingBox()
-        
-        # Parcourir les canalisations dans la bbox
-        request = QgsFeatureRequest().setFilterRect(bbox)
-        for feat in self.canal_layer.getFeatures(request):
-            geom = feat.geometry()
-            if not geom or geom.isEmpty():
-                continue
-            
-            # Calculer la distance
-            distance = pv_geometry.distance(geom)
-            
-            if distance < min_distance:
-                min_distance = distance
-                closest_canal = feat
-        
-        if not closest_canal:
-            # Aucune canalisation trouvée dans le rayon de recherche
+        snap = get_segment_index(g).nearest(pv_point.x(), pv_point.y(), search_distance)
+        if snap is None:
+            # Aucun tronçon dans le rayon de recherche
             return [], [], None
-        
-        # 2. Récupérer le nœud de départ (idnini ou idnterm selon downstream)
-        if downstream:
-            # Amont→Aval : partir du nœud amont (idnini)
-            start_node_id = _as_str(closest_canal.attribute("idnini"))
-        else:
-            # Aval→Amont : partir du nœud aval (idnterm)
-            start_node_id = _as_str(closest_canal.attribute("idnterm"))
-        
-        if not start_node_id or start_node_id == "INCONNU":
+
+        # 2. Nœud de départ du côté où le PV rejoint le tronçon :
+        #    Amont→Aval : nœud aval du tronçon ; Aval→Amont : nœud amont
+        start_node_id = snap.downstream_node if downstream else snap.upstream_node
+        if not start_node_id:
             # Nœud invalide
             return [], [], None
-        
-        # 3. Lancer le cheminement depuis ce nœud
+
+        # 3. Lancer le cheminement depuis ce nœud, tronçon accroché compris
+        #    s'il passe les filtres catégorie / fonction
         canal_ids, fosse_ids = self.trace(start_node_id, downstream=downstream)
-        
+        passes = g.edge_filter(*self._filter_codes())
+        ids = canal_ids if snap.layer == "canal" else fosse_ids
+        if (passes is None or passes[snap.edge]) and snap.fid not in ids:
+            ids.insert(0, snap.fid)
+            (self.canal_ids if snap.layer == "canal" else self.fosse_ids).insert(0, snap.fid)
+            edges = [snap.edge]
+            for layer_code, fids in ((LAYER_CANAL, self.canal_ids), (LAYER_FOSSE, self.fosse_ids)):
+                index = g.fid_index(layer_code)
+                edges.extend(index[f] for f in fids if f in index and index[f] != snap.edge)
+            self.stats = trace_stats(g, edges)
+            self.total_length = self.stats["total_length"]
+            self.flux_types = set(self.stats["flux_types"])
+
         return canal_ids, fosse_ids, start_node_id
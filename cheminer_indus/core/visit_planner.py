@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# cheminer_indus/core/visit_planner.py
+
+"""
+Suggestion du prochain regard à ouvrir (recherche par dichotomie).
+
+Sur le sous-réseau restant (sélection courante), chaque nœud candidat est
+noté selon l'équilibre du partage qu'il produit : la masse située en amont
+du nœud (gardée si pollué = OUI) contre le reste (gardé si pollué = NON).
+Le meilleur regard coupe la masse en deux moitiés.
+
+Masse d'un tronçon = longueur × poids de son nœud amont (1 par défaut ;
+p. ex. 1 + nombre d'industriels raccordés, ou probabilité de pollution IA).
+
+Les masses amont sont des sommes de sous-arbres calculées en un passage
+sur le DAG des composantes du seul sous-réseau, de l'amont vers l'aval. Aux bifurcations
+(plusieurs exutoires), une masse amont est comptée sur chaque branche aval.
+"""
+
+from __future__ import annotations
+
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from .graph import NetworkGraph, _norm
+from .reachability import strongly_connected
+
+
+class VisitSuggestion(NamedTuple):
+    node: str
+    upstream: float     # masse en amont du nœud
+    total: float        # masse du sous-réseau
+    balance: float      # min(amont, reste) / total : 0.5 = coupe parfaite
+
+
+def suggest_visits(graph: NetworkGraph, edge_mask: bytearray,
+                   node_weight: Optional[Dict[str, float]] = None,
+                   exclude: Iterable[str] = (),
+                   limit: int = 10) -> List[VisitSuggestion]:
+    """
+    Classe les nœuds du sous-réseau `edge_mask` par équilibre du partage.
+
+    node_weight : poids par nœud amont des tronçons (absent = 1)
+    exclude     : nœuds à ne pas proposer (départ, nœuds déjà visités)
+    limit       : nombre de suggestions renvoyées (0 = toutes)
+    """
+    g = graph
+    src, dst, dead, lengths, ids = g.edge_src, g.edge_dst, g.edge_dead, g.edge_length, g.node_ids
+    weight_of = None
+    if node_weight:
+        weight_of = {g.node(k): float(v) for k, v in node_weight.items() if g.node(k) >= 0}
+
+    edges = [e for e in range(g.edge_count) if edge_mask[e] and not dead[e]]
+    mass: Dict[int, float] = {}
+    for e in edges:
+        m = max(float(lengths[e]), 0.0)
+        if weight_of is not None and src[e] >= 0:
+            m *= weight_of.get(src[e], 1.0)
+        mass[e] = m
+    total = sum(mass.values())
+    if total <= 0:
+        return []
+
+    # Masse amont par composante, de l'amont vers l'aval (numéros décroissants)
+    candidates = {n for e in edges for n in (src[e], dst[e]) if n >= 0}
+    comp, _ = strongly_connected(g, edge_mask, candidates)
+    by_comp: Dict[int, List[int]] = {}
+    for e in edges:
+        w = dst[e]
+        if w >= 0:
+            by_comp.setdefault(comp[w], []).append(e)
+    upstream: Dict[int, float] = {}
+    for c in sorted(by_comp, reverse=True):
+        acc = 0.0
+        for e in by_comp[c]:
+            acc += mass[e]
+            u = src[e]
+            if u >= 0 and comp[u] != c:
+                acc += upstream.get(comp[u], 0.0)
+        upstream[c] = acc
+
+    skip = {_norm(n) for n in exclude}
+    out: List[VisitSuggestion] = []
+    for n in candidates:
+        name = ids[n]
+        if name in skip:
+            continue
+        up = min(upstream.get(comp[n], 0.0), total)
+        out.append(VisitSuggestion(name, up, total, min(up, total - up) / total))
+    out.sort(key=lambda s: (-s.balance, s.node))
+    return out[:limit] if limit else out
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+# cheminer_indus/core/visit_replay.py
+
+"""
+Rejeu d'une liste de visites (observations pollué O/N) sur le graphe.
+
+Chaque visite est une entrée de `MainDock.visited` :
+    {'id': nœud, 'pollution': bool, 'keep': [nœuds amont des branches conservées]}
+('keep' absent = toutes les branches amont conservées).
+
+Traduction ensembliste d'une visite au nœud v :
+  - branche amont non conservée (ou pollué = NON) : la branche et tout son
+    amont sont retirés (amont complet, hors sous-réseau) ;
+  - pollué = OUI : ne restent que les branches conservées et les tronçons
+    menant à leurs nœuds amont (chemins départ → amont si le départ y mène,
+    tout l'amont sinon).
+
+Un seul passage sur le DAG des composantes, de l'aval vers l'amont : un
+bit « retiré » et un bit par visite polluée sont propagés vers l'amont ; un
+tronçon est retenu s'il n'est pas retiré et porte tous les bits des visites
+polluées. L'ordre des visites est indifférent : sur un réseau arborescent le
+résultat est celui des visites successives ; sur un réseau maillé, les
+chemins sont évalués sur le sous-réseau final (au plus quelques tronçons de
+plus que des visites successives).
+"""
+
+from __future__ import annotations
+
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Set
+
+from .graph import NetworkGraph, _norm
+from .reachability import get_condensation
+
+
+class ReplayResult(NamedTuple):
+    """Sous-réseau candidat après rejeu des visites."""
+    edges: List[int]       # indices d'arêtes retenues
+    nodes: List[int]       # extrémités de ces arêtes
+    canal_fids: List[int]
+    fosse_fids: List[int]
+    removed: List[int]     # arêtes du sous-réseau de départ écartées
+
+
+def replay_visits(graph: NetworkGraph, start_id: Optional[str],
+                  visits: Iterable[Dict[str, Any]],
+                  edge_mask: Optional[bytearray] = None) -> ReplayResult:
+    """
+    Applique toutes les visites au sous-réseau `edge_mask` (trace fraîche ;
+    None = tout le réseau) et renvoie le sous-réseau candidat.
+
+    start_id : départ de la trace (chemins départ → branches conservées).
+    """
+    g = graph
+    n_nodes, n_edges = g.node_count, g.edge_count
+    src, dst, dead, ids = g.edge_src, g.edge_dst, g.edge_dead, g.node_ids
+    in_mask = (lambda e: not dead[e]) if edge_mask is None else (lambda e: edge_mask[e] and not dead[e])
+
+    # 1) Graines : branches retirées / conservées de chaque visite
+    rm_node = bytearray(n_nodes)
+    rm_edge = bytearray(n_edges)
+    keep_node = [0] * n_nodes
+    keep_edge: Dict[int, int] = {}
+    amonts: Dict[int, Set[int]] = {}
+    all_bits = 0
+    for v in visits:
+        node = g.node(v.get("id"))
+        if node < 0:
+            continue
+        polluted = bool(v.get("pollution"))
+        keep = v.get("keep")
+        keep = None if keep is None else {_norm(k) for k in keep}
+        bit = 0
+        if polluted:
+            bit = 1 << len(amonts)
+            amonts[bit] = set()
+            all_bits |= bit
+        for e in g.in_edges(node):
+            u = src[e]
+            if polluted and (keep is None or (u >= 0 and ids[u] in keep)):
+                keep_edge[e] = keep_edge.get(e, 0) | bit
+                if u >= 0:
+                    keep_node[u] |= bit
+                    amonts[bit].add(u)
+            else:
+                rm_edge[e] = 1
+                if u >= 0:
+                    rm_node[u] = 1
+
+    # 2) Propagation vers l'amont, composantes de l'aval vers l'amont
+    cond = get_condensation(g)
+    out_edges = g.out_edges
+    for c in range(cond.comp_count):
+        members = cond.members(c)
+        if any(rm_node[u] for u in members) or any(
+                dst[e] >= 0 and rm_node[dst[e]] for u in members for e in out_edges(u)):
+            for u in members:
+                rm_node[u] = 1
+        if not all_bits:
+            continue
+        changed = True
+        while changed:   # point fixe : une seule itération hors boucle
+            changed = False
+            for u in members:
+                k = keep_node[u]
+                for e in out_edges(u):
+                    w = dst[e]
+                    if w >= 0 and in_mask(e) and not rm_edge[e] and not rm_node[w]:
+                        k |= keep_node[w]
+                if k != keep_node[u]:
+                    keep_node[u] = k
+                    changed = len(members) > 1
+
+    def alive(e: int) -> bool:
+        return in_mask(e) and not rm_edge[e] and not (dst[e] >= 0 and rm_node[dst[e]])
+
+    # 3) Chemins départ → amont : visites dont un nœud amont est atteint depuis le départ
+    fwd: Optional[bytearray] = None
+    fwd_bits = 0
+    start = g.node(start_id)
+    if all_bits and start >= 0:
+        mask = bytearray(n_edges)
+        for e in range(n_edges):
+            if alive(e):
+                mask[e] = 1
+        _, ahead = g.walk([start], downstream=True, edge_mask=mask)
+        fwd = bytearray(n_nodes)
+        for n in ahead:
+            fwd[n] = 1
+        for bit, nodes in amonts.items():
+            if any(fwd[n] for n in nodes):
+                fwd_bits |= bit
+
+    # 4) Sélection finale
+    edges: List[int] = []
+    removed_edges: List[int] = []
+    for e in range(n_edges):
+        if not in_mask(e):
+            continue
+        ok = alive(e)
+        if ok and all_bits:
+            w = dst[e]
+            bits = keep_edge.get(e, 0)
+            if w >= 0:
+                via = keep_node[w]
+                if fwd_bits and not (src[e] >= 0 and fwd[src[e]]):
+                    via &= ~fwd_bits
+                bits |= via
+            ok = bits & all_bits == all_bits
+        (edges if ok else removed_edges).append(e)
+
+    nodes = sorted({n for e in edges for n in (src[e], dst[e]) if n >= 0})
+    canal_fids, fosse_fids = g.fids_by_layer(edges)
+    return ReplayResult(edges, nodes, canal_fids, fosse_fids, removed_edges)
@@ -10,12 +10,16 @@ from qgis.PyQt.QtWidgets import (
     QTableWidget, QTableWidgetItem, QPushButton
 )
 
+from ..core.diagnostics import RULES
+from ..core.topology import CATEGORIES
+
 
 class DiagnosticsDock(QDockWidget):
     """
     Affiche un tableau regroupant :
-    - INVERSIONS
-    - RÉDUCTIONS DE DIAMÈTRE
+    - les rubriques des règles de diagnostic (INVERSIONS, RÉDUCTIONS DE
+      DIAMÈTRE…, voir core/diagnostics.py), regroupées par rubrique
+    - TOPOLOGIE (contrôle du réseau entier, voir core/topology.py)
 
     Colonnes affichées :
         Rubrique | Infos | Entité (cachée)
@@ -50,15 +54,30 @@ class DiagnosticsDock(QDockWidget):
         self._cb_refresh = None
         self._layers = {}
         self._results = {}
+        self._topology = {}
+        self._topo_layers = {}
 
     # ----------------------------------------------------------------------
     # API externe
     # ----------------------------------------------------------------------
-    def set_results(self, results, canal_layer, ouvr_layer):
+    def set_results(self, results, canal_layer, ouvr_layer,
+                    fosse_layer=None, liaison_layer=None):
+        """results : {rubrique: [(FID entité, infos, FID associé), ...]} (Diagnostics)."""
         self._results = results or {}
         self._layers = {
             "canal": canal_layer.name() if canal_layer else "",
-            "ouvr": ouvr_layer.name() if ouvr_layer else ""
+            "ouvr": ouvr_layer.name() if ouvr_layer else "",
+            "fosse": fosse_layer.name() if fosse_layer else "",
+            "liaison": liaison_layer.name() if liaison_layer else "",
+        }
+        self._fill()
+
+    def set_topology(self, report, canal_layer, fosse_layer=None):
+        """report : {rubrique: [TopologyIssue, ...]} (TopologyValidator.report)."""
+        self._topology = report or {}
+        self._topo_layers = {
+            "canal": canal_layer.name() if canal_layer else "",
+            "fosse": fosse_layer.name() if fosse_layer else "",
         }
         self._fill()
 
@@ -74,29 +93,40 @@ class DiagnosticsDock(QDockWidget):
     def _fill(self):
         self.table.setRowCount(0)
 
-        # ---- INVERSIONS ----
-        for (fid_c, info, fid_o) in self._results.get("INVERSIONS", []):
-            r = self.table.rowCount()
-            self.table.insertRow(r)
-
-            self.table.setItem(r, 0, QTableWidgetItem("INVERSIONS"))
-            self.table.setItem(r, 1, QTableWidgetItem(info))
-
-            ent = QTableWidgetItem(f"{self._layers.get('canal', '')}:{fid_c}")
-            ent.setData(Qt.UserRole, (self._layers.get("canal", ""), fid_c))
-            self.table.setItem(r, 2, ent)
-
-        # ---- RÉDUCTIONS ----
-        for (fid_c, info, fid_o) in self._results.get("REDUCTIONS", []):
-            r = self.table.rowCount()
-            self.table.insertRow(r)
-
-            self.table.setItem(r, 0, QTableWidgetItem("RÉDUCTION DE DIAMÈTRE"))
-            self.table.setItem(r, 1, QTableWidgetItem(info))
-
-            ent = QTableWidgetItem(f"{self._layers.get('canal', '')}:{fid_c}")
-            ent.setData(Qt.UserRole, (self._layers.get("canal", ""), fid_c))
-            self.table.setItem(r, 2, ent)
+        # ---- RÈGLES DE DIAGNOSTIC (ordre d'enregistrement, puis rubriques inconnues) ----
+        rules = {r.key: r for r in RULES}
+        keys = [r.key for r in RULES if r.key in self._results]
+        keys += [k for k in self._results if k not in rules]
+        for key in keys:
+            rule = rules.get(key)
+            label = rule.label if rule else key
+            layer_name = self._layers.get(rule.layer if rule else "canal", "")
+            for (fid_c, info, fid_o) in self._results.get(key, []):
+                r = self.table.rowCount()
+                self.table.insertRow(r)
+
+                self.table.setItem(r, 0, QTableWidgetItem(label))
+                self.table.setItem(r, 1, QTableWidgetItem(info))
+
+                ent = QTableWidgetItem(f"{layer_name}:{fid_c}")
+                ent.setData(Qt.UserRole, (layer_name, fid_c))
+                self.table.setItem(r, 2, ent)
+
+        # ---- TOPOLOGIE ----
+        for key, issues in self._topology.items():
+            label = "TOPOLOGIE : {}".format(CATEGORIES.get(key, key))
+            for it in issues:
+                r = self.table.rowCount()
+                self.table.insertRow(r)
+
+                self.table.setItem(r, 0, QTableWidgetItem(label))
+                info = "{} ({} FID {})".format(it.message, it.layer, it.fid)
+                self.table.setItem(r, 1, QTableWidgetItem(info))
+
+                layer_name = self._topo_layers.get(it.layer, "")
+                ent = QTableWidgetItem(f"{layer_name}:{it.fid}")
+                ent.setData(Qt.UserRole, (layer_name, it.fid))
+                self.table.setItem(r, 2, ent)
 
         self.table.resizeColumnsToContents()
 
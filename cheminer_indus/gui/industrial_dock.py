@@ -530,15 +530,17 @@ class IndustrialDock(QDockWidget):
     # ----------------------------------------------------------------------
     # Exclusion d'IDs (utilisé par la logique de visite dans main_dock)
     # ----------------------------------------------------------------------
-    def exclude_ids(self, ids: List[str]):
+    def exclude_ids(self, ids: List[str]) -> Dict[str, Dict[str, str]]:
         """
         Exclut du tableau les industriels dont l'ID figure dans ids.
         ids : liste de chaînes (id_industriel)
+        Retour : lignes retirées { id_indus: {colonne: valeur} } (pour restore_rows).
         """
         if not ids:
-            return
+            return {}
         sids = set(str(i) for i in ids)
 
+        removed = {k: v for k, v in self._raw_data.items() if str(k) in sids}
         self._raw_data = {
             k: v for k, v in self._raw_data.items()
             if str(k) not in sids
@@ -548,6 +550,20 @@ class IndustrialDock(QDockWidget):
             if str(k) not in sids
         }
         self._refresh_table()
+        return removed
+
+    def restore_rows(self, rows: Dict[str, Dict[str, str]]):
+        """
+        Réintègre des lignes retirées par exclude_ids (annulation d'une visite).
+        Le filtre courant est réappliqué.
+        """
+        if not rows:
+            return
+        if not self._all_fields:
+            self.set_data(rows)
+            return
+        self._raw_data.update(rows)
+        self._apply_filter()
 
     # ----------------------------------------------------------------------
     # Export CSV de la vue filtrée
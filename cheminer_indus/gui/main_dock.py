@@ -6,7 +6,7 @@ from __future__ import annotations
 import os, json, datetime, tempfile
 from typing import Optional, List, Tuple, Set, Dict, Any
 
-from qgis.PyQt.QtCore import Qt, QDate, QTime, QDateTime, QSize, QTimer
+from qgis.PyQt.QtCore import Qt, QDate, QTime, QDateTime, QSize, QTimer, QSettings
 from qgis.PyQt.QtGui import QIcon, QPixmap, QColor, QMovie
 from qgis.PyQt.QtWidgets import (
     QAction, QDockWidget, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QComboBox,
@@ -17,14 +17,18 @@ from qgis.PyQt.QtWidgets import (
 
 from qgis.core import (
     QgsProject, QgsExpression, QgsFeatureRequest, QgsVectorLayer,
-    QgsFeature, QgsGeometry, QgsPointXY, Qgis
+    QgsFeature, QgsGeometry, QgsPointXY, Qgis, QgsApplication
 )
 
 from ..utils.config             import ICONS_DIR
 from ..core.selection           import MapSelectionTool, AstreintSelectionTool
 from ..core.tracer              import NetworkTracer
+from ..core.trace_task          import TraceTask
+from ..core.trace_cache         import TRACE_CACHE, DEFAULT_MAX_BYTES
+from ..core.graph               import get_graph
 from ..core.industrials         import IndustrialsService
 from ..core.diagnostics         import Diagnostics
+from ..core.topology            import TopologyValidator
 from ..core.highlight_manager   import HighlightManager
 from ..animation.flow_animator  import FlowAnimator
 from ..report.pdf_generator     import PDFGenerator
@@ -95,6 +99,7 @@ class MainDock:
         # UI state
         self.industrial_dock: Optional[IndustrialDock] = None
         self.diag_dock      : Optional[DiagnosticsDock] = None
+        self._topology      : Optional[TopologyValidator] = None
         self._last_indus_data: Dict[str, Dict[str, str]] = {}
 
         # selection tools
@@ -104,6 +109,9 @@ class MainDock:
 
         # visites & pollueur & astreinte
         self.visited: List[Dict[str, object]] = []
+        # deltas des visites (FIDs retirés, entrée 'visited', lignes indus) pour annuler / rétablir
+        self._visit_undo: List[Dict[str, Any]] = []
+        self._visit_redo: List[Dict[str, Any]] = []
         self.polluter_id   : str = ""
         self.polluter_note : str = ""
         self.astreint_details: Dict[str, object] = {}
@@ -114,6 +122,9 @@ class MainDock:
         # Optimisations pour désélection de nœuds
         self._node_ops: Optional[OptimizedNodeOps] = None
 
+        # Cheminement en tâche de fond (un seul à la fois)
+        self._trace_task: Optional[TraceTask] = None
+
         # widgets
         self.canal_combo = self.ouvr_combo = self.fosse_combo = None
         self.indus_combo = self.liaison_combo = self.astreint_combo = None
@@ -121,6 +132,8 @@ class MainDock:
         self.trace_btn = self.flux_btn = None
         self.direction_combo = self.cat_combo = self.func_combo = None
         self.visit_input = None
+        self.suggest_weight_combo = None
+        self.ai_tab = None
         self.btn_show_indus = None
         self.note_text = None
         self.catchment_chk = None
@@ -259,6 +272,8 @@ class MainDock:
 
         self._populate_layers()
         self._init_autosave()
+        self._warm_graph()
+        self._configure_trace_cache()
 
     # ---------------------------------------------------------
     # Utilitaires génériques (sablier, autosave, inversion)
@@ -352,12 +367,37 @@ class MainDock:
         except Exception:
             pass
 
-    # Wrappers avec sablier
-    def _do_trace_with_wait(self):
-        res = self._run_with_wait_cursor(self._do_trace)
-        self._autosave()
-        return res
+    def _warm_graph(self):
+        """
+        Mappe au démarrage l'instantané disque du graphe réseau s'il est à jour
+        (aucune reconstruction ici : elle aura lieu au premier cheminement).
+        """
+        try:
+            canal = self.canal_combo.currentData() if self.canal_combo else None
+            fosse = self.fosse_combo.currentData() if self.fosse_combo else None
+            if canal and canal.isValid():
+                get_graph(canal, fosse, self.field_alias, build=False)
+        except Exception:
+            pass
+
+    def _configure_trace_cache(self):
+        """Plafond mémoire du cache de cheminements (réglage CheminerIndus/trace_cache_mb)."""
+        try:
+            mb = int(QSettings().value("CheminerIndus/trace_cache_mb",
+                                       DEFAULT_MAX_BYTES // (1024 * 1024)))
+            TRACE_CACHE.resize(max(0, mb) * 1024 * 1024)
+        except (TypeError, ValueError):
+            pass
 
+    def _on_trace_clicked(self):
+        # Un cheminement en cours : le bouton sert à l'interrompre
+        if self._trace_task is not None:
+            self._trace_task.cancel()
+            return
+        # Tâche de fond : l'enregistrement auto suit la fin du parcours (_finish_trace)
+        self._do_trace()
+
+    # Wrappers avec sablier
     def _open_diagnostic_with_wait(self):
         res = self._run_with_wait_cursor(self._open_diagnostic)
         self._autosave()
@@ -459,7 +499,7 @@ class MainDock:
 
         # buttons
         self.trace_btn = QPushButton("Cheminer"); self.trace_btn.setIcon(QIcon(os.path.join(ICONS_DIR,'trace.png')))
-        self.trace_btn.clicked.connect(self._do_trace_with_wait)
+        self.trace_btn.clicked.connect(self._on_trace_clicked)
 
         self.flux_btn = QPushButton("Flux"); self.flux_btn.setIcon(QIcon(os.path.join(ICONS_DIR,'flux.png')))
         self.flux_btn.setCheckable(True); self.flux_btn.clicked.connect(self._toggle_flux)
@@ -494,6 +534,25 @@ class MainDock:
         btn_visit = QPushButton("Visiter (Pollué O/N)"); btn_visit.setIcon(QIcon(os.path.join(ICONS_DIR,'pollueur.png')))
         btn_visit.clicked.connect(self._visit)
         lv.addWidget(btn_visit)
+        hs = QHBoxLayout()
+        btn_suggest = QPushButton("Suggérer la prochaine visite")
+        btn_suggest.setToolTip("Regard qui partage le mieux en deux le réseau restant (sélection)")
+        btn_suggest.clicked.connect(self._suggest_visit)
+        self.suggest_weight_combo = QComboBox()
+        self.suggest_weight_combo.addItem("Longueur", "length")
+        self.suggest_weight_combo.addItem("Industriels raccordés", "indus")
+        self.suggest_weight_combo.addItem("Probabilité IA", "ai")
+        hs.addWidget(btn_suggest); hs.addWidget(self.suggest_weight_combo)
+        lv.addLayout(hs)
+        btn_replay = QPushButton("Rejouer les visites sur la trace")
+        btn_replay.setToolTip("Applique toutes les visites enregistrées à la sélection courante")
+        btn_replay.clicked.connect(self._replay_visits)
+        lv.addWidget(btn_replay)
+        hu = QHBoxLayout()
+        btn_undo = QPushButton("Annuler visite"); btn_undo.clicked.connect(self._undo_visit)
+        btn_redo = QPushButton("Rétablir visite"); btn_redo.clicked.connect(self._redo_visit)
+        hu.addWidget(btn_undo); hu.addWidget(btn_redo)
+        lv.addLayout(hu)
         l.addWidget(box_v)
 
         # bloc indus
@@ -566,7 +625,8 @@ class MainDock:
     # ---------------------------------------------------------
     def _tab_ai(self) -> QWidget:
         """Crée l'onglet IA pour prédiction et visualisation 3D"""
-        return AITab(self)
+        self.ai_tab = AITab(self)
+        return self.ai_tab
 
     # ---------------------------------------------------------
     # Sélection / Recherche
@@ -647,7 +707,7 @@ class MainDock:
                    'function': self.func_combo.currentData() or ''}
 
         if mode == "Cheminement pour Industriels":
-            self._trace_for_industrials(start_id, filters)
+            self._run_with_wait_cursor(self._trace_for_industrials, start_id, filters)
             self._autosave()
             return
 
@@ -659,7 +719,58 @@ class MainDock:
             filters=filters
         )
         downstream = (mode == "Amont vers Aval")
-        canal_ids, fosse_ids = self.tracer.trace(start_id, downstream=downstream)
+
+        # Parcours en tâche de fond : sélection progressive, interruptible
+        self.canal_layer.removeSelection()
+        if self.fosse_layer and self.fosse_layer.isValid():
+            self.fosse_layer.removeSelection()
+        self._start_trace_task(start_id, downstream)
+
+    def _start_trace_task(self, start_id: str, downstream: bool):
+        task = TraceTask(
+            self.tracer, [start_id], downstream,
+            description="CheminerIndus : cheminement depuis {}".format(start_id)
+        )
+        task.batchReady.connect(self._on_trace_batch)
+        task.countsChanged.connect(self._on_trace_counts)
+        task.traceDone.connect(lambda ok, t=task: self._on_trace_done(t, ok))
+        self._trace_task = task
+        if self.trace_btn:
+            self.trace_btn.setText("Arrêter")
+        QgsApplication.taskManager().addTask(task)
+
+    def _on_trace_batch(self, canal_ids: List[int], fosse_ids: List[int]):
+        """Sélection au fil de l'eau des tronçons atteints."""
+        if canal_ids and self.canal_layer:
+            self.canal_layer.selectByIds(canal_ids, QgsVectorLayer.AddToSelection)
+        if fosse_ids and self.fosse_layer and self.fosse_layer.isValid():
+            self.fosse_layer.selectByIds(fosse_ids, QgsVectorLayer.AddToSelection)
+
+    def _on_trace_counts(self, nodes: int, edges: int):
+        try:
+            self.iface.mainWindow().statusBar().showMessage(
+                "Cheminement : {} nœuds, {} tronçons".format(nodes, edges), 2000)
+        except Exception:
+            pass
+
+    def _on_trace_done(self, task: TraceTask, ok: bool):
+        if task is not self._trace_task:
+            return
+        self._trace_task = None
+        if self.trace_btn:
+            self.trace_btn.setText("Cheminer")
+        if not ok:
+            msg = "Cheminement interrompu ({} tronçons sélectionnés).".format(task.edges_seen)
+            if task.error:
+                msg = "Erreur de cheminement : {}".format(task.error)
+            self.iface.messageBar().pushMessage("CheminerIndus", msg, level=Qgis.Warning, duration=5)
+            return
+        self.tracer = task.tracer
+        self._finish_trace(task.downstream)
+
+    def _finish_trace(self, downstream: bool):
+        """Fin de cheminement : sélection exacte, liaisons, bilan, bassin."""
+        canal_ids, fosse_ids = self.tracer.canal_ids, self.tracer.fosse_ids
 
         # sélection
         self.canal_layer.removeSelection()
@@ -668,8 +779,8 @@ class MainDock:
             self.fosse_layer.removeSelection()
             if fosse_ids: self.fosse_layer.selectByIds(fosse_ids)
 
-        # nœuds atteints (pour liaisons)
-        nodes = self._collect_nodes_from_ids(canal_ids, fosse_ids, downstream)
+        # nœuds atteints (pour liaisons) — fournis par le graphe en mémoire
+        nodes = set(self.tracer.last_nodes)
         self._last_trace_nodes = nodes
 
         # liaisons atteintes
@@ -679,8 +790,14 @@ class MainDock:
         dist = round(self.tracer.total_length, 2)
         codes = [c for c in self.tracer.flux_types if c]
         labels = sorted({ self._flux_labels.get(c, c) for c in codes }) or ["Aucun"]
-        QMessageBox.information(self.iface.mainWindow(),"Cheminement",
-            "Longueur : {} m\nFlux : {}".format(dist, " / ".join(labels)))
+        msg = "Longueur : {} m\nFlux : {}".format(dist, " / ".join(labels))
+        msg += self._stats_text(self.tracer.stats)
+        if self.tracer.loops:
+            msg += "\nBoucles rencontrées : {} (nœuds : {})".format(
+                len(self.tracer.loops),
+                " ; ".join(", ".join(lp["nodes"][:5]) + ("…" if len(lp["nodes"]) > 5 else "")
+                           for lp in self.tracer.loops[:3]))
+        QMessageBox.information(self.iface.mainWindow(),"Cheminement", msg)
 
         # bassin concave si demandé (Aval→Amont uniquement)
         if (not downstream) and self.catchment_chk and self.catchment_chk.isChecked():
@@ -715,28 +832,17 @@ class MainDock:
                 self.fosse_layer.selectByIds(fosse_ids)
 
         # nœuds atteints
-        nodes = self._collect_nodes_from_ids(canal_ids, fosse_ids, downstream=False)
+        nodes = set(self.tracer.last_nodes)
         self._last_trace_nodes = nodes
 
         # liaisons + indus
         if not self.indus_svc:
             self.indus_svc = IndustrialsService(self.indus_layer, self.liaison_layer)
 
-        self.indus_svc.select_liaisons_from_nodes(nodes)  # sélectionne liaisons dans la couche
+        # liaisons puis industriels sélectionnés sur la carte (index du service)
+        self.indus_svc.select_liaisons_from_nodes(nodes)
         ind_ids = self.indus_svc.select_industrials_from_selected_liaisons()  # renvoie les IDs texte
 
-        # Sélection explicite des industriels sur la carte
-        if self.indus_layer and self.indus_layer.isValid():
-            self.indus_layer.removeSelection()
-            if ind_ids:
-                esc = lambda s: (s or "").replace("'", "''")
-                values = ",".join("'{}'".format(esc(i)) for i in ind_ids if i)
-                expr = QgsExpression("trim(\"id\") IN ({})".format(values))
-                req = QgsFeatureRequest(expr)
-                fids = [f.id() for f in self.indus_layer.getFeatures(req)]
-                if fids:
-                    self.indus_layer.selectByIds(fids)
-
         details = self.indus_svc.fetch_many(ind_ids)
         self._last_indus_data = details
         self._open_or_update_industrial_dock(data=details)
@@ -751,6 +857,24 @@ class MainDock:
             "Industriels : {}\nLongueur : {} m\nFlux : {}".format(len(ind_ids), dist, " / ".join(labels))
         )
 
+    def _stats_text(self, stats: Dict) -> str:
+        """Détail des longueurs par type de réseau, classe de diamètre et commune."""
+        if not stats:
+            return ""
+        def fmt(d: Dict, label=lambda k: k or "non renseigné") -> str:
+            items = sorted(d.items(), key=lambda kv: -kv[1])
+            return " / ".join("{} : {} m".format(label(k), round(v, 1)) for k, v in items)
+        lines = []
+        if stats.get("by_type"):
+            lines.append("Par réseau : " + fmt(stats["by_type"],
+                                              lambda k: self._flux_labels.get(k, k) or "non renseigné"))
+        if stats.get("by_diameter"):
+            lines.append("Par diamètre (mm) : " + fmt(stats["by_diameter"]))
+        by_commune = stats.get("by_commune") or {}
+        if len(by_commune) > 1 or any(by_commune):
+            lines.append("Par commune : " + fmt(by_commune))
+        return "\n" + "\n".join(lines) if lines else ""
+
     # ---------------------------------------------------------
     # Collecte de nœuds depuis des IDs sélectionnés
     # ---------------------------------------------------------
@@ -777,17 +901,13 @@ class MainDock:
     def _select_liaisons_from_nodes(self, nodes: List[str], clear: bool = True):
         if not self.liaison_layer:
             return
+        if not self.indus_svc:
+            self.indus_svc = IndustrialsService(self.indus_layer, self.liaison_layer)
+        ids = self.indus_svc.liaison_fids_of_nodes(nodes or ())
         if clear:
-            self.liaison_layer.removeSelection()
-        if not nodes:
-            return
-        esc = lambda s: (s or "").replace("'", "''")
-        values = ",".join("'{}'".format(esc(n.strip())) for n in nodes)
-        exprL = QgsExpression("trim(\"id_ouvrage\") IN ({})".format(values))
-        reqL  = QgsFeatureRequest(exprL)
-        ids   = [f.id() for f in self.liaison_layer.getFeatures(reqL)]
-        if ids:
-            self.liaison_layer.selectByIds(ids)
+            self.liaison_layer.selectByIds(ids, QgsVectorLayer.SetSelection)
+        elif ids:
+            self.liaison_layer.selectByIds(ids, QgsVectorLayer.AddToSelection)
 
     # ---------------------------------------------------------
     # VISITES / BRANCHES
@@ -805,13 +925,11 @@ class MainDock:
                 self.liaison_layer, self.indus_layer
             )
         else:
-            # Mettre à jour les couches au cas où elles auraient changé
-            self._node_ops.canal_layer = self.canal_layer
-            self._node_ops.fosse_layer = self.fosse_layer
-            self._node_ops.liaison_layer = self.liaison_layer
-            self._node_ops.indus_layer = self.indus_layer
-            # Invalider les caches pour refléter les changements
-            self._node_ops.invalidate_caches()
+            # Couches éventuellement remplacées ; les éditions sont suivies par signaux
+            self._node_ops.set_layers(
+                self.canal_layer, self.fosse_layer,
+                self.liaison_layer, self.indus_layer
+            )
 
         # 1) Confirmer la pollution au nœud
         resp = QMessageBox.question(
@@ -823,7 +941,8 @@ class MainDock:
         if resp == QMessageBox.Cancel:
             return
         polluted = (resp == QMessageBox.Yes)
-        self.visited.append({'id': node_id, 'pollution': polluted})
+        entry = {'id': node_id, 'pollution': polluted}
+        self.visited.append(entry)
 
         # 2) Branches AMONT du nœud (canal, fosse) + liaisons au nœud
         branches: List[Tuple[str,int,Optional[str],Optional[str]]] = []
@@ -866,334 +985,170 @@ class MainDock:
                         chosen_keep = {fid for cb,_,fid,_,_ in checks if cb.isChecked()}
                     else:
                         return
-                # Désélectionner toutes les branches AMONT non cochées (et tout leur amont récursif + indus)
-                removed_indus_up = self._node_ops.bulk_deselect_unselected_branches_optimized(node_id, branches, chosen_keep)
             else:
                 # Pollué = NON → tout l'amont doit être désélectionné automatiquement
-                removed_indus_up = self._node_ops.bulk_deselect_unselected_branches_optimized(node_id, branches, chosen_ids=set())
-        else:
-            removed_indus_up = set()
-
-        # 5) Si Pollué = OUI → nettoyage strict entre départ et ce nœud sur la sélection
-        removed_indus_down = set()
-        keep_cids: Set[int] = set()
-        keep_fids: Set[int] = set()
-        keep_nodes: Set[str] = set()
-
-        if polluted:
-            # 5.a Désélectionner l'AVAL de ce nœud (sur la sélection courante) - VERSION OPTIMISÉE
-            sel_c, sel_f = self._selected_id_sets()
-            cids_ds, fids_ds, nodes_ds = self._node_ops.walk_downstream_on_selected_optimized(node_id, sel_c, sel_f)
-            if self.canal_layer and cids_ds:
-                self.canal_layer.deselect(list(cids_ds))
-            if self.fosse_layer and fids_ds:
-                self.fosse_layer.deselect(list(fids_ds))
-            removed_indus_down = self._node_ops.deselect_liaisons_and_indus_from_nodes_optimized(nodes_ds)
-
-            # 5.b Construire l'ensemble KEEP = branches cochées + tout leur amont (sur la sélection)
-            for typ, fid, amont, _ in branches:
-                if fid not in chosen_keep:
-                    continue
-                if typ == "canal":
-                    keep_cids.add(fid)
-                elif typ == "fosse":
-                    keep_fids.add(fid)
-                # Remonter sur la sélection à partir de l'amont de la branche cochée - VERSION OPTIMISÉE
-                if amont:
-                    sel_c, sel_f = self._selected_id_sets()
-                    kc, kf, kn = self._node_ops.walk_upstream_on_selected_optimized(amont, sel_c, sel_f)
-                    keep_cids.update(kc); keep_fids.update(kf); keep_nodes.update(kn)
-            # Inclure le nœud visité dans l'ensemble KEEP de nœuds
-            keep_nodes.add(node_id.strip())
-
-            # 5.c Purge finale : tout ce qui reste sélectionné mais pas dans KEEP → on enlève
-            sel_c, sel_f = self._selected_id_sets()
-            rem_c = list(sel_c - keep_cids)
-            rem_f = list(sel_f - keep_fids)
-            if self.canal_layer and rem_c:
-                self.canal_layer.deselect(rem_c)
-            if self.fosse_layer and rem_f:
-                self.fosse_layer.deselect(rem_f)
-
-            # Exclure les liaisons/indus des nœuds associés aux tronçons supprimés
-            nodes_removed: Set[str] = set()
-            # récupérer nœuds depuis les tronçons retirés
-            def _nodes_from_ids(layer, ids):
-                out = set()
-                if not layer or not ids:
-                    return out
-                req = QgsFeatureRequest().setFilterFids(ids)
-                for f in layer.getFeatures(req):
-                    try:
-                        ni = (f['idnini'] or "").strip()
-                        nt = (f['idnterm'] or "").strip()
-                        if ni and ni.upper() != "INCONNU": out.add(str(ni))
-                        if nt and nt.upper() != "INCONNU": out.add(str(nt))
-                    except Exception:
-                        pass
-                return out
-            nodes_removed.update(_nodes_from_ids(self.canal_layer, rem_c))
-            nodes_removed.update(_nodes_from_ids(self.fosse_layer, rem_f))
-            # Attention à ne pas supprimer ce qui est dans KEEP
-            nodes_removed.difference_update(keep_nodes)
-            if nodes_removed:
-                removed_indus_down.update(self._node_ops.deselect_liaisons_and_indus_from_nodes_optimized(nodes_removed))
+                chosen_keep = set()
+        # nœuds amont des branches conservées (rejeu des visites sur une autre trace)
+        entry['keep'] = sorted({str(amont).strip() for typ, fid, amont, _ in branches
+                                if fid in chosen_keep and typ != "liaison" and amont})
+
+        # 5) Nettoyage de la sélection sur masques d'arêtes du graphe :
+        #    - branches AMONT non conservées : désélection récursive de leur amont (+ liaisons/indus)
+        #    - Pollué = OUI : KEEP = branches cochées + tronçons de la sélection situés sur un
+        #      chemin départ → amont de ces branches ; tout le reste (dont l'aval) est purgé
+        #    Une seule mise à jour de sélection par couche.
+        delta: Dict[str, Any] = {"visit": entry}
+        removed_indus_all = self._node_ops.visit_cleanup(
+            node_id, branches, chosen_keep, polluted, (self.id_input.text() or "").strip(), delta
+        )
 
         # 6) Exclure dans le tableau des indus
-        removed_indus_all = set()
-        removed_indus_all.update(removed_indus_up or set())
-        removed_indus_all.update(removed_indus_down or set())
+        delta["indus_ids"] = sorted(removed_indus_all)
+        delta["rows"] = {}
         if self.industrial_dock and removed_indus_all:
             try:
-                self.industrial_dock.exclude_ids(sorted(removed_indus_all))
+                delta["rows"] = self.industrial_dock.exclude_ids(delta["indus_ids"])
             except Exception:
                 pass
+        self._visit_undo.append(delta)
+        self._visit_redo.clear()
 
         self.canvas.refresh()
         self._autosave()
 
-    # --- Parcours amont existant ---
-    def _iter_incoming_edges_mixed(self, node: str):
-        out = []
-        if self.canal_layer:
-            expr = QgsExpression("trim(\"idnterm\") = '{}' AND trim(\"idnini\") != 'INCONNU'".format(node.replace("'","''")))
-            for f in self.canal_layer.getFeatures(QgsFeatureRequest(expr)):
-                out.append(("canal", self.canal_layer, f))
-        if self.fosse_layer:
-            expr = QgsExpression("trim(\"idnterm\") = '{}' AND trim(\"idnini\") != 'INCONNU'".format(node.replace("'","''")))
-            for f in self.fosse_layer.getFeatures(QgsFeatureRequest(expr)):
-                out.append(("fosse", self.fosse_layer, f))
-        return out
-
-    def _walk_upstream_mixed(self, start_node: Optional[str]):
-        if not start_node:
-            return set(), set(), set()
-        seen_nodes: Set[str] = set()
-        cids: Set[int] = set()
-        fids: Set[int] = set()
-        stack = [str(start_node)]
-        while stack:
-            cur = stack.pop()
-            if cur in seen_nodes:
-                continue
-            seen_nodes.add(cur)
-            for typ, layer, feat in self._iter_incoming_edges_mixed(cur):
-                fid = feat.id()
-                if typ == "canal":
-                    if fid in cids: continue
-                    cids.add(fid)
-                else:
-                    if fid in fids: continue
-                    fids.add(fid)
-                nxt = (feat['idnini'] or "").strip()
-                if nxt and nxt.upper() != "INCONNU":
-                    stack.append(str(nxt))
-        return cids, fids, seen_nodes
-
-    # --- Sortant ---
-    def _iter_outgoing_edges_mixed(self, node: str):
-        out = []
-        node_cmp = (node or "").strip().replace("'", "''")
-        if self.canal_layer:
-            expr = QgsExpression(f"trim(\"idnini\") = '{node_cmp}'")
-            for f in self.canal_layer.getFeatures(QgsFeatureRequest(expr)):
-                out.append(("canal", self.canal_layer, f))
-        if self.fosse_layer:
-            expr = QgsExpression(f"trim(\"idnini\") = '{node_cmp}'")
-            for f in self.fosse_layer.getFeatures(QgsFeatureRequest(expr)):
-                out.append(("fosse", self.fosse_layer, f))
-        return out
-
-    def _walk_downstream_mixed(self, start_node: Optional[str]):
-        """Ancienne marche aval globale (non utilisée pour le nettoyage 'entre départ et nœud')."""
-        if not start_node:
-            return set(), set(), set()
-        seen_nodes: Set[str] = set()
-        cids: Set[int] = set()
-        fids: Set[int] = set()
-        stack = [str(start_node).strip()]
-        while stack:
-            cur = stack.pop()
-            if cur in seen_nodes:
-                continue
-            seen_nodes.add(cur)
-            for typ, layer, feat in self._iter_outgoing_edges_mixed(cur):
-                fid = feat.id()
-                if typ == "canal":
-                    if fid in cids: 
-                        continue
-                    cids.add(fid)
-                else:
-                    if fid in fids: 
-                        continue
-                    fids.add(fid)
-                nxt = ""
-                try:
-                    nxt = (feat['idnterm'] or "").strip()
-                except Exception:
-                    nxt = ""
-                if nxt and nxt.upper() != "INCONNU":
-                    stack.append(str(nxt))
-        return cids, fids, seen_nodes
-
-    # --- NOUVEAU : marches limitées à la SÉLECTION (chemin courant) ---
-    def _selected_id_sets(self) -> Tuple[Set[int], Set[int]]:
-        """Renvoie les ID sélectionnés pour canal et fosse (filtre pour marche 'sur sélection')."""
-        sel_c = set(self.canal_layer.selectedFeatureIds()) if self.canal_layer else set()
-        sel_f = set(self.fosse_layer.selectedFeatureIds()) if self.fosse_layer else set()
-        return sel_c, sel_f
-
-    def _walk_downstream_on_selected(self, start_node: Optional[str]):
-        """Aval sur la sélection courante (nettoyage 'entre départ et nœud visité')."""
-        if not start_node:
-            return set(), set(), set()
-        sel_c, sel_f = self._selected_id_sets()
-        seen_nodes: Set[str] = set()
-        cids: Set[int] = set()
-        fids: Set[int] = set()
-        stack = [str(start_node).strip()]
-        while stack:
-            cur = stack.pop()
-            if cur in seen_nodes:
-                continue
-            seen_nodes.add(cur)
-            for typ, layer, feat in self._iter_outgoing_edges_mixed(cur):
-                fid = feat.id()
-                if typ == "canal":
-                    if fid not in sel_c or fid in cids: continue
-                    cids.add(fid)
-                else:
-                    if fid not in sel_f or fid in fids: continue
-                    fids.add(fid)
-                nxt = (feat['idnterm'] or "").strip()
-                if nxt and nxt.upper() != "INCONNU":
-                    stack.append(str(nxt))
-        return cids, fids, seen_nodes
-
-    def _walk_upstream_on_selected(self, start_node: Optional[str]):
-        """Amont sur la sélection courante (pour construire l'ensemble KEEP)."""
-        if not start_node:
-            return set(), set(), set()
-        sel_c, sel_f = self._selected_id_sets()
-        seen_nodes: Set[str] = set()
-        cids: Set[int] = set()
-        fids: Set[int] = set()
-        stack = [str(start_node).strip()]
-        while stack:
-            cur = stack.pop()
-            if cur in seen_nodes:
-                continue
-            seen_nodes.add(cur)
-            for typ, layer, feat in self._iter_incoming_edges_mixed(cur):
-                fid = feat.id()
-                if typ == "canal":
-                    if fid not in sel_c or fid in cids: continue
-                    cids.add(fid)
-                else:
-                    if fid not in sel_f or fid in fids: continue
-                    fids.add(fid)
-                nxt = (feat['idnini'] or "").strip()
-                if nxt and nxt.upper() != "INCONNU":
-                    stack.append(str(nxt))
-        return cids, fids, seen_nodes
-
-    def _deselect_liaisons_and_indus_from_nodes(self, nodes: Set[str]) -> Set[str]:
-        """Désélectionne liaisons (id_ouvrage ∈ nodes) et renvoie les IDs d'indus à exclure, puis les désélectionne."""
-        removed_indus: Set[str] = set()
-        if not nodes or not self.liaison_layer:
-            return removed_indus
-        esc = lambda s: (s or "").replace("'","''")
-        values = ",".join("'{}'".format(esc((n or "").strip())) for n in nodes if (n or "").strip())
-        if not values:
-            return removed_indus
-        exprL = QgsExpression("trim(\"id_ouvrage\") IN ({})".format(values))
-        reqL  = QgsFeatureRequest(exprL)
-        lids = [f.id() for f in self.liaison_layer.getFeatures(reqL)]
-        if lids:
-            # collecter indus liés
-            for lid in lids:
-                try:
-                    lf = self.liaison_layer.getFeature(lid)
-                    iid = lf['id_industriel']
-                    if iid and str(iid) != 'INCONNU':
-                        removed_indus.add(str(iid))
-                except Exception:
-                    pass
-            self.liaison_layer.deselect(lids)
-
-        if self.indus_layer and removed_indus:
-            exprI = QgsExpression("trim(\"id\") IN ({})".format(",".join("'{}'".format(i.replace("'","''")) for i in removed_indus)))
-            reqI  = QgsFeatureRequest(exprI)
-            rem_ids = [f.id() for f in self.indus_layer.getFeatures(reqI)]
-            if rem_ids:
-                self.indus_layer.deselect(rem_ids)
-        return removed_indus
-
-    def _bulk_deselect_unselected_branches(self, start_node: str,
-                                           branches: List[Tuple[str,int,Optional[str],Optional[str]]],
-                                           chosen_ids: Set[int]) -> Set[str]:
-        """
-        Désélectionne tout l'amont pour les branches NON cochées.
-        Retourne l'ensemble des IDs industriels exclus.
-        """
-        removed_cids: Set[int] = set()
-        removed_fids: Set[int] = set()
-        removed_lids: Set[int] = set()
-        removed_nodes: Set[str] = set()
-        removed_indus: Set[str] = set()
-
-        for typ, fid, amont, indus in branches:
-            if fid in chosen_ids:
-                continue
-            if typ == "canal":
-                removed_cids.add(fid)
-                cids, fids, nodes = self._walk_upstream_mixed(amont)
-                removed_cids.update(cids); removed_fids.update(fids); removed_nodes.update(nodes)
-            elif typ == "fosse":
-                removed_fids.add(fid)
-                cids, fids, nodes = self._walk_upstream_mixed(amont)
-                removed_cids.update(cids); removed_fids.update(fids); removed_nodes.update(nodes)
-            else:
-                removed_lids.add(fid)
-                if indus:
-                    removed_indus.add(str(indus))
+    def _suggest_visit(self):
+        """Propose le regard qui coupe le mieux la sélection restante."""
+        if not self.canal_layer or not (
+                self.canal_layer.selectedFeatureIds()
+                or (self.fosse_layer and self.fosse_layer.selectedFeatureIds())):
+            QMessageBox.information(self.iface.mainWindow(), "Visites",
+                                    "Lancer d'abord un cheminement (sélection vide).")
+            return
+        if not self._node_ops:
+            self._node_ops = OptimizedNodeOps(
+                self.canal_layer, self.fosse_layer,
+                self.liaison_layer, self.indus_layer
+            )
+        else:
+            self._node_ops.set_layers(
+                self.canal_layer, self.fosse_layer,
+                self.liaison_layer, self.indus_layer
+            )
 
-        if self.canal_layer and removed_cids:
-            self.canal_layer.deselect(list(removed_cids))
-        if self.fosse_layer and removed_fids:
-            self.fosse_layer.deselect(list(removed_fids))
+        mode = self.suggest_weight_combo.currentData() if self.suggest_weight_combo else "length"
+        node_weight: Optional[Dict[str, float]] = None
+        if mode == "ai":
+            hotspots = getattr(self.ai_tab, "_last_hotspots", None) or []
+            if not hotspots:
+                QMessageBox.information(self.iface.mainWindow(), "Visites",
+                                        "Aucune prédiction IA : pondération par la longueur.")
+            # (nœud, probabilité %, niveau) → poids 1 + p
+            node_weight = {str(h[0]): 1.0 + float(h[1]) / 100.0 for h in hotspots}
+
+        exclude = {str(v.get('id', '')) for v in self.visited}
+        exclude.add((self.id_input.text() or "").strip())
+        suggestions = self._node_ops.suggest_next_visits(
+            exclude, node_weight, by_industrials=(mode == "indus"), limit=5
+        )
+        if not suggestions:
+            QMessageBox.information(self.iface.mainWindow(), "Visites", "Aucun regard à proposer.")
+            return
 
-        # liaisons amont + indus (depuis tous les nœuds collectés)
-        if self.liaison_layer:
-            ids_to_unselect = list(removed_lids)
-            if removed_nodes:
-                esc = lambda s: (s or "").replace("'","''")
-                values = ",".join("'{}'".format(esc((n or "").strip())) for n in removed_nodes if (n or "").strip())
-                if values:
-                    exprL = QgsExpression("trim(\"id_ouvrage\") IN ({})".format(values))
-                    reqL  = QgsFeatureRequest(exprL)
-                    ids_to_unselect += [f.id() for f in self.liaison_layer.getFeatures(reqL)]
-
-            if ids_to_unselect:
-                for lid in ids_to_unselect:
-                    try:
-                        lf = self.liaison_layer.getFeature(lid)
-                        iid = lf['id_industriel']
-                        if iid and str(iid) != 'INCONNU':
-                            removed_indus.add(str(iid))
-                    except Exception:
-                        pass
-                self.liaison_layer.deselect(ids_to_unselect)
+        self.visit_input.setText(suggestions[0].node)
+        lines = ["{}  —  amont {:.0f} / {:.0f} ({:.0%} du réseau restant)".format(
+            s.node, s.upstream, s.total, s.upstream / s.total) for s in suggestions]
+        QMessageBox.information(
+            self.iface.mainWindow(), "Prochaine visite",
+            "Regards suggérés (meilleur partage en tête) :\n\n" + "\n".join(lines))
 
-        if self.indus_layer and removed_indus:
-            exprI = QgsExpression("trim(\"id\") IN ({})".format(",".join("'{}'".format(i.replace("'","''")) for i in removed_indus)))
-            reqI  = QgsFeatureRequest(exprI)
-            rem_ids = [f.id() for f in self.indus_layer.getFeatures(reqI)]
-            if rem_ids:
-                self.indus_layer.deselect(rem_ids)
+    def _replay_visits(self):
+        """Rejoue toute la liste des visites sur la trace courante, en une passe."""
+        if not self.visited:
+            QMessageBox.information(self.iface.mainWindow(), "Visites", "Aucune visite à rejouer.")
+            return
+        if not self.canal_layer or not (
+                self.canal_layer.selectedFeatureIds()
+                or (self.fosse_layer and self.fosse_layer.selectedFeatureIds())):
+            QMessageBox.information(self.iface.mainWindow(), "Visites",
+                                    "Lancer d'abord un cheminement (sélection vide).")
+            return
+        if not self._node_ops:
+            self._node_ops = OptimizedNodeOps(
+                self.canal_layer, self.fosse_layer,
+                self.liaison_layer, self.indus_layer
+            )
+        else:
+            self._node_ops.set_layers(
+                self.canal_layer, self.fosse_layer,
+                self.liaison_layer, self.indus_layer
+            )
+
+        delta: Dict[str, Any] = {"visit": None}
+        removed_indus_all = self._node_ops.replay_visits(
+            (self.id_input.text() or "").strip(), self.visited, delta
+        )
+        delta["indus_ids"] = sorted(removed_indus_all)
+        delta["rows"] = {}
+        if self.industrial_dock and removed_indus_all:
+            try:
+                delta["rows"] = self.industrial_dock.exclude_ids(delta["indus_ids"])
+            except Exception:
+                pass
+        self._visit_undo.append(delta)
+        self._visit_redo.clear()
 
         self.canvas.refresh()
-        return removed_indus
+        self._autosave()
+
+    def _undo_visit(self):
+        """Annule la dernière visite en rejouant son delta à l'envers."""
+        if not self._visit_undo:
+            QMessageBox.information(self.iface.mainWindow(), "Visites", "Aucune visite à annuler.")
+            return
+        delta = self._visit_undo.pop()
+        self._apply_visit_delta(delta, undo=True)
+        self._visit_redo.append(delta)
+        self.canvas.refresh()
+        self._autosave()
+
+    def _redo_visit(self):
+        """Rétablit la dernière visite annulée."""
+        if not self._visit_redo:
+            QMessageBox.information(self.iface.mainWindow(), "Visites", "Aucune visite à rétablir.")
+            return
+        delta = self._visit_redo.pop()
+        self._apply_visit_delta(delta, undo=False)
+        self._visit_undo.append(delta)
+        self.canvas.refresh()
+        self._autosave()
+
+    def _apply_visit_delta(self, delta: Dict[str, Any], undo: bool):
+        """Sélections, liste des visites et tableau des indus : coût proportionnel au delta."""
+        if not self._node_ops:
+            self._node_ops = OptimizedNodeOps(
+                self.canal_layer, self.fosse_layer,
+                self.liaison_layer, self.indus_layer
+            )
+        self._node_ops.apply_visit_delta(delta, undo)
+
+        entry = delta.get("visit")
+        if undo:
+            # dernière occurrence (une visite abandonnée au choix des branches reste listée)
+            for i in range(len(self.visited) - 1, -1, -1):
+                if self.visited[i] == entry:
+                    del self.visited[i]
+                    break
+        elif entry:
+            self.visited.append(entry)
+
+        if self.industrial_dock:
+            try:
+                if undo:
+                    self.industrial_dock.restore_rows(delta.get("rows") or {})
+                elif delta.get("indus_ids"):
+                    self.industrial_dock.exclude_ids(delta["indus_ids"])
+            except Exception:
+                pass
 
     # ---------------------------------------------------------
     # FLUX (animation)
@@ -1336,21 +1291,10 @@ class MainDock:
         if not self._last_trace_nodes:
             return
 
+        # liaisons + industriels sélectionnés sur la carte par le service
         ids = self.indus_svc.connected_ids_from_nodes(self._last_trace_nodes)
         details = self.indus_svc.fetch_many(ids)
 
-        # Sélection graphique des indus à partir de ces IDs
-        if self.indus_layer and self.indus_layer.isValid():
-            self.indus_layer.removeSelection()
-            if ids:
-                esc = lambda s: (s or "").replace("'", "''")
-                values = ",".join("'{}'".format(esc(i)) for i in ids if i)
-                expr = QgsExpression("trim(\"id\") IN ({})".format(values))
-                req = QgsFeatureRequest(expr)
-                fids = [f.id() for f in self.indus_layer.getFeatures(req)]
-                if fids:
-                    self.indus_layer.selectByIds(fids)
-
         self._last_indus_data = details # <-- mémorisation
         if self.industrial_dock:
             self.industrial_dock.set_data(details)
@@ -1599,24 +1543,14 @@ class MainDock:
         if self.fosse_layer and self.fosse_layer.isValid():
             self.fosse_layer.removeSelection()
 
-        all_canal_ids: Set[int] = set()
-        all_fosse_ids: Set[int] = set()
-        all_nodes: Set[str] = set()
-
-        # 12) Lancer le cheminement Amont→Aval depuis CHAQUE ouvrage retenu
-        for oid in ouvrages:
-            try:
-                cids, fids = self.tracer.trace(oid, downstream=True)
-            except Exception:
-                continue
-            if cids:
-                all_canal_ids.update(cids)
-            if fids:
-                all_fosse_ids.update(fids)
-
-            # Collecter les nœuds atteints pour mettre à jour _last_trace_nodes
-            nodes = self._collect_nodes_from_ids(list(cids or []), list(fids or []), downstream=True)
-            all_nodes.update(nodes)
+        # 12) Lancer UN cheminement Amont→Aval amorcé depuis tous les ouvrages retenus
+        try:
+            cids, fids = self.tracer.trace_many(ouvrages, downstream=True)
+        except Exception:
+            cids, fids = [], []
+        all_canal_ids: Set[int] = set(cids)
+        all_fosse_ids: Set[int] = set(fids)
+        all_nodes: Set[str] = set(self.tracer.last_nodes)
 
         # 13) Appliquer les sélections sur le réseau (canalisations + fossés)
         if all_canal_ids and self.canal_layer and self.canal_layer.isValid():
@@ -1670,7 +1604,8 @@ class MainDock:
             QMessageBox.warning(self.iface.mainWindow(),"CheminerIndus","Il faut CANALISATION et OUVRAGE.")
             return
 
-        diag = Diagnostics(self.canal_layer, self.ouvr_layer)
+        diag = Diagnostics(self.canal_layer, self.ouvr_layer,
+                           self.fosse_layer, self.liaison_layer, self.indus_layer)
         results = diag.run_selected_only()
 
         if not self.diag_dock:
@@ -1679,9 +1614,19 @@ class MainDock:
             self.diag_dock.on_refresh_request(self._open_diagnostic_with_wait)
             self.iface.addDockWidget(Qt.RightDockWidgetArea, self.diag_dock)
 
-        self.diag_dock.set_results(results, canal_layer=self.canal_layer, ouvr_layer=self.ouvr_layer)
+        self.diag_dock.set_results(results, canal_layer=self.canal_layer, ouvr_layer=self.ouvr_layer,
+                                   fosse_layer=self.fosse_layer, liaison_layer=self.liaison_layer)
+        self.diag_dock.set_topology(self._check_topology(), self.canal_layer, self.fosse_layer)
         self.diag_dock.show(); self.diag_dock.raise_()
 
+    def _check_topology(self):
+        """Contrôle de topologie du réseau entier (incrémental entre deux appels)."""
+        g = get_graph(self.canal_layer, self.fosse_layer, self.field_alias)
+        topo = self._topology
+        if topo is None or topo.graph is not g or topo.ouvr_layer is not self.ouvr_layer:
+            topo = self._topology = TopologyValidator(g, self.ouvr_layer)
+        return topo.update()
+
     def _zoom_to_feature_from_diag(self, layer_name: str, fid: int):
         lyr = None
         for L in (self.canal_layer, self.ouvr_layer, self.fosse_layer, self.indus_layer, self.liaison_layer):
@@ -1949,6 +1894,8 @@ class MainDock:
             "category": self.cat_combo.currentData() if self.cat_combo else '',
             "function": self.func_combo.currentData() if self.func_combo else '',
             "visited": self.visited,
+            "visit_undo": self._visit_undo,
+            "visit_redo": self._visit_redo,
             "polluter_id": self.polluter_id,
             "polluter_note": self.polluter_note,
             "astreinte": {k:_safe_json(v) for k,v in self.astreint_details.items()},
@@ -1979,6 +1926,8 @@ class MainDock:
                         self.func_combo.setCurrentIndex(i); break
 
             self.visited = st.get("visited",[])
+            self._visit_undo = list(st.get("visit_undo") or [])
+            self._visit_redo = list(st.get("visit_redo") or [])
             self.polluter_id = st.get("polluter_id","")
             self.polluter_note = st.get("polluter_note","")
             if self.note_text:
@@ -2165,6 +2114,7 @@ class MainDock:
             self.note_text.clear()
 
         self.visited.clear()
+        self._visit_undo.clear(); self._visit_redo.clear()
         self.polluter_id = ""; self.polluter_note = ""; self.astreint_details.clear()
         self._last_trace_nodes.clear()
         self._mask_on = False
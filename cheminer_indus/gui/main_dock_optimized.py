@@ -2,14 +2,45 @@
 # OPTIMISATIONS pour main_dock.py - Module de performance pour la désélection de nœuds
 # Ce module contient les fonctions optimisées à intégrer dans MainDock
 
-from typing import Dict, List, Optional, Set, Tuple
-from qgis.core import QgsFeature, QgsFeatureRequest, QgsVectorLayer, QgsExpression
+from itertools import compress
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from qgis.core import QgsFeature, QgsFeatureRequest, QgsVectorLayer
+
+from ..core.graph import LAYER_CANAL, LAYER_FOSSE, NetworkGraph, get_graph, invalidate_graph
+from ..core.industrials import IndustrialsService
+from ..core.reachability import ReachabilityIndex, get_reachability
+from ..core.visit_planner import VisitSuggestion, suggest_visits
+from ..core.visit_replay import replay_visits
+
+
+def _bits_and(a: bytearray, b: bytearray) -> bytearray:
+    """Masques 0/1 (un octet par arête) : a ET b."""
+    x = int.from_bytes(a, "little") & int.from_bytes(b, "little")
+    return bytearray(x.to_bytes(len(a), "little"))
+
+
+def _bits_andnot(a: bytearray, b: bytearray) -> bytearray:
+    """Masques 0/1 (un octet par arête) : a ET NON b."""
+    ia = int.from_bytes(a, "little")
+    x = ia ^ (ia & int.from_bytes(b, "little"))
+    return bytearray(x.to_bytes(len(a), "little"))
+
+
+class LiaisonRecord:
+    """Liaison industriel ↔ ouvrage."""
+    __slots__ = ("fid", "node", "indus")
+
+    def __init__(self, fid: int, node: str, indus: str):
+        self.fid = fid
+        self.node = node     # id_ouvrage
+        self.indus = indus   # id_industriel ('' si absent / INCONNU)
 
 
 class OptimizedNodeOps:
     """
     Classe contenant les opérations optimisées pour la désélection de nœuds.
-    Utilise des caches pour minimiser les requêtes répétées.
+    Utilise des caches pour minimiser les requêtes répétées ; les parcours
+    amont/aval s'exécutent sur le graphe compact partagé (core/graph.py).
     """
     
     def __init__(self, canal_layer, fosse_layer, liaison_layer, indus_layer):
@@ -19,400 +50,426 @@ class OptimizedNodeOps:
         self.indus_layer = indus_layer
         
         # Caches pour optimisation
-        self._incoming_cache: Optional[Dict[str, List[Tuple[str, QgsVectorLayer, QgsFeature]]]] = None
-        self._outgoing_cache: Optional[Dict[str, List[Tuple[str, QgsVectorLayer, QgsFeature]]]] = None
-        self._liaison_by_node: Optional[Dict[str, List[QgsFeature]]] = None
-        self._indus_feat_cache: Optional[Dict[str, QgsFeature]] = None
+        self._liaison_by_node: Optional[Dict[str, List[LiaisonRecord]]] = None
+        self._liaison_node_of: Dict[int, str] = {}  # fid liaison -> ouvrage
+        self._graph: Optional[NetworkGraph] = None
+        self._industrials: Optional[IndustrialsService] = None
+        self._watched: List[Tuple[QgsVectorLayer, Dict[str, object]]] = []
     
     def invalidate_caches(self):
-        """Invalide tous les caches."""
-        self._incoming_cache = None
-        self._outgoing_cache = None
+        """Invalide tous les caches (y compris le graphe partagé)."""
+        if self._graph is not None:
+            invalidate_graph(self.canal_layer, self.fosse_layer)
+        self._graph = None
         self._liaison_by_node = None
-        self._indus_feat_cache = None
-    
-    def build_incoming_cache(self) -> Dict[str, List[Tuple[str, QgsVectorLayer, QgsFeature]]]:
-        """Construit un cache des arêtes entrantes pour tous les nœuds (amont)."""
-        if self._incoming_cache is not None:
-            return self._incoming_cache
-        
-        cache: Dict[str, List[Tuple[str, QgsVectorLayer, QgsFeature]]] = {}
-        
-        # Canal layer - éditer pour éviter requêtes répétées
-        if self.canal_layer and self.canal_layer.isValid():
-            for f in self.canal_layer.getFeatures():
-                try:
-                    idnini = (f['idnini'] or "").strip()
-                    idnterm = (f['idnterm'] or "").strip()
-                    if idnini != 'INCONNU' and idnterm != 'INCONNU' and idnterm:
-                        if idnterm not in cache:
-                            cache[idnterm] = []
-                        # Dupliquer le feature pour éviter problèmes de référence
-                        cache[idnterm].append(("canal", self.canal_layer, QgsFeature(f)))
-                except Exception:
-                    continue
-        
-        # Fosse layer
-        if self.fosse_layer and self.fosse_layer.isValid():
-            for f in self.fosse_layer.getFeatures():
-                try:
-                    idnini = (f['idnini'] or "").strip()
-                    idnterm = (f['idnterm'] or "").strip()
-                    if idnini != 'INCONNU' and idnterm != 'INCONNU' and idnterm:
-                        if idnterm not in cache:
-                            cache[idnterm] = []
-                        cache[idnterm].append(("fosse", self.fosse_layer, QgsFeature(f)))
-                except Exception:
-                    continue
-        
-        self._incoming_cache = cache
-        return cache
-    
-    def build_outgoing_cache(self) -> Dict[str, List[Tuple[str, QgsVectorLayer, QgsFeature]]]:
-        """Construit un cache des arêtes sortantes pour tous les nœuds (aval)."""
-        if self._outgoing_cache is not None:
-            return self._outgoing_cache
-        
-        cache: Dict[str, List[Tuple[str, QgsVectorLayer, QgsFeature]]] = {}
-        
-        # Canal layer
-        if self.canal_layer and self.canal_layer.isValid():
-            for f in self.canal_layer.getFeatures():
-                try:
-                    idnini = (f['idnini'] or "").strip()
-                    idnterm = (f['idnterm'] or "").strip()
-                    if idnini != 'INCONNU' and idnterm != 'INCONNU' and idnini:
-                        if idnini not in cache:
-                            cache[idnini] = []
-                        cache[idnini].append(("canal", self.canal_layer, QgsFeature(f)))
-                except Exception:
-                    continue
-        
-        # Fosse layer
-        if self.fosse_layer and self.fosse_layer.isValid():
-            for f in self.fosse_layer.getFeatures():
-                try:
-                    idnini = (f['idnini'] or "").strip()
-                    idnterm = (f['idnterm'] or "").strip()
-                    if idnini != 'INCONNU' and idnterm != 'INCONNU' and idnini:
-                        if idnini not in cache:
-                            cache[idnini] = []
-                        cache[idnini].append(("fosse", self.fosse_layer, QgsFeature(f)))
-                except Exception:
-                    continue
-        
-        self._outgoing_cache = cache
-        return cache
+        self._liaison_node_of = {}
+        self._industrials = None
+
+    def set_layers(self, canal_layer, fosse_layer, liaison_layer, indus_layer):
+        """
+        Met à jour les couches sans tout invalider : seuls les caches des
+        couches remplacées sont oubliés. Les éditions sur les couches en place
+        sont suivies par signaux (graphe partagé, cache des liaisons).
+        """
+        if canal_layer is not self.canal_layer or fosse_layer is not self.fosse_layer:
+            self.canal_layer = canal_layer
+            self.fosse_layer = fosse_layer
+            self._graph = None
+        if liaison_layer is not self.liaison_layer:
+            self._unwatch(self.liaison_layer)
+            self.liaison_layer = liaison_layer
+            self._liaison_by_node = None
+            self._liaison_node_of = {}
+            self._industrials = None
+        if indus_layer is not self.indus_layer:
+            self.indus_layer = indus_layer
+            self._industrials = None
+
+    # --- Suivi des éditions ---
+
+    def _watch(self, layer, slots: Dict[str, object]):
+        if layer is None or any(lyr is layer for lyr, _ in self._watched):
+            return
+        for sig, slot in slots.items():
+            getattr(layer, sig).connect(slot)
+        self._watched.append((layer, slots))
+
+    def _unwatch(self, *layers):
+        keep = []
+        for lyr, slots in self._watched:
+            if any(lyr is l for l in layers if l is not None):
+                for sig, slot in slots.items():
+                    try:
+                        getattr(lyr, sig).disconnect(slot)
+                    except (RuntimeError, TypeError):
+                        pass
+            else:
+                keep.append((lyr, slots))
+        self._watched = keep
+
+    def _watch_liaisons(self):
+        """Le cache des liaisons est corrigé entité par entité."""
+        layer = self.liaison_layer
+        self._watch(layer, {
+            "featureAdded": lambda fid: self._liaison_refresh(fid),
+            "featureDeleted": lambda fid: self._liaison_forget(fid),
+            "attributeValueChanged": lambda fid, _idx, _val: self._liaison_refresh(fid),
+            "committedFeaturesAdded": lambda _lid, feats: self._liaison_committed(feats),
+            "afterRollBack": lambda: self._liaison_reset(),
+        })
+
+    def _liaison_reset(self):
+        self._liaison_by_node = None
+        self._liaison_node_of = {}
+
+    def _liaison_forget(self, fid: int):
+        node = self._liaison_node_of.pop(fid, None)
+        if node is None or self._liaison_by_node is None:
+            return
+        lst = [lf for lf in self._liaison_by_node.get(node, []) if lf.fid != fid]
+        if lst:
+            self._liaison_by_node[node] = lst
+        else:
+            self._liaison_by_node.pop(node, None)
+
+    def _liaison_add(self, f: QgsFeature):
+        try:
+            id_ouvr = (f['id_ouvrage'] or "").strip()
+            iid = f['id_industriel']
+        except Exception:
+            return
+        indus = str(iid) if iid and str(iid).upper() != 'INCONNU' else ""
+        if id_ouvr and id_ouvr.upper() != 'INCONNU':
+            self._liaison_by_node.setdefault(id_ouvr, []).append(LiaisonRecord(f.id(), id_ouvr, indus))
+            self._liaison_node_of[f.id()] = id_ouvr
+
+    def _liaison_refresh(self, fid: int):
+        if self._liaison_by_node is None:
+            return
+        self._liaison_forget(fid)
+        f = self.liaison_layer.getFeature(fid)
+        if f.isValid():
+            self._liaison_add(f)
+
+    def _liaison_committed(self, feats):
+        """Après validation, les FIDs temporaires (< 0) sont remplacés."""
+        if self._liaison_by_node is None:
+            return
+        for fid in [fid for fid in self._liaison_node_of if fid < 0]:
+            self._liaison_forget(fid)
+        for f in feats:
+            self._liaison_forget(f.id())
+            self._liaison_add(f)
     
-    def build_liaison_cache(self) -> Dict[str, List[QgsFeature]]:
+    def build_liaison_cache(self) -> Dict[str, List[LiaisonRecord]]:
         """Construit un cache des liaisons par ouvrage."""
         if self._liaison_by_node is not None:
             return self._liaison_by_node
-        
-        cache: Dict[str, List[QgsFeature]] = {}
-        
+
+        self._liaison_by_node = {}
+        self._liaison_node_of = {}
+
         if self.liaison_layer and self.liaison_layer.isValid():
-            for f in self.liaison_layer.getFeatures():
-                try:
-                    id_ouvr = (f['id_ouvrage'] or "").strip()
-                    if id_ouvr and id_ouvr.upper() != 'INCONNU':
-                        if id_ouvr not in cache:
-                            cache[id_ouvr] = []
-                        cache[id_ouvr].append(QgsFeature(f))
-                except Exception:
-                    continue
-        
-        self._liaison_by_node = cache
-        return cache
-    
-    def walk_upstream_mixed_optimized(self, start_node: Optional[str]) -> Tuple[Set[int], Set[int], Set[str]]:
-        """Version optimisée du parcours amont avec cache."""
-        if not start_node:
-            return set(), set(), set()
-        
-        # Construire le cache une seule fois
-        incoming_cache = self.build_incoming_cache()
-        
-        seen_nodes: Set[str] = set()
-        cids: Set[int] = set()
-        fids: Set[int] = set()
-        stack = [str(start_node)]
-        
-        while stack:
-            cur = stack.pop()
-            if cur in seen_nodes:
-                continue
-            seen_nodes.add(cur)
-            
-            # Utiliser le cache au lieu de requêtes
-            edges = incoming_cache.get(cur, [])
-            for typ, layer, feat in edges:
-                fid = feat.id()
-                if typ == "canal":
-                    if fid in cids:
-                        continue
-                    cids.add(fid)
-                else:
-                    if fid in fids:
-                        continue
-                    fids.add(fid)
-                
-                try:
-                    nxt = (feat['idnini'] or "").strip()
-                    if nxt and nxt.upper() != "INCONNU":
-                        stack.append(str(nxt))
-                except Exception:
-                    pass
-        
-        return cids, fids, seen_nodes
-    
-    def walk_downstream_mixed_optimized(self, start_node: Optional[str]) -> Tuple[Set[int], Set[int], Set[str]]:
-        """Version optimisée du parcours aval avec cache."""
-        if not start_node:
-            return set(), set(), set()
-        
-        # Construire le cache une seule fois
-        outgoing_cache = self.build_outgoing_cache()
-        
-        seen_nodes: Set[str] = set()
-        cids: Set[int] = set()
-        fids: Set[int] = set()
-        stack = [str(start_node).strip()]
-        
-        while stack:
-            cur = stack.pop()
-            if cur in seen_nodes:
-                continue
-            seen_nodes.add(cur)
-            
-            # Utiliser le cache
-            edges = outgoing_cache.get(cur, [])
-            for typ, layer, feat in edges:
-                fid = feat.id()
-                if typ == "canal":
-                    if fid in cids:
-                        continue
-                    cids.add(fid)
-                else:
-                    if fid in fids:
-                        continue
-                    fids.add(fid)
-                
-                try:
-                    nxt = (feat['idnterm'] or "").strip()
-                    if nxt and nxt.upper() != "INCONNU":
-                        stack.append(str(nxt))
-                except Exception:
-                    pass
-        
-        return cids, fids, seen_nodes
-    
-    def walk_upstream_on_selected_optimized(self, start_node: Optional[str], 
-                                           sel_c: Set[int], sel_f: Set[int]) -> Tuple[Set[int], Set[int], Set[str]]:
-        """Parcours amont limité à la sélection (optimisé)."""
-        if not start_node:
-            return set(), set(), set()
-        
-        incoming_cache = self.build_incoming_cache()
-        
-        seen_nodes: Set[str] = set()
-        cids: Set[int] = set()
-        fids: Set[int] = set()
-        stack = [str(start_node).strip()]
-        
-        while stack:
-            cur = stack.pop()
-            if cur in seen_nodes:
-                continue
-            seen_nodes.add(cur)
-            
-            edges = incoming_cache.get(cur, [])
-            for typ, layer, feat in edges:
-                fid = feat.id()
-                if typ == "canal":
-                    if fid not in sel_c or fid in cids:
-                        continue
-                    cids.add(fid)
-                else:
-                    if fid not in sel_f or fid in fids:
-                        continue
-                    fids.add(fid)
-                
-                try:
-                    nxt = (feat['idnini'] or "").strip()
-                    if nxt and nxt.upper() != "INCONNU":
-                        stack.append(str(nxt))
-                except Exception:
-                    pass
-        
-        return cids, fids, seen_nodes
-    
-    def walk_downstream_on_selected_optimized(self, start_node: Optional[str],
-                                              sel_c: Set[int], sel_f: Set[int]) -> Tuple[Set[int], Set[int], Set[str]]:
-        """Parcours aval limité à la sélection (optimisé)."""
-        if not start_node:
+            req = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry)
+            req.setSubsetOfAttributes(["id_ouvrage", "id_industriel"], self.liaison_layer.fields())
+            for f in self.liaison_layer.getFeatures(req):
+                self._liaison_add(f)
+            self._watch_liaisons()
+
+        return self._liaison_by_node
+
+    @property
+    def graph(self) -> NetworkGraph:
+        """Graphe compact canal + fossé partagé (tenu à jour par les signaux d'édition)."""
+        self._graph = get_graph(self.canal_layer, self.fosse_layer)
+        return self._graph
+
+    @property
+    def industrials(self) -> IndustrialsService:
+        """Résolutions liaisons → industriels (index des couches LIAISON / INDUS)."""
+        if self._industrials is None:
+            self._industrials = IndustrialsService(self.indus_layer, self.liaison_layer)
+        return self._industrials
+
+    @property
+    def reachability(self) -> ReachabilityIndex:
+        """Index d'accessibilité amont du graphe (partagé, daté par version)."""
+        return get_reachability(self.graph)
+
+    def _upstream_edges(self, start_node: str) -> Tuple[List[int], List[int]]:
+        """
+        Amont complet sans restriction : énuméré depuis l'index d'accessibilité
+        (toutes les arêtes entrantes des nœuds amont et du départ).
+        Retour : (arêtes, nœuds) en indices du graphe.
+        """
+        g = self.graph
+        start = g.node(start_node)
+        if start < 0:
+            return [], []
+        nodes = [start]
+        nodes.extend(self.reachability.iter_upstream(start))
+        edges = [e for n in nodes for e in g.in_edges(n)]
+        return edges, nodes
+
+    def path_on_selected(self, start_node: Optional[str], targets: List[str],
+                         sel_c: Set[int], sel_f: Set[int]) -> Tuple[Set[int], Set[int], Set[str]]:
+        """
+        Tronçons de la sélection situés sur un chemin départ → cibles, en un
+        seul appel (passage avant + passage arrière sur le graphe).
+        Si le départ ne mène à aucune cible, tout l'amont des cibles est retenu.
+        """
+        g = self.graph
+        if not any(targets):
             return set(), set(), set()
-        
-        outgoing_cache = self.build_outgoing_cache()
-        
-        seen_nodes: Set[str] = set()
+        edges, nodes = self._path_edges(start_node, targets, g.mask_from_fids(sel_c or (), sel_f or ()))
+
         cids: Set[int] = set()
         fids: Set[int] = set()
-        stack = [str(start_node).strip()]
-        
-        while stack:
-            cur = stack.pop()
-            if cur in seen_nodes:
-                continue
-            seen_nodes.add(cur)
-            
-            edges = outgoing_cache.get(cur, [])
-            for typ, layer, feat in edges:
-                fid = feat.id()
-                if typ == "canal":
-                    if fid not in sel_c or fid in cids:
-                        continue
-                    cids.add(fid)
-                else:
-                    if fid not in sel_f or fid in fids:
-                        continue
-                    fids.add(fid)
-                
-                try:
-                    nxt = (feat['idnterm'] or "").strip()
-                    if nxt and nxt.upper() != "INCONNU":
-                        stack.append(str(nxt))
-                except Exception:
-                    pass
-        
+        for e in edges:
+            (cids if g.edge_layer[e] == LAYER_CANAL else fids).add(g.edge_fid[e])
+        seen_nodes = g.node_names(nodes)
+        seen_nodes.update(t.strip() for t in targets if t)
         return cids, fids, seen_nodes
-    
-    def deselect_liaisons_and_indus_from_nodes_optimized(self, nodes: Set[str]) -> Set[str]:
-        """
-        Désélectionne liaisons et industriels depuis un ensemble de nœuds (OPTIMISÉ).
-        Utilise un cache pour éviter les multiples getFeature().
-        """
-        removed_indus: Set[str] = set()
-        if not nodes or not self.liaison_layer:
-            return removed_indus
-        
-        # Construire le cache des liaisons si pas déjà fait
-        liaison_cache = self.build_liaison_cache()
-        
-        lids_to_deselect: List[int] = []
-        
-        # Parcourir les nœuds et collecter les liaisons + indus
-        for node in nodes:
-            node = (node or "").strip()
-            if not node:
-                continue
-            
-            liaisons = liaison_cache.get(node, [])
-            for lf in liaisons:
-                lids_to_deselect.append(lf.id())
-                try:
-                    iid = lf['id_industriel']
-                    if iid and str(iid).upper() != 'INCONNU':
-                        removed_indus.add(str(iid))
-                except Exception:
-                    pass
-        
-        # Désélectionner les liaisons en une seule fois
-        if lids_to_deselect:
-            self.liaison_layer.deselect(lids_to_deselect)
-        
-        # Désélectionner les industriels en batch
-        if self.indus_layer and removed_indus:
-            esc = lambda s: (s or "").replace("'", "''")
-            values = ",".join("'{}'".format(esc(i)) for i in removed_indus if i)
-            if values:
-                exprI = QgsExpression("trim(\"id\") IN ({})".format(values))
-                reqI = QgsFeatureRequest(exprI)
-                rem_ids = [f.id() for f in self.indus_layer.getFeatures(reqI)]
-                if rem_ids:
-                    self.indus_layer.deselect(rem_ids)
-        
-        return removed_indus
-    
-    def bulk_deselect_unselected_branches_optimized(
-        self, 
-        start_node: str,
-        branches: List[Tuple[str, int, Optional[str], Optional[str]]],
-        chosen_ids: Set[int]
-    ) -> Set[str]:
+
+    def _path_edges(self, start_node: Optional[str], targets: List[str],
+                    mask: bytearray) -> Tuple[List[int], List[int]]:
+        """Arêtes / nœuds du masque situés sur un chemin départ → cibles (voir path_on_selected)."""
+        g = self.graph
+        dst = [g.node((t or "").strip()) for t in targets if t]
+        if not dst:
+            return [], []
+        src = g.node((start_node or "").strip())
+        res = g.path_between(src, dst, edge_mask=mask) if src >= 0 else None
+        if res is None or res.length < 0:
+            res = g.path_between(None, dst, edge_mask=mask)
+        return res.edges, res.nodes
+
+    def visit_cleanup(self, node_id: str,
+                      branches: List[Tuple[str, int, Optional[str], Optional[str]]],
+                      chosen_keep: Set[int], polluted: bool,
+                      start_node: Optional[str],
+                      delta: Optional[Dict[str, List]] = None) -> Set[str]:
         """
-        Désélectionne tout l'amont pour les branches NON cochées (VERSION OPTIMISÉE).
-        Utilise les caches pour accélérer les parcours.
+        Nettoyage de sélection d'une visite, calculé sur des masques alignés sur
+        les arêtes du graphe (sélection, amont retiré, KEEP, purge) puis poussé
+        en une seule mise à jour de sélection par couche :
+          - branches amont non conservées : la branche et tout son amont ;
+          - pollué : ne restent que les branches conservées et les tronçons de
+            la sélection sur un chemin départ → amont de ces branches.
+        Les liaisons / industriels des nœuds retirés sont désélectionnés.
+
+        delta : si fourni, reçoit les FIDs effectivement retirés de la
+                sélection ('canal', 'fosse', 'liaison', 'indus') pour
+                `apply_visit_delta`.
+
+        Retour : IDs des industriels retirés.
         """
-        removed_cids: Set[int] = set()
-        removed_fids: Set[int] = set()
-        removed_lids: Set[int] = set()
+        g = self.graph
+        node_id = node_id.strip()
+        canal_sel = self.canal_layer.selectedFeatureIds() if self.canal_layer else []
+        fosse_sel = self.fosse_layer.selectedFeatureIds() if self.fosse_layer else []
+        sel = g.mask_from_fids(canal_sel, fosse_sel)
+        n_before = sum(sel)
+        index = {"canal": g.fid_index(LAYER_CANAL), "fosse": g.fid_index(LAYER_FOSSE)}
+        # Sélection hors graphe (extrémité INCONNU…) : retirée seulement par la purge
+        extra = {
+            "canal": {fid for fid in canal_sel if fid not in index["canal"]},
+            "fosse": {fid for fid in fosse_sel if fid not in index["fosse"]},
+        }
+        n_extra = {k: len(v) for k, v in extra.items()}
+
         removed_nodes: Set[str] = set()
+        removed_lids: Set[int] = set()
         removed_indus: Set[str] = set()
-        
-        # Construire les caches une seule fois
-        liaison_cache = self.build_liaison_cache()
-        
+
+        # 1) Branches amont non conservées → branche + tout son amont
         for typ, fid, amont, indus in branches:
-            if fid in chosen_ids:
+            if fid in chosen_keep:
                 continue
-            
-            if typ == "canal":
-                removed_cids.add(fid)
-                cids, fids, nodes = self.walk_upstream_mixed_optimized(amont)
-                removed_cids.update(cids)
-                removed_fids.update(fids)
-                removed_nodes.update(nodes)
-            elif typ == "fosse":
-                removed_fids.add(fid)
-                cids, fids, nodes = self.walk_upstream_mixed_optimized(amont)
-                removed_cids.update(cids)
-                removed_fids.update(fids)
-                removed_nodes.update(nodes)
+            if typ in index:
+                e = index[typ].get(fid)
+                if e is None:
+                    extra[typ].discard(fid)
+                else:
+                    sel[e] = 0
+                if amont:
+                    amont = str(amont).strip()
+                    edges, nodes = self._upstream_edges(amont)
+                    for e in edges:
+                        sel[e] = 0
+                    removed_nodes.update(g.node_names(nodes))
+                    removed_nodes.add(amont)
             else:  # liaison
                 removed_lids.add(fid)
                 if indus:
                     removed_indus.add(str(indus))
-        
-        # Désélectionner en batch
-        if self.canal_layer and removed_cids:
-            self.canal_layer.deselect(list(removed_cids))
-        if self.fosse_layer and removed_fids:
-            self.fosse_layer.deselect(list(removed_fids))
-        
-        # Liaisons amont + indus (depuis tous les nœuds collectés) - VERSION OPTIMISÉE
-        ids_to_unselect = list(removed_lids)
-        
-        # Utiliser le cache pour les liaisons
-        for node in removed_nodes:
-            node = (node or "").strip()
-            if not node:
-                continue
-            liaisons = liaison_cache.get(node, [])
-            for lf in liaisons:
-                lid = lf.id()
-                if lid not in ids_to_unselect:
-                    ids_to_unselect.append(lid)
-                try:
-                    iid = lf['id_industriel']
-                    if iid and str(iid).upper() != 'INCONNU':
-                        removed_indus.add(str(iid))
-                except Exception:
-                    pass
-        
-        # Désélectionner toutes les liaisons en une fois
-        if self.liaison_layer and ids_to_unselect:
-            self.liaison_layer.deselect(ids_to_unselect)
-        
-        # Désélectionner les industriels en batch
-        if self.indus_layer and removed_indus:
-            esc = lambda s: (s or "").replace("'", "''")
-            values = ",".join("'{}'".format(esc(i)) for i in removed_indus if i)
-            if values:
-                exprI = QgsExpression("trim(\"id\") IN ({})".format(values))
-                reqI = QgsFeatureRequest(exprI)
-                rem_ids = [f.id() for f in self.indus_layer.getFeatures(reqI)]
-                if rem_ids:
-                    self.indus_layer.deselect(rem_ids)
-        
+        self._liaisons_of_nodes(removed_nodes, removed_lids, removed_indus)
+
+        # 2) Pollué → KEEP = branches conservées + chemins départ → amont ; purge du reste
+        if polluted:
+            keep = bytearray(len(sel))
+            keep_extra = {"canal": set(), "fosse": set()}
+            keep_nodes: Set[str] = {node_id}
+            amonts: List[str] = []
+            for typ, fid, amont, _ in branches:
+                if fid not in chosen_keep:
+                    continue
+                if typ in index:
+                    e = index[typ].get(fid)
+                    if e is None:
+                        keep_extra[typ].add(fid)
+                    else:
+                        keep[e] = 1
+                if amont:
+                    amonts.append(str(amont))
+            if amonts:
+                edges, nodes = self._path_edges(start_node, amonts, sel)
+                for e in edges:
+                    keep[e] = 1
+                keep_nodes.update(g.node_names(nodes))
+                keep_nodes.update(t.strip() for t in amonts)
+
+            purged = _bits_andnot(sel, keep)
+            sel = _bits_and(sel, keep)
+            purged_extra = {k: extra[k] - keep_extra[k] for k in extra}
+            extra = {k: extra[k] & keep_extra[k] for k in extra}
+
+            nodes_removed = g.node_names(
+                n for e in compress(range(len(purged)), purged)
+                for n in (g.edge_src[e], g.edge_dst[e]))
+            for typ, layer in (("canal", self.canal_layer), ("fosse", self.fosse_layer)):
+                nodes_removed.update(self._nodes_of_fids(layer, purged_extra[typ]))
+            nodes_removed.difference_update(keep_nodes)
+            self._liaisons_of_nodes(nodes_removed, removed_lids, removed_indus)
+
+        # 3) Une seule mise à jour de sélection par couche
+        removed = {"canal": [], "fosse": [], "liaison": [], "indus": []}
+        if sum(sel) != n_before or any(len(extra[k]) != n_extra[k] for k in extra):
+            canal_ids, fosse_ids = g.fids_by_layer(compress(range(len(sel)), sel))
+            for typ, layer, before, after in (
+                ("canal", self.canal_layer, canal_sel, canal_ids + sorted(extra["canal"])),
+                ("fosse", self.fosse_layer, fosse_sel, fosse_ids + sorted(extra["fosse"])),
+            ):
+                if layer:
+                    layer.selectByIds(after, QgsVectorLayer.SetSelection)
+                    removed[typ] = sorted(set(before).difference(after))
+        if self.liaison_layer and removed_lids:
+            removed["liaison"] = sorted(removed_lids.intersection(self.liaison_layer.selectedFeatureIds()))
+            self.liaison_layer.deselect(sorted(removed_lids))
+        removed["indus"] = self._deselect_indus(removed_indus)
+        if delta is not None:
+            delta.update(removed)
         return removed_indus
+
+    def replay_visits(self, start_node: Optional[str], visits: List[Dict[str, object]],
+                      delta: Optional[Dict[str, List]] = None) -> Set[str]:
+        """
+        Rejoue toutes les visites sur la sélection courante (trace fraîche) en
+        un seul passage sur le graphe (core/visit_replay.py), puis une seule
+        mise à jour de sélection par couche. Les liaisons / industriels des
+        nœuds écartés sont désélectionnés.
+
+        delta : comme pour `visit_cleanup`.
+        Retour : IDs des industriels retirés.
+        """
+        g = self.graph
+        canal_sel = self.canal_layer.selectedFeatureIds() if self.canal_layer else []
+        fosse_sel = self.fosse_layer.selectedFeatureIds() if self.fosse_layer else []
+        res = replay_visits(g, start_node, visits, g.mask_from_fids(canal_sel, fosse_sel))
+
+        removed = {"canal": [], "fosse": [], "liaison": [], "indus": []}
+        removed_lids: Set[int] = set()
+        removed_indus: Set[str] = set()
+        if res.removed:
+            rm_canal, rm_fosse = g.fids_by_layer(res.removed)
+            for typ, layer, fids in (("canal", self.canal_layer, rm_canal),
+                                     ("fosse", self.fosse_layer, rm_fosse)):
+                if layer and fids:
+                    layer.deselect(fids)
+                    removed[typ] = sorted(fids)
+            nodes_removed = g.node_names(
+                n for e in res.removed for n in (g.edge_src[e], g.edge_dst[e]))
+            nodes_removed.difference_update(g.node_names(res.nodes))
+            self._liaisons_of_nodes(nodes_removed, removed_lids, removed_indus)
+        if self.liaison_layer and removed_lids:
+            removed["liaison"] = sorted(removed_lids.intersection(self.liaison_layer.selectedFeatureIds()))
+            self.liaison_layer.deselect(sorted(removed_lids))
+        removed["indus"] = self._deselect_indus(removed_indus)
+        if delta is not None:
+            delta.update(removed)
+        return removed_indus
+
+    def suggest_next_visits(self, exclude: Iterable[str] = (),
+                            node_weight: Optional[Dict[str, float]] = None,
+                            by_industrials: bool = False,
+                            limit: int = 10) -> List[VisitSuggestion]:
+        """
+        Regards classés par équilibre du partage de la sélection courante
+        (core/visit_planner.py). by_industrials : poids 1 + nombre
+        d'industriels raccordés au nœud (cache des liaisons).
+        """
+        g = self.graph
+        canal_sel = self.canal_layer.selectedFeatureIds() if self.canal_layer else []
+        fosse_sel = self.fosse_layer.selectedFeatureIds() if self.fosse_layer else []
+        if by_industrials and self.liaison_layer:
+            node_weight = dict(node_weight or {})
+            for node, recs in self.build_liaison_cache().items():
+                n = sum(1 for r in recs if r.indus)
+                if n:
+                    node_weight[node] = node_weight.get(node, 1.0) + n
+        return suggest_visits(g, g.mask_from_fids(canal_sel, fosse_sel), node_weight, exclude, limit)
+
+    def apply_visit_delta(self, delta: Dict[str, List], undo: bool) -> None:
+        """
+        Rejoue le delta d'une visite (FIDs retirés par `visit_cleanup`) :
+        undo = les remet dans la sélection, sinon les retire de nouveau.
+        Coût proportionnel à la taille du delta.
+        """
+        for key, layer in (("canal", self.canal_layer), ("fosse", self.fosse_layer),
+                           ("liaison", self.liaison_layer), ("indus", self.indus_layer)):
+            fids = [int(f) for f in delta.get(key) or ()]
+            if not layer or not fids:
+                continue
+            if undo:
+                layer.selectByIds(fids, QgsVectorLayer.AddToSelection)
+            else:
+                layer.deselect(fids)
+
+    def _liaisons_of_nodes(self, nodes: Set[str], lids: Set[int], indus: Set[str]) -> None:
+        """Complète lids / indus avec les liaisons des nœuds donnés (cache des liaisons)."""
+        if not nodes or not self.liaison_layer:
+            return
+        cache = self.build_liaison_cache()
+        for node in nodes:
+            for lf in cache.get((node or "").strip(), ()):
+                lids.add(lf.fid)
+                if lf.indus:
+                    indus.add(lf.indus)
+
+    @staticmethod
+    def _nodes_of_fids(layer, fids: Set[int]) -> Set[str]:
+        out: Set[str] = set()
+        if not layer or not fids:
+            return out
+        req = QgsFeatureRequest().setFilterFids(list(fids))
+        req.setFlags(QgsFeatureRequest.NoGeometry)
+        for f in layer.getFeatures(req):
+            try:
+                for v in (f['idnini'], f['idnterm']):
+                    v = (v or "").strip()
+                    if v and v.upper() != "INCONNU":
+                        out.add(v)
+            except Exception:
+                pass
+        return out
+
+    def _deselect_indus(self, indus_ids: Set[str]) -> List[int]:
+        """Désélectionne les industriels donnés ; retour : FIDs qui étaient sélectionnés."""
+        if not self.indus_layer or not indus_ids:
+            return []
+        rem_ids = self.industrials.indus_fids_of(indus_ids)
+        if not rem_ids:
+            return []
+        was_selected = sorted(set(rem_ids).intersection(self.indus_layer.selectedFeatureIds()))
+        self.indus_layer.deselect(rem_ids)
+        return was_selected
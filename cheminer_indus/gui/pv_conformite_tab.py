@@ -42,6 +42,10 @@ class PVConformiteTab(QWidget):
         self.temp_indus_layer = None
         self.temp_path_layer = None
         
+        # Campagne PV (cheminement en masse) : ensembles relus et couches chargées
+        self.batch_sets = {}
+        self.batch_layers = []
+        
         self._init_ui()
         
     def _init_ui(self):
@@ -83,6 +87,9 @@ class PVConformiteTab(QWidget):
         # Groupe 3: Actions
         self._add_actions_group(layout)
         
+        # Groupe 4: Campagne PV (tous les PV non conformes)
+        self._add_batch_group(layout)
+        
         layout.addStretch()
         
     def _add_config_group(self, layout):
@@ -244,6 +251,34 @@ class PVConformiteTab(QWidget):
         
         layout.addWidget(group)
         
+    def _add_batch_group(self, layout):
+        """Ajoute le groupe de la campagne PV (cheminement en masse)"""
+        group = QGroupBox("🚚 Campagne PV (tous les PV non conformes)")
+        group_layout = QVBoxLayout(group)
+        
+        btn_layout = QHBoxLayout()
+        btn_run = QPushButton("▶️ Lancer une campagne…")
+        btn_run.setToolTip("Cheminer depuis chaque PV non conforme et écrire les tables CSV")
+        btn_run.clicked.connect(self._on_batch_run)
+        btn_layout.addWidget(btn_run)
+        
+        btn_load = QPushButton("📂 Charger une campagne…")
+        btn_load.setToolTip("Relire les tables CSV d'une campagne (fichier *_ensembles.csv)")
+        btn_load.clicked.connect(self._on_batch_load)
+        btn_layout.addWidget(btn_load)
+        group_layout.addLayout(btn_layout)
+        
+        # Ensemble d'arêtes à sélectionner sur la carte
+        set_layout = QHBoxLayout()
+        set_layout.addWidget(QLabel("Ensemble :"))
+        self.batch_combo = QComboBox()
+        self.batch_combo.setToolTip("Sélectionne sur la carte les tronçons de l'ensemble choisi")
+        self.batch_combo.currentIndexChanged.connect(self._on_batch_set_changed)
+        set_layout.addWidget(self.batch_combo, 1)
+        group_layout.addLayout(set_layout)
+        
+        layout.addWidget(group)
+        
     # ========================================================================
     # Méthodes d'analyse
     # ========================================================================
@@ -760,6 +795,112 @@ class PVConformiteTab(QWidget):
             "Génération de rapport : fonctionnalité à implémenter dans la prochaine version."
         )
         
+    # ========================================================================
+    # Campagne PV
+    # ========================================================================
+    
+    @staticmethod
+    def _batch_base(path: str) -> str:
+        """Préfixe des tables d'une campagne à partir d'un de ses fichiers"""
+        from ..core.batch_trace import EDGESET_SUFFIX, PV_SUFFIX
+        
+        for suffix in (EDGESET_SUFFIX, PV_SUFFIX, ".csv"):
+            if path.endswith(suffix):
+                return path[:-len(suffix)]
+        return path
+        
+    def _on_batch_run(self):
+        """Lance la campagne sur tous les PV non conformes puis la charge"""
+        from ..core.batch_trace import trace_pv_batch
+        
+        pv_layer = self._find_layer_by_name("PV_CONFORMITE") or self._find_layer_by_name("osmose.PV_CONFORMITE")
+        canal_layer = self.main_dock.canal_layer
+        if not pv_layer or not canal_layer:
+            QMessageBox.warning(
+                self,
+                "Campagne PV",
+                "Couches PV_CONFORMITE et canalisations nécessaires (réalisez d'abord un cheminement)."
+            )
+            return
+        
+        file_path, _ = QFileDialog.getSaveFileName(self, "Campagne PV", "", "Fichiers CSV (*.csv)")
+        if not file_path:
+            return
+        base = self._batch_base(file_path)
+        
+        fosse_layer = self.main_dock.fosse_layer
+        status = self.iface.mainWindow().statusBar()
+        try:
+            res = self.main_dock._run_with_wait_cursor(
+                trace_pv_batch, canal_layer, pv_layer, base,
+                fosse_layer=fosse_layer if fosse_layer and fosse_layer.isValid() else None,
+                liaison_layer=self.main_dock.liaison_layer,
+                field_alias=self.main_dock.field_alias,
+                search_distance=self.distance_spin.value(),
+                progress=lambda i, n: status.showMessage("Campagne PV : paquet {}/{}".format(i, n)),
+            )
+        except Exception as e:
+            QMessageBox.critical(self, "Campagne PV", f"Erreur pendant la campagne :\n{str(e)}")
+            return
+        
+        self.iface.messageBar().pushMessage(
+            "Campagne PV",
+            "✅ {pv} PV, {accroches} accrochés, {ensembles} ensembles".format(**res),
+            level=Qgis.Success,
+            duration=5
+        )
+        self._load_batch(base)
+        
+    def _on_batch_load(self):
+        """Relit une campagne existante"""
+        file_path, _ = QFileDialog.getOpenFileName(
+            self, "Charger une campagne PV", "", "Ensembles de campagne (*_ensembles.csv)"
+        )
+        if file_path:
+            self._load_batch(self._batch_base(file_path))
+        
+    def _load_batch(self, base: str):
+        """Charge les tables de la campagne (couches + liste des ensembles)"""
+        from ..core.batch_trace import batch_layers, load_edge_sets
+        
+        try:
+            self.batch_sets = load_edge_sets(base)
+        except (OSError, ValueError, KeyError) as e:
+            QMessageBox.critical(self, "Campagne PV", f"Tables de campagne illisibles :\n{str(e)}")
+            return
+        
+        project = QgsProject.instance()
+        for layer in self.batch_layers:
+            project.removeMapLayer(layer.id())
+        canal_layer = self.main_dock.canal_layer
+        crs = canal_layer.crs().authid() if canal_layer else ""
+        self.batch_layers = [lyr for lyr in batch_layers(base, crs) if lyr.isValid()]
+        project.addMapLayers(self.batch_layers)
+        
+        self.batch_combo.blockSignals(True)
+        self.batch_combo.clear()
+        for sid, edge_set in sorted(self.batch_sets.items()):
+            self.batch_combo.addItem(
+                "{} — {} m — {} PV — exutoire {}".format(
+                    sid, edge_set["longueur"], len(edge_set["pv"]), edge_set["exutoire"] or "?"),
+                sid
+            )
+        self.batch_combo.setCurrentIndex(-1)
+        self.batch_combo.blockSignals(False)
+        
+    def _on_batch_set_changed(self, index: int):
+        """Sélectionne sur la carte les tronçons de l'ensemble choisi"""
+        from ..core.batch_trace import select_edge_set
+        
+        sid = self.batch_combo.itemData(index) if index >= 0 else None
+        canal_layer = self.main_dock.canal_layer
+        if sid not in self.batch_sets or not canal_layer:
+            return
+        fosse_layer = self.main_dock.fosse_layer
+        select_edge_set(self.batch_sets[sid], canal_layer,
+                        fosse_layer if fosse_layer and fosse_layer.isValid() else None)
+        self.iface.mapCanvas().zoomToSelected(canal_layer)
+        
     # ========================================================================
     # Utilitaires
     # ========================================================================
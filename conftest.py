@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""
+Configuration pytest des tests des cœurs Python (graphe, accessibilité,
+cache, instantané disque, planification / rejeu de visites, index de segments,
+diagnostics, liaisons industrielles).
+
+Hors de QGIS, un module `qgis.core` minimal est installé pour les seuls
+besoins de ces tests ; les couches sont des couches factices en mémoire
+(`FakeLayer`), utilisables aussi avec le vrai `qgis.core`.
+"""
+
+import importlib.util
+import re
+import sys
+import types
+
+import pytest
+
+QGIS_AVAILABLE = importlib.util.find_spec("qgis") is not None
+
+# Script à exécuter dans la console Python de QGIS (couches du projet)
+collect_ignore = [] if QGIS_AVAILABLE else ["test_pv_analyzer.py"]
+
+
+class FakePoint:
+    def __init__(self, x, y):
+        self._x, self._y = float(x), float(y)
+
+    def x(self):
+        return self._x
+
+    def y(self):
+        return self._y
+
+
+class FakeGeometry:
+    """Polyligne simple : liste de sommets (x, y)."""
+
+    def __init__(self, points):
+        self.points = [FakePoint(x, y) for x, y in points]
+
+    def isEmpty(self):
+        return not self.points
+
+    def isMultipart(self):
+        return False
+
+    def asPolyline(self):
+        return list(self.points)
+
+    def length(self):
+        pts = self.points
+        return sum(((b.x() - a.x()) ** 2 + (b.y() - a.y()) ** 2) ** 0.5 for a, b in zip(pts, pts[1:]))
+
+
+class FakeFeature:
+    def __init__(self, fid, attrs, geometry=None):
+        self._fid = fid
+        self._attrs = dict(attrs)
+        self._geometry = geometry
+
+    def id(self):
+        return self._fid
+
+    def __getitem__(self, name):
+        return self._attrs[name]
+
+    def isValid(self):
+        return True
+
+    def hasGeometry(self):
+        return self._geometry is not None
+
+    def geometry(self):
+        return self._geometry
+
+
+class _InvalidFeature:
+    def isValid(self):
+        return False
+
+
+class _Fields:
+    def __init__(self, names):
+        self._names = list(names)
+
+    def names(self):
+        return list(self._names)
+
+
+class _Signal:
+    def __init__(self):
+        self.slots = []
+
+    def connect(self, slot):
+        self.slots.append(slot)
+
+    def disconnect(self, slot):
+        self.slots.remove(slot)
+
+    def emit(self, *args):
+        for slot in list(self.slots):
+            slot(*args)
+
+
+_EXPRESSION = re.compile(r'^(trim\()?"(\w+)"\)?\s*(=|IN)\s*\(?(.*?)\)?$')
+
+
+def _matches(feature, expression):
+    """Filtres `"champ" = 'v'` et `trim("champ") IN ('a', 'b')` des requêtes du plugin."""
+    trim, name, _, values = _EXPRESSION.match(expression).groups()
+    value = feature[name]
+    value = "" if value is None else str(value)
+    wanted = {v.replace("''", "'") for v in re.findall(r"'((?:[^']|'')*)'", values)}
+    return (value.strip() if trim else value) in wanted
+
+
+class FakeLayer:
+    """Couche vectorielle en mémoire (attributs, géométrie, sélection, signaux)."""
+
+    SIGNALS = ("featureAdded", "featureDeleted", "geometryChanged", "attributeValueChanged",
+               "committedFeaturesAdded", "afterRollBack")
+    _ids = 0
+
+    def __init__(self, names, features=(), name="layer"):
+        FakeLayer._ids += 1
+        self._id = "{}_{}".format(name, FakeLayer._ids)
+        self._names = list(names)
+        self.features = {f.id(): f for f in features}
+        self.selected = set()
+        for signal in self.SIGNALS:
+            setattr(self, signal, _Signal())
+
+    def id(self):
+        return self._id
+
+    def isValid(self):
+        return True
+
+    def providerType(self):
+        return "memory"
+
+    def source(self):
+        return "memory:" + self._id
+
+    def fields(self):
+        return _Fields(self._names)
+
+    def featureCount(self):
+        return len(self.features)
+
+    def getFeatures(self, request=None):
+        feats = list(self.features.values())
+        if request is None:
+            return iter(feats)
+        if request.filterType() == request.FilterFids:
+            fids = request.filterFids()
+            return iter([self.features[fid] for fid in sorted(fids) if fid in self.features])
+        expression = getattr(request, "expression", None)
+        if expression is not None:
+            return iter([f for f in feats if _matches(f, expression.expression)])
+        return iter(feats)
+
+    def getFeature(self, fid):
+        return self.features.get(fid, _InvalidFeature())
+
+    def selectedFeatureIds(self):
+        return sorted(self.selected)
+
+    def selectByIds(self, fids, behavior=0):
+        if behavior == 0:       # SetSelection
+            self.selected = set(fids)
+        elif behavior == 1:     # AddToSelection
+            self.selected |= set(fids)
+        elif behavior == 2:     # IntersectSelection
+            self.selected &= set(fids)
+        else:                   # RemoveFromSelection
+            self.selected -= set(fids)
+
+    def deselect(self, fids):
+        self.selected -= set(fids)
+
+
+def _install_fake_qgis():
+    class QgsFeatureRequest:
+        NoGeometry = 1
+        FilterNone = 0
+        FilterExpression = 2
+        FilterFids = 3
+
+        def __init__(self, expression=None):
+            self.expression = expression
+            self._fids = None
+
+        def setFlags(self, flags):
+            return self
+
+        def setSubsetOfAttributes(self, attrs, fields=None):
+            return self
+
+        def setFilterFids(self, fids):
+            self._fids = set(fids)
+            return self
+
+        def filterType(self):
+            if self._fids is not None:
+                return self.FilterFids
+            return self.FilterNone if self.expression is None else self.FilterExpression
+
+        def filterFids(self):
+            return set(self._fids or ())
+
+    class QgsExpression:
+        def __init__(self, expression):
+            self.expression = expression
+
+    class QgsVectorLayer(FakeLayer):
+        SetSelection = 0
+        AddToSelection = 1
+        IntersectSelection = 2
+        RemoveFromSelection = 3
+
+    core = types.ModuleType("qgis.core")
+    core.QgsExpression = QgsExpression
+    core.QgsFeatureRequest = QgsFeatureRequest
+    core.QgsVectorLayer = QgsVectorLayer
+    core.QgsFeature = FakeFeature
+    core.QgsGeometry = FakeGeometry
+    core.QgsPointXY = FakePoint
+    package = types.ModuleType("qgis")
+    package.core = core
+    sys.modules["qgis"] = package
+    sys.modules["qgis.core"] = core
+
+
+if not QGIS_AVAILABLE:
+    _install_fake_qgis()
+
+
+CANAL_FIELDS = ["idnini", "idnterm", "l_longcana_reelle", "contcanass"]
+
+
+def _canal_layer(rows, name="canal"):
+    feats = []
+    for row in rows:
+        fid, ini, term = row[:3]
+        length = row[3] if len(row) > 3 else 1.0
+        cat = row[4] if len(row) > 4 else ""
+        geom = FakeGeometry(row[5]) if len(row) > 5 else None
+        feats.append(FakeFeature(fid, {"idnini": ini, "idnterm": term,
+                                       "l_longcana_reelle": length, "contcanass": cat}, geom))
+    return FakeLayer(CANAL_FIELDS, feats, name)
+
+
+def _table(names, rows, name="table"):
+    return FakeLayer(names, [FakeFeature(row[0], dict(zip(names, row[1:]))) for row in rows], name)
+
+
+@pytest.fixture
+def layer_of():
+    """
+    Couche de tronçons à partir de tuples (fid, idnini, idnterm[, longueur
+    [, catégorie[, sommets]]]) : layer_of(rows[, name]).
+    """
+    return _canal_layer
+
+
+@pytest.fixture
+def graph_of():
+    """Graphe d'une couche de tronçons : graph_of(rows) (voir `layer_of`)."""
+    from cheminer_indus.core.graph import NetworkGraph
+
+    return lambda rows: NetworkGraph.from_layers(_canal_layer(rows))
+
+
+@pytest.fixture
+def table_of():
+    """Couche attributaire sans géométrie : table_of(champs, [(fid, valeurs…)][, name])."""
+    return _table
+
+
+@pytest.fixture(autouse=True)
+def _forget_shared_graphs():
+    from cheminer_indus.core.graph import invalidate_graph
+
+    yield
+    invalidate_graph()
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""Tests des règles de diagnostic des tronçons sélectionnés (core/diagnostics.py)."""
+
+from cheminer_indus.core.diagnostics import RULES, ContrePenteRule, Diagnostics
+
+CANAL = ["idnini", "idnterm", "z_amont", "zaval"]
+
+
+def _run(table_of, names, rows, selected):
+    canal = table_of(names, rows, "canal")
+    canal.selectByIds(selected)
+    ouvr = table_of(["idouvrage", "typreseau"], [], "ouvrage")
+    return Diagnostics(canal, ouvr, rules=[ContrePenteRule()]).run_selected_only()
+
+
+def test_contre_pente_registered():
+    assert any(isinstance(r, ContrePenteRule) for r in RULES)
+
+
+def test_contre_pente_on_selected_edges(table_of):
+    rows = [
+        (1, "a", "b", 10.0, 9.5),       # pente normale
+        (2, "b", "c", "8,20", "8.75"),  # contre-pente (virgule décimale)
+        (3, "c", "d", None, 3.0),       # cote manquante
+        (4, "d", "e", 1.0, 2.0),        # contre-pente hors sélection
+    ]
+    res = _run(table_of, CANAL, rows, [1, 2, 3])
+    assert res["CONTRE_PENTES"] == [(2, "Contre-pente : cote amont 8.20 < cote aval 8.75", 2)]
+
+
+def test_contre_pente_skipped_without_z_columns(table_of):
+    res = _run(table_of, ["idnini", "idnterm"], [(1, "a", "b")], [1])
+    assert res == {"CONTRE_PENTES": []}
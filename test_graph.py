@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""Tests du graphe compact canal + fossé (core/graph.py)."""
+
+import random
+
+from cheminer_indus.core.graph import LAYER_CANAL, NetworkGraph
+from cheminer_indus.core.reachability import get_condensation
+
+# Réseau :  a → b → d → e,  c → d,  x → INCONNU (hors graphe)
+ROWS = [
+    (1, "a", "b", 10.0, "EU"),
+    (2, "b", "d", 5.0, "EU"),
+    (3, "c", "d", 2.0, "EP"),
+    (4, "d", "e", 1.0, "EU"),
+    (5, "x", "INCONNU", 1.0, "EU"),
+]
+
+
+def _names(g, nodes):
+    return {g.node_ids[n] for n in nodes}
+
+
+def _fids(g, edges):
+    return sorted(g.edge_fid[e] for e in edges)
+
+
+def test_build_excludes_inconnu(graph_of):
+    g = graph_of(ROWS)
+    assert g.edge_count == 4
+    assert g.unknown_edges == [(LAYER_CANAL, 5)]
+    assert _fids(g, range(g.edge_count)) == [1, 2, 3, 4]
+
+
+def test_walk_directions(graph_of):
+    g = graph_of(ROWS)
+    edges, nodes = g.walk([g.node("b")], downstream=True)
+    assert _fids(g, edges) == [2, 4]
+    assert _names(g, nodes) == {"b", "d", "e"}
+
+    edges, nodes = g.walk([g.node("d")], downstream=False)
+    assert _fids(g, edges) == [1, 2, 3]
+    assert _names(g, nodes) == {"a", "b", "c", "d"}
+
+
+def test_incremental_updates_and_journal(layer_of):
+    layer = layer_of(ROWS)
+    g = NetworkGraph.from_layers(layer)
+    v0 = g.version
+
+    e = g.remove_feature(LAYER_CANAL, 2)
+    assert g.edge_dead[e]
+    assert g.node("b") >= 0 and not g.walk([g.node("b")], downstream=True)[0]
+
+    layer.features[6] = layer_of([(6, "b", "e", 3.0, "EU")]).features[6]
+    new = g.add_feature(LAYER_CANAL, layer.features[6])
+    edges, _ = g.walk([g.node("b")], downstream=True)
+    assert _fids(g, edges) == [6]
+    assert g.changed_edges_since(v0) == {e, new}
+    assert g.changed_edges_since(g.version) == set()
+
+
+def test_walk_owners(graph_of):
+    g = graph_of(ROWS)
+    owners = []
+    edges, _ = g.walk([g.node("a"), g.node("c")], downstream=True, owners=owners)
+    by_fid = dict(zip((g.edge_fid[e] for e in edges), owners))
+    assert by_fid[1] == 0 and by_fid[3] == 1
+
+
+def test_path_between(graph_of):
+    g = graph_of(ROWS)
+    res = g.path_between(g.node("a"), g.node("e"))
+    assert _fids(g, res.edges) == [1, 2, 4]
+    assert [g.edge_fid[e] for e in res.shortest] == [1, 2, 4]
+    assert res.length == 16.0
+
+    assert _fids(g, g.path_between(None, g.node("d")).edges) == [1, 2, 3]
+    assert g.path_between(g.node("c"), g.node("a")).length < 0
+
+
+def test_path_between_random_against_brute_force(graph_of):
+    rnd = random.Random(7)
+    for _ in range(100):
+        n = rnd.randint(2, 12)
+        g = graph_of([(i, "n%d" % rnd.randrange(n), "n%d" % rnd.randrange(n), rnd.randint(1, 9))
+                      for i in range(1, rnd.randint(2, 30))])
+        a, b = rnd.randrange(g.node_count), rnd.randrange(g.node_count)
+
+        def reach(start, forward):
+            seen, stack = {start}, [start]
+            while stack:
+                v = stack.pop()
+                for e in range(g.edge_count):
+                    u, w = (g.edge_src[e], g.edge_dst[e]) if forward else (g.edge_dst[e], g.edge_src[e])
+                    if u == v and w not in seen:
+                        seen.add(w)
+                        stack.append(w)
+            return seen
+
+        ahead, back = reach(a, True), reach(b, False)
+        expected = set()
+        if b in ahead:
+            expected = {e for e in range(g.edge_count)
+                        if g.edge_src[e] in ahead and g.edge_dst[e] in back}
+        assert set(g.path_between(a, b).edges) == expected
+
+
+def test_walk_category_filter(graph_of):
+    g = graph_of(ROWS)
+    edges, _ = g.walk([g.node("d")], downstream=False, cat_code=g.filter_code("cat", "EU"))
+    assert _fids(g, edges) == [1, 2]
+
+
+def test_frozen_copy_is_independent_and_keeps_derived(graph_of):
+    g = graph_of(ROWS)
+    cond = get_condensation(g)
+    g._derived["tuple"] = (g.version, "value")
+    g._derived["old"] = (g.version - 1, "value")
+
+    f = g.frozen()
+    assert f.uid == g.uid and f.version == g.version
+    assert f._derived["tuple"] == (g.version, "value")
+    assert "old" not in f._derived
+    copied = get_condensation(f)
+    assert copied is not cond and copied.graph is f and not copied.stale
+
+    g.remove_feature(LAYER_CANAL, 1)
+    assert f.edge_dead == bytearray(f.edge_count)
+    assert _fids(f, f.walk([f.node("d")], downstream=False)[0]) == [1, 2, 3]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""Tests de l'instantané disque du graphe (core/graph_snapshot.py)."""
+
+import os
+
+from cheminer_indus.core.graph_snapshot import (
+    close_snapshot, load_snapshot, purge_snapshots, save_snapshot, snapshot_path,
+)
+
+ROWS = [(1, "a", "b\nbis", 2.0, "EU"), (2, "b\nbis", "é", 3.0, "EP"), (3, "", "é")]
+
+
+def test_round_trip_keeps_node_ids(graph_of, tmp_path):
+    g = graph_of(ROWS)
+    path = snapshot_path("k" * 40, "tag", str(tmp_path))
+    save_snapshot(g, path, "k" * 40)
+    assert load_snapshot(path, "other") is None
+
+    s = load_snapshot(path, "k" * 40)
+    assert s.node_ids == g.node_ids and s.node_index == g.node_index
+    assert list(s.edge_fid) == list(g.edge_fid)
+    edges, _ = s.walk([s.node("a")], downstream=True)
+    assert sorted(s.edge_fid[e] for e in edges) == [1, 2]
+    close_snapshot(s)
+
+
+def test_purge_keeps_other_sources(graph_of, tmp_path):
+    g = graph_of(ROWS)
+    old, other, keep = (snapshot_path(k * 16, tag, str(tmp_path))
+                        for k, tag in (("1", "aaaa"), ("2", "bbbb"), ("3", "aaaa")))
+    legacy = os.path.join(str(tmp_path), "graph_" + "4" * 16 + ".bin")
+    for p in (old, other, keep, legacy):
+        save_snapshot(g, p)
+    purge_snapshots(str(tmp_path), keep)
+    assert sorted(os.listdir(str(tmp_path))) == sorted(os.path.basename(p) for p in (other, keep))
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""Tests de l'index des liaisons industrielles (core/industrials.py)."""
+
+import random
+
+from cheminer_indus.core.industrials import IndustrialsService, LiaisonIndex
+
+LIAISON = ["id_ouvrage", "id_industriel", "commentaire"]
+
+
+def _liaison(table_of, fid, node, ind):
+    return table_of(LIAISON, [(fid, node, ind, "")]).features[fid]
+
+
+def _same(a, b):
+    assert {n: sorted(f) for n, f in a.node_liaisons.items()} == \
+           {n: sorted(f) for n, f in b.node_liaisons.items()}
+    assert a.liaison_indus == b.liaison_indus
+
+
+def test_liaison_edits_patch_the_index(table_of):
+    rnd = random.Random(2)
+    value = lambda: rnd.choice(["n1", " n2 ", "n3", "", "INCONNU", None])
+    liaison = table_of(LIAISON, [(fid, value(), rnd.choice(["I1", "I2", ""]), "")
+                                 for fid in range(1, 20)], "liaison")
+    svc = IndustrialsService(table_of(["id"], [(1, "I1"), (2, "I2")], "indus"), liaison)
+    index = svc.index
+    next_fid = -1
+    for _ in range(60):
+        choice, fids = rnd.random(), list(liaison.features)
+        if choice < 0.25 and fids:
+            fid = rnd.choice(fids)
+            del liaison.features[fid]
+            liaison.featureDeleted.emit(fid)
+        elif choice < 0.5:
+            liaison.features[next_fid] = _liaison(table_of, next_fid, value(), "I2")
+            liaison.featureAdded.emit(next_fid)
+            next_fid -= 1
+        elif fids:
+            fid = rnd.choice(fids)
+            field = rnd.randrange(len(LIAISON))
+            liaison.features[fid]._attrs[LIAISON[field]] = value()
+            liaison.attributeValueChanged.emit(fid, field, None)
+        assert svc._index is index
+        _same(index, LiaisonIndex(liaison, None))
+
+    # validation : les FIDs temporaires deviennent définitifs
+    committed = []
+    for fid in [fid for fid in liaison.features if fid < 0]:
+        f = liaison.features.pop(fid)
+        liaison.features[1000 - fid] = _liaison(table_of, 1000 - fid, f["id_ouvrage"], f["id_industriel"])
+        committed.append(liaison.features[1000 - fid])
+    liaison.committedFeaturesAdded.emit(liaison.id(), committed)
+    _same(index, LiaisonIndex(liaison, None))
+
+    liaison.afterRollBack.emit()
+    assert svc._index is None
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""Tests de l'accessibilité amont et des boucles (core/reachability.py)."""
+
+import random
+
+import pytest
+
+from cheminer_indus.core.reachability import (
+    ReachabilityIndex, get_condensation, reached_loops, strongly_connected,
+)
+
+
+def _random_graph(graph_of, rnd, mesh=0.2):
+    """Réseau majoritairement arborescent (vers les petits numéros), avec maillage / boucles."""
+    n = rnd.randint(2, 25)
+    rows = []
+    for fid in range(1, rnd.randint(2, 45)):
+        a, b = rnd.randrange(n), rnd.randrange(n)
+        if rnd.random() > mesh and a < b:
+            a, b = b, a
+        rows.append((fid, "n%d" % a, "n%d" % b))
+    return graph_of(rows)
+
+
+def _downstream_sets(g):
+    adj = {}
+    for e in range(g.edge_count):
+        if g.edge_src[e] >= 0 and g.edge_dst[e] >= 0 and not g.edge_dead[e]:
+            adj.setdefault(g.edge_src[e], set()).add(g.edge_dst[e])
+    out = {}
+    for a in range(g.node_count):
+        seen, stack = set(), [a]
+        while stack:
+            for w in adj.get(stack.pop(), ()):
+                if w not in seen:
+                    seen.add(w)
+                    stack.append(w)
+        out[a] = seen
+    return out
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_index_matches_brute_force(graph_of, seed):
+    rnd = random.Random(seed)
+    for _ in range(60):
+        g = _random_graph(graph_of, rnd)
+        idx = ReachabilityIndex(g)
+        down = _downstream_sets(g)
+        for b in range(g.node_count):
+            up = {a for a in range(g.node_count) if a != b and b in down[a]}
+            assert idx.upstream_count(b) == len(up)
+            listed = list(idx.iter_upstream(b))
+            assert len(listed) == len(set(listed)) and set(listed) == up
+            for a in range(g.node_count):
+                assert idx.is_upstream(a, b) == (a in up)
+
+
+def test_components_numbered_downstream_first(graph_of):
+    rnd = random.Random(11)
+    for _ in range(50):
+        g = _random_graph(graph_of, rnd, mesh=0.4)
+        comp, count = strongly_connected(g)
+        assert sorted(set(comp)) == list(range(count))
+        down = _downstream_sets(g)
+        for e in range(g.edge_count):
+            u, v = g.edge_src[e], g.edge_dst[e]
+            if comp[u] != comp[v]:
+                assert comp[v] < comp[u]
+            else:
+                assert u == v or (v in down[u] and u in down[v])
+
+
+def test_condensation_cached_until_edit(graph_of):
+    g = graph_of([(1, "a", "b"), (2, "b", "c")])
+    cond = get_condensation(g)
+    assert get_condensation(g) is cond
+    g.remove_feature(0, 1)
+    assert cond.stale and get_condensation(g) is not cond
+
+
+def test_roots_limit_numbering(graph_of):
+    g = graph_of([(1, "a", "b"), (2, "b", "a"), (3, "c", "d")])
+    comp, _ = strongly_connected(g, roots=[g.node("a")])
+    assert comp[g.node("a")] == comp[g.node("b")] >= 0
+    assert comp[g.node("c")] == comp[g.node("d")] == -1
+
+
+def test_reached_loops_match_condensation(graph_of):
+    rnd = random.Random(5)
+    for _ in range(80):
+        g = _random_graph(graph_of, rnd, mesh=0.5)
+        cond = get_condensation(g)
+        start = rnd.randrange(g.node_count)
+        edges, nodes = g.walk([start], downstream=rnd.random() < 0.5)
+
+        reached = set(nodes)
+        self_loops = {g.edge_src[e] for e in range(g.edge_count) if g.edge_src[e] == g.edge_dst[e]}
+        expected = {tuple(sorted(cond.members(c))) for c in range(cond.comp_count)
+                    if (len(cond.members(c)) > 1 or self_loops.intersection(cond.members(c)))
+                    and reached.intersection(cond.members(c))}
+        loops = reached_loops(g, edges, nodes)
+        assert {tuple(members) for members, _ in loops} == expected
+        for members, inner in loops:
+            assert all(g.edge_src[e] in members and g.edge_dst[e] in members for e in inner)
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""Tests de l'index de segments pour l'accrochage des points (core/segment_index.py)."""
+
+import math
+import random
+
+import pytest
+
+from cheminer_indus.core.graph import LAYER_CANAL, NetworkGraph
+from cheminer_indus.core.segment_index import SegmentIndex, get_segment_index, grid_cells
+
+
+@pytest.mark.parametrize("cell", [1.0, 3.7, 10.0])
+def test_grid_cells_cover_segment_contiguously(cell):
+    rnd = random.Random(int(cell * 10))
+    for _ in range(400):
+        x0, y0, x1, y1 = (rnd.uniform(-30, 30) for _ in range(4))
+        if rnd.random() < 0.2:
+            x1 = x0
+        if rnd.random() < 0.2:
+            x0, y0, x1, y1 = (float(round(v)) for v in (x0, y0, x1, y1))
+        cells = list(grid_cells(x0, y0, x1, y1, cell))
+        assert cells[0] == (math.floor(x0 / cell), math.floor(y0 / cell))
+        assert cells[-1] == (math.floor(x1 / cell), math.floor(y1 / cell))
+        assert len(set(cells)) == len(cells)
+        for (i, j), (k, m) in zip(cells, cells[1:]):
+            assert abs(i - k) + abs(j - m) == 1
+        # tout point du segment est dans (ou sur le bord d') une cellule inscrite
+        found = set(cells)
+        for step in range(201):
+            t = step / 200
+            x, y = x0 + t * (x1 - x0), y0 + t * (y1 - y0)
+            cols = {math.floor(x / cell), math.ceil(x / cell) - 1}
+            rows = {math.floor(y / cell), math.ceil(y / cell) - 1}
+            assert any((i, j) in found for i in cols for j in rows)
+
+
+def _polyline(rnd):
+    x, y = rnd.uniform(0, 500), rnd.uniform(0, 500)
+    pts = [(x, y)]
+    for _ in range(rnd.randint(1, 4)):
+        x += rnd.uniform(-40, 40)
+        y += rnd.uniform(-40, 40)
+        pts.append((x, y))
+    return pts
+
+
+def _row(rnd, fid):
+    return (fid, "n%d" % rnd.randrange(30), "n%d" % rnd.randrange(30), 1.0, "", _polyline(rnd))
+
+
+def _distance(px, py, pts):
+    best = float("inf")
+    for (ax, ay), (bx, by) in zip(pts, pts[1:]):
+        dx, dy = bx - ax, by - ay
+        len2 = dx * dx + dy * dy
+        t = min(max(((px - ax) * dx + (py - ay) * dy) / len2, 0.0), 1.0) if len2 else 0.0
+        best = min(best, math.hypot(ax + t * dx - px, ay + t * dy - py))
+    return best
+
+
+def test_nearest_matches_brute_force(graph_of):
+    rnd = random.Random(3)
+    rows = [_row(rnd, fid) for fid in range(1, 60)]
+    g = graph_of(rows)
+    idx = SegmentIndex(g)
+    for _ in range(200):
+        x, y = rnd.uniform(-50, 550), rnd.uniform(-50, 550)
+        dist = {row[0]: _distance(x, y, row[5]) for row in rows}
+        snap = idx.nearest(x, y)
+        assert snap.distance == pytest.approx(min(dist.values()))
+        assert dist[snap.fid] == pytest.approx(snap.distance)
+        assert 0.0 <= snap.fraction <= 1.0
+        if snap.distance > 20.0:
+            assert idx.nearest(x, y, max_distance=snap.distance / 2) is None
+
+
+def test_nearest_many_matches_nearest(graph_of):
+    rnd = random.Random(8)
+    g = graph_of([_row(rnd, fid) for fid in range(1, 40)])
+    idx = SegmentIndex(g)
+    points = [(rnd.uniform(-50, 550), rnd.uniform(-50, 550)) for _ in range(100)]
+    for max_distance in (15.0, float("inf")):
+        many = idx.nearest_many(points, max_distance)
+        single = [idx.nearest(x, y, max_distance) for x, y in points]
+        assert [(r.edge, round(r.distance, 9)) if r else None for r in many] == \
+               [(r.edge, round(r.distance, 9)) if r else None for r in single]
+
+
+def test_incremental_update_matches_fresh_index(layer_of):
+    rnd = random.Random(4)
+    layer = layer_of([_row(rnd, fid) for fid in range(1, 50)])
+    g = NetworkGraph.from_layers(layer)
+    idx = get_segment_index(g)
+    next_fid = 1000
+    for _ in range(8):
+        for _ in range(rnd.randint(1, 4)):
+            choice, fids = rnd.random(), list(layer.features)
+            if choice < 0.3:
+                fid = rnd.choice(fids)
+                del layer.features[fid]
+                g.remove_feature(LAYER_CANAL, fid)
+            elif choice < 0.6:
+                next_fid += 1
+                layer.features[next_fid] = layer_of([_row(rnd, next_fid)]).features[next_fid]
+                g.add_feature(LAYER_CANAL, layer.features[next_fid])
+            else:
+                fid = rnd.choice(fids)
+                old = layer.features[fid]
+                row = (fid, old["idnini"], old["idnterm"], 1.0, "", _polyline(rnd))
+                layer.features[fid] = layer_of([row]).features[fid]
+                g.refresh_feature(LAYER_CANAL, fid)
+        idx = get_segment_index(g)
+        assert not idx.stale
+        fresh = SegmentIndex(g, cell_size=idx.cell)
+        for _ in range(50):
+            x, y = rnd.uniform(-50, 550), rnd.uniform(-50, 550)
+            a, b = idx.nearest(x, y), fresh.nearest(x, y)
+            assert (a.fid, round(a.distance, 9)) == (b.fid, round(b.distance, 9))
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Tests du cache LRU des cheminements (core/trace_cache.py)."""
+
+import threading
+from array import array
+from types import SimpleNamespace
+
+from cheminer_indus.core.trace_cache import CachedTrace, TraceCache
+
+
+def _trace(n=0):
+    return CachedTrace(array("q", range(n)), array("q"), array("i"), {}, [])
+
+
+def _key(uid=1, start="a", version=0):
+    return TraceCache.key(SimpleNamespace(uid=uid, version=version), (start,), True, None, None)
+
+
+def test_hit_and_miss_counters():
+    cache = TraceCache()
+    assert cache.get(_key()) is None
+    value = _trace(3)
+    cache.put(_key(), value)
+    assert cache.get(_key()) is value
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_lru_eviction_by_bytes():
+    size = _trace(10).nbytes()
+    cache = TraceCache(max_bytes=2 * size)
+    cache.put(_key(start="a"), _trace(10))
+    cache.put(_key(start="b"), _trace(10))
+    cache.get(_key(start="a"))                 # « a » devient le plus récent
+    cache.put(_key(start="c"), _trace(10))
+    assert cache.get(_key(start="b")) is None
+    assert cache.get(_key(start="a")) is not None
+    assert len(cache) == 2 and cache.bytes == 2 * size
+
+    cache.resize(size)
+    assert len(cache) == 1 and cache.get(_key(start="a")) is not None
+
+
+def test_oversized_entry_not_stored():
+    cache = TraceCache(max_bytes=10)
+    cache.put(_key(), _trace(100))
+    assert len(cache) == 0 and cache.bytes == 0
+
+
+def test_newer_version_purges_older_entries_of_same_graph():
+    cache = TraceCache()
+    cache.put(_key(uid=1, start="a", version=0), _trace())
+    cache.put(_key(uid=2, start="a", version=0), _trace())
+    cache.put(_key(uid=1, start="b", version=1), _trace())
+    assert cache.get(_key(uid=1, start="a", version=0)) is None
+    assert cache.get(_key(uid=2, start="a", version=0)) is not None
+    assert len(cache) == 2
+
+    cache.clear()
+    assert len(cache) == 0 and cache.bytes == 0
+
+
+def test_concurrent_access_keeps_accounting_consistent():
+    size = _trace(5).nbytes()
+    cache = TraceCache(max_bytes=20 * size)
+
+    def worker(w):
+        for i in range(300):
+            key = _key(uid=w % 2, start="n%d" % (i % 40), version=i // 100)
+            if cache.get(key) is None:
+                cache.put(key, _trace(5))
+
+    threads = [threading.Thread(target=worker, args=(w,)) for w in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert cache.bytes == len(cache) * size <= cache.max_bytes
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Tests de la suggestion de regards par dichotomie (core/visit_planner.py)."""
+
+import random
+
+import pytest
+
+from cheminer_indus.core.visit_planner import suggest_visits
+
+
+def _all(g):
+    return bytearray(b"\x01" * g.edge_count)
+
+
+def test_chain_best_cut_in_the_middle(graph_of):
+    # n4 → n3 → n2 → n1 → n0, tronçons de longueur 1
+    g = graph_of([(i, "n%d" % i, "n%d" % (i - 1)) for i in range(1, 5)])
+    out = suggest_visits(g, _all(g), limit=0)
+    assert out[0].node == "n2"
+    assert (out[0].upstream, out[0].total, out[0].balance) == (2.0, 4.0, 0.5)
+    by_node = {s.node: s.upstream for s in out}
+    assert by_node == {"n0": 4.0, "n1": 3.0, "n2": 2.0, "n3": 1.0, "n4": 0.0}
+
+
+def test_exclude_limit_and_mask(graph_of):
+    g = graph_of([(i, "n%d" % i, "n%d" % (i - 1)) for i in range(1, 5)])
+    assert [s.node for s in suggest_visits(g, _all(g), exclude=[" n2 "], limit=2)] == ["n1", "n3"]
+
+    mask = bytearray(g.edge_count)
+    mask[g.fid_index(0)[1]] = 1
+    assert {s.node for s in suggest_visits(g, mask, limit=0)} == {"n0", "n1"}
+    assert suggest_visits(g, bytearray(g.edge_count)) == []
+
+
+def test_node_weight_scales_upstream_edges(graph_of):
+    g = graph_of([(1, "a", "c"), (2, "b", "c")])
+    out = {s.node: s for s in suggest_visits(g, _all(g), node_weight={"a": 3.0}, limit=0)}
+    assert out["c"].total == 4.0
+    assert out["a"].upstream == 0.0 and out["c"].upstream == 4.0
+
+
+def test_loop_members_share_upstream_mass(graph_of):
+    g = graph_of([(1, "a", "b"), (2, "b", "a"), (3, "b", "c")])
+    out = {s.node: s.upstream for s in suggest_visits(g, _all(g), limit=0)}
+    assert out["a"] == out["b"] == 2.0 and out["c"] == 3.0
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_tree_upstream_mass_matches_brute_force(graph_of, seed):
+    rnd = random.Random(seed)
+    for _ in range(40):
+        n = rnd.randint(2, 30)
+        rows = [(i, "n%d" % i, "n%d" % rnd.randrange(i), rnd.randint(1, 9)) for i in range(1, n)]
+        g = graph_of(rows)
+        mask = bytearray(rnd.random() < 0.8 for _ in range(g.edge_count))
+        edges = [e for e in range(g.edge_count) if mask[e]]
+        total = float(sum(g.edge_length[e] for e in edges))
+        out = suggest_visits(g, mask, limit=0)
+        if not total:
+            assert out == []
+            continue
+
+        def reaches(u, v):
+            while u != v:
+                nxt = [g.edge_dst[e] for e in edges if g.edge_src[e] == u]
+                if not nxt:
+                    return False
+                u = nxt[0]
+            return True
+
+        for s in out:
+            v = g.node(s.node)
+            expected = sum(g.edge_length[e] for e in edges if reaches(g.edge_dst[e], v))
+            assert s.upstream == pytest.approx(expected)
+            assert s.balance == pytest.approx(min(expected, total - expected) / total)
+        balances = [s.balance for s in out]
+        assert balances == sorted(balances, reverse=True)
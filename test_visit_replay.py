@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""Tests du rejeu des visites (core/visit_replay.py)."""
+
+import random
+
+import pytest
+
+from cheminer_indus.core.visit_replay import replay_visits
+
+# Écoulement vers S :  w1 → u1 → v,  w2 → u2 → v,  v → S,  z → S
+ROWS = [
+    (1, "v", "S"), (2, "z", "S"),
+    (3, "u1", "v"), (4, "u2", "v"),
+    (5, "w1", "u1"), (6, "w2", "u2"),
+]
+
+
+def _fids(g, edges):
+    return sorted(g.edge_fid[e] for e in edges)
+
+
+def test_no_visit_keeps_everything(graph_of):
+    g = graph_of(ROWS)
+    res = replay_visits(g, "S", [])
+    assert res.canal_fids == [1, 2, 3, 4, 5, 6] and res.removed == []
+
+
+def test_clean_visit_removes_whole_upstream(graph_of):
+    g = graph_of(ROWS)
+    res = replay_visits(g, "S", [{"id": "v", "pollution": False}])
+    assert res.canal_fids == [1, 2]
+    assert _fids(g, res.removed) == [3, 4, 5, 6]
+
+
+def test_polluted_visit_keeps_chosen_branches_only(graph_of):
+    g = graph_of(ROWS)
+    res = replay_visits(g, "S", [{"id": "v", "pollution": True, "keep": ["u1"]}])
+    assert res.canal_fids == [3, 5]
+    assert {g.node_ids[n] for n in res.nodes} == {"w1", "u1", "v"}
+
+    res = replay_visits(g, "S", [{"id": "v", "pollution": True}])
+    assert res.canal_fids == [3, 4, 5, 6]
+
+
+def test_edge_mask_limits_result(graph_of):
+    g = graph_of(ROWS)
+    mask = g.mask_from_fids([1, 3, 5])
+    res = replay_visits(g, "S", [{"id": "u1", "pollution": False}], mask)
+    assert res.canal_fids == [1, 3] and _fids(g, res.removed) == [5]
+
+
+def _random_tree(graph_of, rnd):
+    n = rnd.randint(3, 25)
+    return graph_of([(i, "n%d" % i, "n%d" % rnd.randrange(i)) for i in range(1, n)]), n
+
+
+def _random_visit(rnd, g, n):
+    v = "n%d" % rnd.randrange(n)
+    visit = {"id": v, "pollution": rnd.random() < 0.5}
+    ups = [g.node_ids[g.edge_src[e]] for e in g.in_edges(g.node(v))]
+    if visit["pollution"] and ups and rnd.random() < 0.7:
+        visit["keep"] = [u for u in ups if rnd.random() < 0.5]
+    return visit
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_tree_replay_matches_successive_visits_in_any_order(graph_of, seed):
+    rnd = random.Random(seed)
+    for _ in range(60):
+        g, n = _random_tree(graph_of, rnd)
+        visits = [_random_visit(rnd, g, n) for _ in range(rnd.randint(1, 4))]
+
+        together = replay_visits(g, "n0", visits).edges
+        shuffled = visits[:]
+        rnd.shuffle(shuffled)
+        assert replay_visits(g, "n0", shuffled).edges == together
+
+        mask = None
+        for v in visits:
+            mask = g.mask_from_fids(replay_visits(g, "n0", [v], mask).canal_fids)
+        assert [e for e in range(g.edge_count) if mask[e]] == together
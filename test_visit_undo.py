@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""Tests des deltas d'annulation / rétablissement des visites (gui/main_dock_optimized.py)."""
+
+import json
+import random
+
+import pytest
+
+from cheminer_indus.gui.main_dock_optimized import OptimizedNodeOps
+
+# Écoulement vers S :  w1 → u1 → v,  w2 → u2 → v,  v → S
+CANAL = [(1, "v", "S"), (3, "u1", "v"), (4, "u2", "v"), (5, "w1", "u1"), (6, "w2", "u2")]
+FOSSE = [(1, "z", "S")]
+LIAISONS = [(11, "u1", "I1"), (12, "w2", "I2"), (13, "v", "I3")]
+INDUS = [(1, "I1"), (2, "I2"), (3, "I3")]
+
+
+@pytest.fixture
+def ops_of(layer_of, table_of):
+    """Opérations de visite sur des couches entièrement sélectionnées : (ops, couches)."""
+    def build(canal=CANAL, fosse=FOSSE, liaisons=LIAISONS, indus=INDUS):
+        layers = (
+            layer_of(canal, "canal"),
+            layer_of(fosse, "fosse"),
+            table_of(["id_ouvrage", "id_industriel"], liaisons, "liaison"),
+            table_of(["id"], indus, "indus"),
+        )
+        for layer in layers:
+            layer.selected = set(layer.features)
+        return OptimizedNodeOps(*layers), layers
+    return build
+
+
+def _branches(ops, node):
+    out = []
+    for typ, layer in (("canal", ops.canal_layer), ("fosse", ops.fosse_layer)):
+        for f in layer.features.values():
+            if f["idnterm"] == node and f["idnini"] != "INCONNU":
+                out.append((typ, f.id(), f["idnini"], None))
+    for f in ops.liaison_layer.features.values():
+        if f["id_ouvrage"] == node:
+            out.append(("liaison", f.id(), None, f["id_industriel"]))
+    return out
+
+
+def _selection(layers):
+    return [set(layer.selected) for layer in layers]
+
+
+def test_polluted_visit_delta_round_trip(ops_of):
+    ops, layers = ops_of()
+    before = _selection(layers)
+    delta = {}
+    removed = ops.visit_cleanup("v", _branches(ops, "v"), {3, 13}, True, "S", delta)
+    after = _selection(layers)
+
+    canal, fosse, liaison, indus = after
+    assert canal == {3, 5} and fosse == set()
+    assert liaison == {11, 13} and indus == {1, 3}
+    assert removed == {"I2"}
+    assert delta == {"canal": [1, 4, 6], "fosse": [1], "liaison": [12], "indus": [2]}
+
+    delta = json.loads(json.dumps(delta))   # delta tel qu'enregistré dans la session
+    ops.apply_visit_delta(delta, undo=True)
+    assert _selection(layers) == before
+    ops.apply_visit_delta(delta, undo=False)
+    assert _selection(layers) == after
+
+
+def test_clean_visit_removes_upstream_and_its_industrials(ops_of):
+    ops, layers = ops_of()
+    delta = {}
+    ops.visit_cleanup("v", _branches(ops, "v"), set(), False, "S", delta)
+    canal, fosse, liaison, indus = _selection(layers)
+    assert canal == {1} and fosse == {1}
+    # la liaison du regard lui-même est une branche non conservée
+    assert liaison == set() and indus == set()
+    assert delta["canal"] == [3, 4, 5, 6] and delta["liaison"] == [11, 12, 13]
+
+
+def test_random_deltas_undo_and_redo(ops_of):
+    rnd = random.Random(5)
+    for _ in range(80):
+        n = rnd.randint(3, 15)
+
+        def node():
+            return rnd.choice(["n%d" % rnd.randrange(n)] * 8 + ["INCONNU"])
+
+        canal = [(fid, node(), node(), rnd.randint(1, 9)) for fid in range(1, rnd.randint(3, 30))]
+        fosse = [(fid, node(), node()) for fid in range(1, rnd.randint(2, 8))]
+        liaisons = [(fid, "n%d" % rnd.randrange(n), "I%d" % rnd.randrange(5)) for fid in range(1, 7)]
+        ops, layers = ops_of(canal, fosse, liaisons, [(i, "I%d" % i) for i in range(5)])
+        for layer in layers[:2]:
+            layer.selected = {fid for fid in layer.features if rnd.random() < 0.7}
+
+        history = []
+        for _ in range(rnd.randint(1, 3)):
+            v = "n%d" % rnd.randrange(n)
+            branches = _branches(ops, v)
+            keep = {b[1] for b in branches if rnd.random() < 0.5}
+            before, delta = _selection(layers), {}
+            ops.visit_cleanup(v, branches, keep, rnd.random() < 0.6, "n%d" % rnd.randrange(n), delta)
+            history.append((before, delta, _selection(layers)))
+
+        for before, delta, after in reversed(history):
+            assert _selection(layers) == after
+            ops.apply_visit_delta(delta, undo=True)
+            assert _selection(layers) == before
+        for before, delta, after in history:
+            ops.apply_visit_delta(delta, undo=False)
+            assert _selection(layers) == after